@@ -0,0 +1,87 @@
+"""
+Сравнивает скорость get_file_hash с прежним чтением блоками по 64 КиБ на файлах разного размера.
+
+Запуск из директории репозитория:
+    python benchmarks/hashing.py [--repeat 5] [--dir /path/on/tested/disk]
+
+Файлы после первого прохода лежат в кеше ОС, поэтому измеряется цена системных вызовов,
+выделения памяти и самого blake2s, а не скорость диска.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from mediagarden.hashing import get_file_hash  # noqa: E402
+
+FILE_SIZES = {
+    '4 КиБ': (4 * 1024, 2000),
+    '256 КиБ': (256 * 1024, 200),
+    '4 МиБ': (4 * 1024 * 1024, 20),
+    '32 МиБ': (32 * 1024 * 1024, 4),
+    '256 МиБ': (256 * 1024 * 1024, 1),
+}
+
+
+def get_file_hash_by_64k_blocks(file_path):
+    BLOCKSIZE = 65536
+    hasher = hashlib.blake2s()
+    with open(file_path, 'rb') as afile:
+        buf = afile.read(BLOCKSIZE)
+        while len(buf) > 0:
+            hasher.update(buf)
+            buf = afile.read(BLOCKSIZE)
+
+    return hasher.hexdigest()
+
+
+def measure(func, file_paths, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for file_path in file_paths:
+            func(file_path)
+
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--dir', default=None, help='директория для временных файлов')
+    args = parser.parse_args()
+
+    print(f'{"Размер":>10} | {"Файлов":>6} | {"64 КиБ, МБ/с":>13} | {"get_file_hash, МБ/с":>20} | {"Ускорение":>9}')
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for title, (size, count) in FILE_SIZES.items():
+            file_paths = []
+            for index in range(count):
+                file_path = os.path.join(directory, f'{size}_{index}')
+                with open(file_path, 'wb') as afile:
+                    afile.write(os.urandom(size))
+
+                file_paths.append(file_path)
+
+            assert get_file_hash(file_paths[0]) == get_file_hash_by_64k_blocks(file_paths[0])
+            megabytes = size * count / 1_000_000
+            old_time = measure(get_file_hash_by_64k_blocks, file_paths, args.repeat)
+            new_time = measure(get_file_hash, file_paths, args.repeat)
+            print(
+                f'{title:>10} | {count:>6} | {megabytes / old_time:>13.1f} | '
+                f'{megabytes / new_time:>20.1f} | {old_time / new_time:>8.2f}x'
+            )
+
+            for file_path in file_paths:
+                os.remove(file_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Сравнивает работу с базой с профилем SQLite из настроек (WAL, synchronous=NORMAL и т.д.) и без него.
+
+Для каждого варианта во временной директории создаётся хранилище из --files файлов и новая база, затем:
+- сканирование: время полного scan_to_db;
+- GUI во время сканирования: пока сканер в своём потоке пишет в базу, основной поток, как главное окно,
+  выполняет запросы списка книг (count, поиск, первая страница) и привязывает теги к файлам.
+  Измеряются задержки этих запросов и число ошибок "database is locked".
+
+Запуск из директории репозитория:
+    python benchmarks/sqlite_profile.py [--files 5000] [--dir /path/on/tested/disk]
+
+Результат сильно зависит от диска: fsync на каждую транзакцию в режиме synchronous=FULL
+заметнее всего на HDD и сетевых дисках.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import OperationalError, connection, connections  # noqa: E402
+
+from common.models import Tag  # noqa: E402
+from mediagarden.models import AnyFile  # noqa: E402
+from mediagarden.scanner import LibraryStorage  # noqa: E402
+
+PROFILES = {
+    'без профиля': {},
+    'профиль': settings.DEFAULT_SQLITE_PROFILE,
+}
+
+
+def use_database(database_path, profile):
+    connections.close_all()
+    settings_dict = connection.settings_dict
+    settings_dict['NAME'] = database_path
+    settings_dict['OPTIONS'] = {
+        'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in profile.items()),
+    }
+    call_command('migrate', verbosity=0)
+
+
+def create_storage(directory, count_files):
+    for index in range(count_files):
+        subdirectory = os.path.join(directory, f'раздел_{index % 20}')
+        os.makedirs(subdirectory, exist_ok=True)
+        with open(os.path.join(subdirectory, f'книга_{index}.pdf'), 'wb') as afile:
+            afile.write(os.urandom(4096))
+
+
+def measure_gui(is_scanning, tag):
+    read_latencies, write_latencies = [], []
+    count_locked = 0
+    index = 0
+    while is_scanning.is_set():
+        index += 1
+        started = time.perf_counter()
+        try:
+            queryset = AnyFile.objects.filter(filename__contains=str(index % 10)).order_by('filename')
+            queryset.count()
+            list(queryset[:50])
+            read_latencies.append(time.perf_counter() - started)
+
+            anyfile = AnyFile.objects.order_by('?').first()
+            if anyfile:
+                started = time.perf_counter()
+                anyfile.tags.add(tag)
+                write_latencies.append(time.perf_counter() - started)
+        except OperationalError:
+            count_locked += 1
+
+        time.sleep(0.01)
+
+    return read_latencies, write_latencies, count_locked
+
+
+def format_latencies(latencies):
+    if not latencies:
+        return '-'
+
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95)]
+    return f'{statistics.median(latencies) * 1000:.1f} / {p95 * 1000:.1f} / {latencies[-1] * 1000:.1f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=5000)
+    parser.add_argument('--dir', default=None, help='директория для временного хранилища и базы')
+    args = parser.parse_args()
+
+    for title, profile in PROFILES.items():
+        with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+            storage = os.path.join(directory, 'books')
+            create_storage(storage, args.files)
+            settings.STORAGE_BOOKS = Path(storage)
+            use_database(os.path.join(directory, 'sqlite3.db'), profile)
+
+            started = time.perf_counter()
+            LibraryStorage().scan_to_db()
+            scan_time = time.perf_counter() - started
+
+            # Повторное полное сканирование переписывает каждую строку, пока GUI читает и пишет
+            tag = Tag.objects.create(code=AnyFile.CODE, name='тег')
+            is_scanning = threading.Event()
+            is_scanning.set()
+
+            def scan():
+                try:
+                    LibraryStorage().scan_to_db(is_incremental=False)
+                finally:
+                    connection.close()
+                    is_scanning.clear()
+
+            scanner_thread = threading.Thread(target=scan)
+            scanner_thread.start()
+            read_latencies, write_latencies, count_locked = measure_gui(is_scanning, tag)
+            scanner_thread.join()
+            connections.close_all()
+
+        print(f'{title}:')
+        print(f'  сканирование {args.files} файлов: {scan_time:.2f} с')
+        print(f'  чтение списка во время сканирования, мс (медиана / p95 / максимум): {format_latencies(read_latencies)}')
+        print(f'  привязка тега во время сканирования, мс (медиана / p95 / максимум): {format_latencies(write_latencies)}')
+        print(f'  ошибок "database is locked": {count_locked}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class CommonConfig(AppConfig):
+    name = 'common'
+
+    def ready(self):
+        # Модели всех приложений уже загружены: можно найти все модели с тегами
+        from common import tag_counters, tag_tree
+
+        # Дерево первым: недопустимый перенос тега отменяется до изменения счётчиков
+        tag_tree.connect_signals()
+        tag_counters.connect_signals()
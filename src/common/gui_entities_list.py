@@ -1,56 +1,109 @@
+from functools import lru_cache
+
 from PyQt6.QtWidgets import (
     QVBoxLayout, QHBoxLayout, QPushButton, QTableView, QHeaderView, QLabel, QDialog, QAbstractItemView, QWidget
 )
 from PyQt6.QtCore import QAbstractTableModel, Qt, QModelIndex, pyqtSignal
 
+from common.pagination import build_keyset_condition, get_key, get_keyset_order_fields
+
+
+@lru_cache(maxsize=None)
+def get_columns_info(dj_model, field_names):
+    """Заголовки столбцов и словари choices их полей: вычисляются один раз на модель, а не для каждой ячейки"""
+    headers, choices = [], []
+    for name in field_names:
+        dj_field = dj_model._meta.get_field(name)
+        headers.append('ID' if name == 'id' else dj_field.verbose_name.capitalize())
+        choices.append(dict(dj_field.choices) if dj_field.choices else None)
+
+    return headers, choices
+
 
 class DjangoTableModel(QAbstractTableModel):
+    """
+    Таблица сущностей, которая загружает строки порциями по BATCH_SIZE, по мере прокрутки (canFetchMore/fetchMore).
+    Значения хранятся по столбцам уже готовыми к показу строками, а от сущностей остаются только первичные ключи:
+    сама сущность загружается, когда её открывают или удаляют.
+    """
+    BATCH_SIZE = 200
+
     def __init__(self, dj_model, field_names, queryset=None, func_get_value=None):
         super().__init__()
         self.dj_model = dj_model
-        self.field_names = field_names
-        self._headers = []
-        self._data = []
-        self.entities = []
-        self.queryset = dj_model.objects if queryset is None else queryset 
+        self.field_names = list(field_names)
+        self._headers, self.choices = get_columns_info(dj_model, tuple(field_names))
+        queryset = dj_model.objects.all() if queryset is None else queryset.all()
+        if not queryset.ordered:
+            # Без сортировки порядок строк в порциях не определён
+            queryset = queryset.order_by('pk')
+
+        # Связанные сущности из столбцов загружаются тем же запросом, а не отдельным на каждую строку
+        dj_fields = [dj_model._meta.get_field(name) for name in self.field_names]
+        related_names = [dj_field.name for dj_field in dj_fields if dj_field.many_to_one or dj_field.one_to_one]
+        self.queryset = queryset.only(*self.field_names).select_related(*related_names)
+        self.order_fields = get_keyset_order_fields(self.queryset)
         self.func_get_value = func_get_value
-        for name in field_names:
-            if name == 'id':
-                self._headers.append('ID')
-            else:
-                self._headers.append(dj_model._meta.get_field(name).verbose_name.capitalize())
-
         self.refresh()
 
     def refresh(self):
         self.beginResetModel()
-        _data = self.queryset.only(*self.field_names)
-        self._data = []
-        self.entities = []
-        for entity in _data:
-            self.entities.append(entity)
-            row = []
-            for name in self.field_names:
+        self.columns = [[] for _ in self.field_names]
+        self.pks = []
+        self.last_key = None
+        self.is_fetched_all = False
+        self.append_entities(self.load_batch())
+        self.endResetModel()
+
+    def load_batch(self):
+        queryset = self.queryset
+        if self.order_fields is None:
+            entities = list(queryset[len(self.pks):len(self.pks) + self.BATCH_SIZE])
+        else:
+            # Следующая порция выбирается по ключу последней загруженной строки, а не через OFFSET
+            if self.last_key is not None:
+                queryset = queryset.filter(build_keyset_condition(self.order_fields, self.last_key))
+
+            entities = list(queryset[:self.BATCH_SIZE])
+            if entities:
+                self.last_key = get_key(entities[-1], self.order_fields)
+
+        self.is_fetched_all = len(entities) < self.BATCH_SIZE
+        return entities
+
+    def append_entities(self, entities):
+        for entity in entities:
+            self.pks.append(entity.pk)
+            for column, name, choices in zip(self.columns, self.field_names, self.choices):
                 value = getattr(entity, name)
-                dj_field = self.dj_model._meta.get_field(name)
-                if dj_field.choices:
-                    value = dict(dj_field.choices).get(value)
+                if choices:
+                    value = choices.get(value)
 
-                row.append(self.func_get_value(entity, name, value) if self.func_get_value else value)
+                column.append(str(self.func_get_value(entity, name, value) if self.func_get_value else value))
 
-            self._data.append(row)
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.is_fetched_all
 
-        self.endResetModel()
+    def fetchMore(self, parent=QModelIndex()):
+        entities = self.load_batch()
+        if entities:
+            count_rows = len(self.pks)
+            self.beginInsertRows(QModelIndex(), count_rows, count_rows + len(entities) - 1)
+            self.append_entities(entities)
+            self.endInsertRows()
+
+    def get_entity(self, row):
+        return self.dj_model.objects.get(pk=self.pks[row])
 
     def rowCount(self, parent=QModelIndex()):  # TODO: узнать, что это за аргумент parent
-        return len(self._data)
+        return 0 if parent.isValid() else len(self.pks)
 
     def columnCount(self, parent=QModelIndex()):
         return len(self.field_names)
     
     def data(self, index, role=Qt.ItemDataRole.DisplayRole):
         if role == Qt.ItemDataRole.DisplayRole:
-            return str(self._data[index.row()][index.column()])
+            return self.columns[index.column()][index.row()]
 
         return None
 
@@ -62,7 +115,7 @@ class DjangoTableModel(QAbstractTableModel):
 
 
 class EntitiesList(QWidget):
-    tag_count_changed = pyqtSignal(object)
+    tag_count_changed = pyqtSignal(object, int)
     signal_open_entity = pyqtSignal(object)
     signal_add_entity = pyqtSignal()
     signal_delete_entity = pyqtSignal(object)
@@ -96,7 +149,7 @@ class EntitiesList(QWidget):
         self.table.model().refresh()
     
     def open_edit_dialog(self, index):
-        entity = self.table.model().entities[index.row()]
+        entity = self.table.model().get_entity(index.row())
         self.signal_open_entity.emit(entity)
 
     def open_add_dialog(self):
@@ -106,10 +159,11 @@ class EntitiesList(QWidget):
         index = self.table.currentIndex()
         index_row = index.row()
         if index_row > -1:
-            entity = self.table.model().entities[index.row()]
+            entity = self.table.model().get_entity(index_row)
             self.signal_delete_entity.emit(entity)
 
-    def set_model(self, gui_model, *args):
+    def set_model(self, gui_model, *args, count=None, first_rows=None):
+        # count и first_rows посчитаны при поиске в главном окне, но модель таблицы загружает строки сама
         model = DjangoTableModel(gui_model.dj_model, gui_model.table_fields, *args)
         self.title_label.setText(str(gui_model.dj_model._meta.verbose_name_plural))
         self.table.setModel(model)
@@ -1,13 +1,15 @@
-from django.db.models import Q, Count
-
 from PyQt6.QtWidgets import QDialog
 from PyQt6.QtCore import pyqtSignal
 
+from common.search import build_search_condition
+from common.tag_tree import tagged_with
+
 
 class GUIEntity(QDialog):
     dj_model = None
     field_order = 'pk'
     fields_search = []
+    fts_table = None  # FTS5-таблица с триграммами по полям fields_search, если она есть
     actions_class = None
     table_class = None
     window_class = None
@@ -20,21 +22,15 @@ class GUIEntity(QDialog):
     def _build_queryset(self, tags=None, search=''):
         queryset = self.dj_model.objects
         if search and self.fields_search:
-            q_condition = None
-            for field_search in self.fields_search:
-                kwargs = {f'{field_search}__contains': search}
-                q_part = Q(**kwargs)
-                if q_condition is None:
-                    q_condition = q_part
-                else:
-                    q_condition |= q_part
-
-            queryset = queryset.filter(q_condition)
+            queryset = queryset.filter(build_search_condition(self.fields_search, search, self.fts_table))
         
         if tags:
-            queryset = queryset.filter(tags__pk__in=tags).annotate(Count('pk'))
+            # Отмеченный тег включает и все вложенные в него теги
+            queryset = queryset.filter(tagged_with(self.dj_model, tags))
 
         return queryset
 
     def select_rows(self, tags=None, search=''):
-        return self._build_queryset(tags, search).order_by(self.field_order)
+        # Первичный ключ делает порядок однозначным - на этом держится постраничная выборка списка
+        order_fields = [self.field_order] if self.field_order == 'pk' else [self.field_order, 'pk']
+        return self._build_queryset(tags, search).order_by(*order_fields)
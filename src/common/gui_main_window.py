@@ -4,6 +4,7 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtCore import Qt
 
 from common.gui_entity_types import EntityTypesWidget
+from common.gui_search import SearchController
 from common.gui_tags import TagsWidget
 
 
@@ -15,6 +16,9 @@ class MainWindow(QMainWindow):
         self.actions_widget = None
         self.table_widget = None
         self.current_gui_model = None
+        self.search_controller = SearchController(self.build_queryset, self.build_found_ids_queryset, self)
+        self.search_controller.found.connect(self.on_found)
+        QApplication.instance().aboutToQuit.connect(self.search_controller.stop)
 
         self.central_widget = QSplitter()
         self.setCentralWidget(self.central_widget)
@@ -57,7 +61,7 @@ class MainWindow(QMainWindow):
         lbl_search_title = QLabel('Найдено: ')
         self.lbl_search_count = QLabel()
 
-        self.field_search.textChanged.connect(self.update_table)
+        self.field_search.textChanged.connect(self.search_controller.schedule)
         btn_clear.clicked.connect(lambda: self.field_search.setText(''))
         btn_search.clicked.connect(self.update_table)
 
@@ -90,13 +94,27 @@ class MainWindow(QMainWindow):
             self.actions_widget = actions_class(self)
             self.actions_holder.addWidget(self.actions_widget)
 
-    def update_table(self):
-        queryset = self.current_gui_model().select_rows(
+    def build_queryset(self):
+        return self.current_gui_model().select_rows(
             self.tags_widget.checked_tags_id or None,
             self.field_search.text(),
         )
-        self.lbl_search_count.setText(str(queryset.count()))
-        self.table_widget.set_model(self.current_gui_model, queryset)
+
+    def build_found_ids_queryset(self):
+        # Дерево тегов считает, сколько найденного строкой поиска останется при отметке тега
+        search = self.field_search.text()
+        if not search:
+            return None
+
+        return self.current_gui_model().select_rows(None, search).order_by().values_list('pk', flat=True)
+
+    def update_table(self):
+        self.search_controller.search()
+
+    def on_found(self, queryset, count, first_rows, found_ids):
+        self.lbl_search_count.setText(str(count))
+        self.tags_widget.set_found_ids(found_ids)
+        self.table_widget.set_model(self.current_gui_model, queryset, count=count, first_rows=first_rows)
 
     def change_table(self, gui_model):
         self.current_gui_model = gui_model
@@ -0,0 +1,114 @@
+import threading
+
+from django.db import OperationalError, connection
+from PyQt6.QtCore import QObject, QThread, QTimer, Qt, pyqtSignal, pyqtSlot
+
+
+class SearchWorker(QObject):
+    """Выполняет запросы поиска в своём потоке, с отдельным подключением к базе"""
+    found = pyqtSignal(int, object, int, list, object)
+
+    def __init__(self):
+        super().__init__()
+        self.latest_generation = 0
+        self.raw_connection = None
+        self.lock = threading.Lock()
+
+    @pyqtSlot(int, object, int, object)
+    def run_query(self, generation, queryset, first_page_size, found_ids_queryset):
+        # Пока запрос стоял в очереди, мог прийти более новый - тогда этот уже не нужен
+        if generation != self.latest_generation:
+            return
+
+        try:
+            connection.ensure_connection()
+            with self.lock:
+                self.raw_connection = connection.connection
+
+            count = queryset.count()
+            first_rows = list(queryset[:first_page_size]) if generation == self.latest_generation else []
+            found_ids = None
+            if found_ids_queryset is not None and generation == self.latest_generation:
+                found_ids = list(found_ids_queryset)
+        except OperationalError as error:
+            # Прерванный через interrupt() запрос устарел, об этом сообщать не нужно
+            if generation == self.latest_generation:
+                print(error)
+
+            return
+        finally:
+            with self.lock:
+                self.raw_connection = None
+
+        if generation == self.latest_generation:
+            self.found.emit(generation, queryset, count, first_rows, found_ids)
+
+    def cancel(self, generation):
+        """Вызывается из основного потока: прерывает выполняемый запрос, если он старше generation"""
+        self.latest_generation = generation
+        with self.lock:
+            if self.raw_connection is not None:
+                self.raw_connection.interrupt()
+
+    @pyqtSlot()
+    def close_connection(self):
+        connection.close()
+
+
+class SearchController(QObject):
+    """
+    Поиск для главного окна без задержек интерфейса.
+    Ввод в поле поиска откладывается на DEBOUNCE_MS, количество найденного и первая страница
+    считаются в потоке SearchWorker. Каждый поиск получает номер поколения: с приходом нового
+    выполняемый запрос прерывается, а результаты устаревших поколений отбрасываются.
+    Если задана func_build_found_ids_queryset, в том же потоке выбираются и идентификаторы найденного
+    без учёта тегов (None, если функция вернула None).
+    """
+    DEBOUNCE_MS = 300
+    FIRST_PAGE_SIZE = 50
+    query_requested = pyqtSignal(int, object, int, object)
+    found = pyqtSignal(object, int, list, object)
+
+    def __init__(self, func_build_queryset, func_build_found_ids_queryset=None, parent=None):
+        super().__init__(parent)
+        self.func_build_queryset = func_build_queryset
+        self.func_build_found_ids_queryset = func_build_found_ids_queryset
+        self.generation = 0
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.DEBOUNCE_MS)
+        self.timer.timeout.connect(self.search)
+
+        self.worker = SearchWorker()
+        self.thread = QThread()
+        self.worker.moveToThread(self.thread)
+        self.query_requested.connect(self.worker.run_query)
+        self.worker.found.connect(self.on_found)
+        # finished испускается из самого потока, поэтому подключение к базе закрывается там, где было открыто
+        self.thread.finished.connect(self.worker.close_connection, Qt.ConnectionType.DirectConnection)
+        self.thread.start()
+
+    def schedule(self):
+        """Поиск после паузы во вводе"""
+        self.timer.start()
+
+    def search(self):
+        """Поиск сразу"""
+        self.timer.stop()
+        self.generation += 1
+        self.worker.cancel(self.generation)
+        # Построение queryset не обращается к базе, выполняется он уже в потоке
+        found_ids_queryset = self.func_build_found_ids_queryset() if self.func_build_found_ids_queryset else None
+        self.query_requested.emit(self.generation, self.func_build_queryset(), self.FIRST_PAGE_SIZE, found_ids_queryset)
+
+    def on_found(self, generation, queryset, count, first_rows, found_ids):
+        if generation == self.generation:
+            self.found.emit(queryset, count, first_rows, found_ids)
+
+    def stop(self):
+        self.timer.stop()
+        self.generation += 1
+        self.worker.cancel(self.generation)
+        self.thread.quit()
+        self.thread.wait()
@@ -1,5 +1,7 @@
+from collections import defaultdict
 from struct import pack, unpack
 
+from django.conf import settings
 from django.core.exceptions import FieldDoesNotExist
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QCheckBox,
@@ -9,8 +11,9 @@ from PyQt6.QtGui import QStandardItemModel, QStandardItem, QDrag
 from PyQt6.QtCore import Qt, QModelIndex, pyqtSignal, QMimeData
 
 from common.models import Tag
+from common.tag_index import TagIndex
 
-__all__ = ['TaggedWidget', 'TaggsWidget']
+__all__ = ['TaggedWidget', 'TagsWidget', 'get_dropped_tag']
 
 
 class DragableLabel(QLabel):
@@ -94,13 +97,20 @@ class TagsWidget(QWidget):
     column_index_name = 0
     column_index_checkbox = 1
     column_index_count = 2
+    column_index_count_if_checked = 3
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.dj_model = None
         layout = QVBoxLayout(self)
         self.rows = {}
+        self.counts = {}
+        self.subtree_counts = {}
         self.checked_tags_id = set()
+        self.found_ids = None  # найденное строкой поиска без учёта тегов, None - строки поиска нет
+        # Индексы тегов в памяти по моделям: строятся при первом показе тегов модели
+        self.tag_indexes = {}
+        self.tag_index = None
 
         # Tags tree
         tree_view = QTreeView()
@@ -122,6 +132,7 @@ class TagsWidget(QWidget):
         header.resizeSection(self.column_index_name, 200)
         header.resizeSection(self.column_index_checkbox, 20)
         header.resizeSection(self.column_index_count, 50)
+        header.resizeSection(self.column_index_count_if_checked, 60)
         header.setHidden(True)
 
         self.model = model
@@ -154,28 +165,46 @@ class TagsWidget(QWidget):
             else:
                 item.setText(dj_tag.name)
 
-    def build_tags(self, dj_model, parent_id=None, parent_row=None):
+    def build_tags(self, dj_model):
+        """
+        Строит дерево тегов одним запросом: количество сущностей хранится в самом теге (Tag.count_entities
+        и Tag.count_entities_in_subtree) и не требует подсчёта по промежуточной таблице. Дерево собирается в памяти.
+        Как и фильтр по отмеченным тегам, столбец количества учитывает вложенные теги.
+        """
         self.dj_model = dj_model
         try:
-            dj_field = dj_model._meta.get_field('tags')
+            dj_model._meta.get_field('tags')
         except FieldDoesNotExist:
             print(f'У django-модели {dj_model.__name__} должно быть поле "tags" для поддержки тегов')
             return
 
-        related_name = dj_field._related_name
-
-        parents = []
-        for dj_tag in Tag.objects.filter(parent_id=parent_id, code=self.dj_model.CODE):
-            entities = getattr(dj_tag, related_name)
-            row = [
-                QStandardItem(),
-                QStandardItem(),
-                QStandardItem(str(entities.count())),
-            ]
-            row[self.column_index_name].setData(dj_tag)
-            row[self.column_index_checkbox].setEditable(False)
-            row[self.column_index_count].setEditable(False)
-            parents.append((dj_tag.pk, row))
+        self.counts = {}
+        self.subtree_counts = {}
+        children = defaultdict(list)
+        for dj_tag in Tag.objects.filter(code=self.dj_model.CODE).order_by('pk'):
+            self.counts[dj_tag.pk] = dj_tag.count_entities
+            self.subtree_counts[dj_tag.pk] = dj_tag.count_entities_in_subtree
+            children[dj_tag.parent_id].append(dj_tag)
+
+        self.tag_index = None
+        if settings.TAG_INDEX:
+            if dj_model not in self.tag_indexes:
+                self.tag_indexes[dj_model] = TagIndex(dj_model)
+
+            self.tag_index = self.tag_indexes[dj_model]
+            # Например, после импорта CSV, который вставляет привязки тегов в обход сигналов
+            if self.tag_index.is_outdated:
+                self.tag_index.build()
+
+        self.model.removeRows(0, self.model.rowCount())
+        self.rows = {}
+        self.append_tags(children)
+        self.tree_view.expandAll()
+        self.update_counts_if_checked()
+
+    def append_tags(self, children, parent_id=None, parent_row=None):
+        for dj_tag in children[parent_id]:
+            row = self.create_row(dj_tag)
             if parent_row:
                 parent_row[self.column_index_name].appendRow(row)
             else:
@@ -183,17 +212,65 @@ class TagsWidget(QWidget):
 
             # self.tree_view.openPersistentEditor(row[self.column_index_name].index())
             self.tree_view.openPersistentEditor(row[self.column_index_checkbox].index())
-            self.rows[dj_tag.pk] = row
+            self.append_tags(children, dj_tag.pk, row)
 
-        for next_parent_id, row in parents:
-            self.build_tags(dj_model, next_parent_id, row)
-        
-        if parent_row is None:
-            self.tree_view.expandAll()
-    
-    def on_changed_count(self, dj_tag):
-        row = self.rows[dj_tag.pk]
-        row[self.column_index_count].setText(str(dj_tag.files.count()))
+    def create_row(self, dj_tag):
+        row = [
+            QStandardItem(),
+            QStandardItem(),
+            QStandardItem(),
+            QStandardItem(),
+        ]
+        row[self.column_index_name].setData(dj_tag)
+        row[self.column_index_checkbox].setEditable(False)
+        row[self.column_index_count].setEditable(False)
+        row[self.column_index_count_if_checked].setEditable(False)
+        self.rows[dj_tag.pk] = row
+        self.update_count(dj_tag.pk)
+        return row
+
+    def update_count(self, tag_id):
+        count = self.counts.get(tag_id, 0)
+        subtree_count = self.subtree_counts.get(tag_id, 0)
+        item = self.rows[tag_id][self.column_index_count]
+        item.setText(str(subtree_count))
+        item.setToolTip(f'С тегом: {count}, с тегом и вложенными в него тегами: {subtree_count}')
+
+    def on_changed_count(self, dj_tag, delta):
+        """
+        Тег привязали к сущности (delta=1) или отвязали от неё (delta=-1): счётчики тега
+        и счётчики поддерева у всех его предков меняются без запроса
+        """
+        self.counts[dj_tag.pk] = self.counts.get(dj_tag.pk, 0) + delta
+        item = self.rows[dj_tag.pk][self.column_index_name]
+        while item:
+            tag_id = item.data().pk
+            self.subtree_counts[tag_id] = self.subtree_counts.get(tag_id, 0) + delta
+            self.update_count(tag_id)
+            item = item.parent()
+
+        self.update_counts_if_checked()
+
+    def set_found_ids(self, found_ids):
+        self.found_ids = found_ids
+        self.update_counts_if_checked()
+
+    def update_counts_if_checked(self):
+        """
+        Для каждого неотмеченного тега показывает, сколько сущностей останется в списке, если его отметить.
+        Считается по индексу тегов в памяти и найденному строкой поиска, без запросов к базе
+        """
+        if not self.tag_index:
+            return
+
+        counts = self.tag_index.count_if_added(self.checked_tags_id, self.rows, self.found_ids)
+        for tag_id, row in self.rows.items():
+            item = row[self.column_index_count_if_checked]
+            if tag_id in self.checked_tags_id:
+                item.setText('')
+            else:
+                item.setText(f'→ {counts[tag_id]}')
+                item.setToolTip(f'Сущностей в списке, если отметить тег: {counts[tag_id]}')
 
     def get_selected_item(self) -> tuple[QStandardItem, int] | tuple[None, None]:
         indexes = self.tree_view.selectedIndexes()
@@ -205,11 +282,6 @@ class TagsWidget(QWidget):
 
     def action_add_tag(self):
         item, _ = self.get_selected_item()
-        row = [
-            QStandardItem(self.new_tag_name),
-            QStandardItem(),
-            QStandardItem('0'),
-        ]
         parent = None
         parent_tag_id = None
         if item:
@@ -219,22 +291,13 @@ class TagsWidget(QWidget):
 
         dj_tag = Tag(name=self.new_tag_name, parent_id=parent_tag_id, code=self.dj_model.CODE)
         dj_tag.save()
-        row[self.column_index_name].setData(dj_tag)
-        row[self.column_index_count].setEditable(False)
-        (parent or self.model).appendRow(row)
+        (parent or self.model).appendRow(self.create_row(dj_tag))
 
     def action_add_child_tag(self):
         item, _ = self.get_selected_item()
-        row = [
-            QStandardItem(self.new_tag_name),
-            QStandardItem(),
-            QStandardItem('0'),
-        ]
         dj_tag = Tag(name=self.new_tag_name, parent_id=item.data().pk if item else None, code=self.dj_model.CODE)
         dj_tag.save()
-        row[self.column_index_name].setData(dj_tag)
-        row[self.column_index_count].setEditable(False)
-        (item or self.model).appendRow(row)
+        (item or self.model).appendRow(self.create_row(dj_tag))
 
     def action_delete_tag(self):
         item, index_row = self.get_selected_item()
@@ -262,9 +325,20 @@ class TagsWidget(QWidget):
         else:
             self.checked_tags_id.remove(dj_tag.pk)
 
+        self.update_counts_if_checked()
         self.tag_status_changed.emit()
 
 
+def get_dropped_tag(mime_data: QMimeData):
+    """Возвращает тег, перетащенный из дерева тегов, или None, если перетащили что-то другое"""
+    data: bytearray = mime_data.data('application/x-tag-id')
+    if data:
+        tag_pk = unpack('I', data)[0]
+        dj_tag = Tag(pk=tag_pk)
+        dj_tag.refresh_from_db()
+        return dj_tag
+
+
 class TaggedWidget(QWidget):
     tag_unassigned = pyqtSignal(object)
     tag_assigned = pyqtSignal(object)
@@ -282,12 +356,8 @@ class TaggedWidget(QWidget):
             event.ignore()
 
     def dropEvent(self, event):
-        mime_data: QMimeData = event.mimeData()
-        data: bytearray = mime_data.data('application/x-tag-id')
-        if data:
-            tag_pk = unpack('I', data)[0]
-            dj_tag = Tag(pk=tag_pk)
-            dj_tag.refresh_from_db()
+        dj_tag = get_dropped_tag(event.mimeData())
+        if dj_tag:
             self.dj_entity.tags.add(dj_tag)
             self.update_data(self.dj_entity)
             self.tag_assigned.emit(dj_tag)
@@ -297,5 +367,5 @@ class TaggedWidget(QWidget):
 
     def unassign_tag(self, dj_tag):
         self.dj_entity.tags.remove(dj_tag)
-        self.update_data(self.dj_file)
+        self.update_data(self.dj_entity)
         self.tag_unassigned.emit(dj_tag)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from common.tag_counters import recount_tags
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики сущностей у тегов по привязкам в базе'
+
+    def handle(self, *args, **options):
+        count_changed = recount_tags()
+        self.stdout.write(f'Исправлено тегов: {count_changed}')
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.1 on 2026-10-17 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='tag',
+            options={'verbose_name': 'Тег', 'verbose_name_plural': 'Теги'},
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['parent', 'code'], name='tag_parent_code_idx'),
+        ),
+    ]
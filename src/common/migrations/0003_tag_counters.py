@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-17 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_tag_parent_code_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='count_entities',
+            field=models.PositiveIntegerField(default=0, verbose_name='Сущностей с тегом'),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='count_entities_in_subtree',
+            field=models.PositiveIntegerField(default=0, verbose_name='Привязок тега и вложенных тегов'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-17 11:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Замыкание для уже существующих тегов. Новые теги и переносы поддерживает common.tag_tree
+FILL_CLOSURE_SQL = """
+    INSERT INTO common_tagclosure (ancestor_id, descendant_id, depth)
+    WITH RECURSIVE closure(ancestor_id, descendant_id, depth) AS (
+        SELECT id, id, 0 FROM common_tag
+        UNION ALL
+        SELECT closure.ancestor_id, tag.id, closure.depth + 1
+        FROM common_tag AS tag JOIN closure ON tag.parent_id = closure.descendant_id
+    )
+    SELECT ancestor_id, descendant_id, depth FROM closure
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0003_tag_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(verbose_name='Расстояние от предка до потомка')),
+                ('ancestor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='common.tag')),
+                ('descendant', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='common.tag')),
+            ],
+            options={
+                'verbose_name': 'Связь тега с предком',
+                'verbose_name_plural': 'Связи тегов с предками',
+                'indexes': [models.Index(fields=['descendant', 'ancestor'], name='tag_closure_ancestors_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='tag_closure_unique')],
+            },
+        ),
+        migrations.RunSQL(FILL_CLOSURE_SQL, migrations.RunSQL.noop),
+    ]
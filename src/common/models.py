@@ -2,10 +2,54 @@ from django.db import models
 
 
 class Tag(models.Model):
+    COUNTER_FIELDS = ('count_entities', 'count_entities_in_subtree')
+
     code = models.PositiveIntegerField('Код модели')
     name = models.CharField('Имя тега', max_length=255)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name='children', null=True)
+    # Счётчики поддерживаются при изменении тегов сущностей (см. common.tag_counters), пересчитать: recount_tags
+    count_entities = models.PositiveIntegerField('Сущностей с тегом', default=0)
+    count_entities_in_subtree = models.PositiveIntegerField('Привязок тега и вложенных тегов', default=0)
+
+    class Meta:
+        verbose_name = 'Тег'
+        verbose_name_plural = 'Теги'
+        indexes = [
+            # Дерево тегов строится по уровням: дочерние теги родителя для модели с данным кодом
+            models.Index(fields=['parent', 'code'], name='tag_parent_code_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Счётчики меняются только запросами UPDATE ... F() из common.tag_counters, поэтому полное сохранение
+        # давно загруженного тега не должно затирать их устаревшими значениями. Явный update_fields - как есть
+        if kwargs.get('update_fields') is None and not self._state.adding:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+
+        super().save(*args, **kwargs)
+
+
+class TagClosure(models.Model):
+    """
+    Таблица замыкания дерева тегов: строка на каждую пару "предок - потомок", включая пару тега с самим собой
+    (depth=0). Все потомки тега или все его предки выбираются одним запросом по индексу, без обхода по уровням.
+    Поддерживается сигналами при создании и переносе тега (см. common.tag_tree), при удалении тега его строки
+    удаляются каскадом.
+    """
+    # Отдельные индексы по внешним ключам не нужны: их покрывают составные индексы ниже
+    ancestor = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='descendant_links', db_index=False)
+    descendant = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='ancestor_links', db_index=False)
+    depth = models.PositiveIntegerField('Расстояние от предка до потомка')
 
-    class Model:
-        verbose_name = 'Теги'
-        verbose_name_plural = 'Тег'
+    class Meta:
+        verbose_name = 'Связь тега с предком'
+        verbose_name_plural = 'Связи тегов с предками'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='tag_closure_unique'),
+        ]
+        indexes = [
+            # Предки тега: поиск по потомку сразу отдаёт идентификаторы предков без обращения к таблице
+            models.Index(fields=['descendant', 'ancestor'], name='tag_closure_ancestors_idx'),
+        ]
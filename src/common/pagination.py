@@ -0,0 +1,92 @@
+from django.db.models import Q
+
+
+def build_keyset_condition(order_fields, key, is_forward=True):
+    """
+    Возвращает условие "строка после key" (при is_forward=False - "перед key") для сортировки order_fields.
+    Вместо OFFSET, который заставляет SQLite пропустить все предыдущие строки, выборка начинается сразу
+    с нужного места индекса. Поля сортировки не должны содержать NULL.
+    """
+    condition = None
+    for name, value in reversed(list(zip(order_fields, key))):
+        is_descending = name.startswith('-')
+        name = name.lstrip('-')
+        lookup = 'gt' if is_forward != is_descending else 'lt'
+        field_condition = Q(**{f'{name}__{lookup}': value})
+        condition = field_condition if condition is None else field_condition | Q(**{name: value}) & condition
+
+    # Нестрогое условие на первое поле дублирует уже составленное, но позволяет SQLite искать по индексу
+    name = order_fields[0]
+    lookup = 'gte' if is_forward != name.startswith('-') else 'lte'
+    return Q(**{f'{name.lstrip("-")}__{lookup}': key[0]}) & condition
+
+
+def get_keyset_order_fields(queryset):
+    """Поля сортировки queryset, если по ним возможна ключевая выборка (сортировка заканчивается первичным ключом)"""
+    order_fields = list(queryset.query.order_by)
+    pk_names = ('pk', queryset.model._meta.pk.name)
+    if order_fields and all(isinstance(name, str) for name in order_fields):
+        if order_fields[-1].lstrip('-') in pk_names:
+            return order_fields
+
+
+def get_key(row, order_fields):
+    return [getattr(row, name.lstrip('-')) for name in order_fields]
+
+
+class RowsWindow:
+    """
+    Окно строк queryset вокруг видимой части списка.
+    Количество строк считается один раз, пока не сменится запрос. Недостающие строки подгружаются
+    одним запросом на всё окно с запасом PREFETCH_ROWS с каждой стороны. При прокрутке соседние строки
+    выбираются по ключу сортировки от края окна, и только при переходе далеко от окна - через OFFSET.
+    Ключевая выборка возможна, если сортировка однозначна, то есть заканчивается первичным ключом.
+    """
+    PREFETCH_ROWS = 40
+
+    def __init__(self, queryset, count=None, first_rows=None):
+        self.queryset = queryset
+        self.count = queryset.count() if count is None else count
+        self.start = 0
+        self.rows = list(first_rows or [])
+        self.order_fields = get_keyset_order_fields(queryset)
+
+    def get_rows(self, first, last):
+        """Строки с индексами от first до last, не включая last"""
+        last = min(last, self.count)
+        if first >= last:
+            return []
+
+        if not (self.start <= first and last <= self.start + len(self.rows)):
+            self.fetch(max(0, first - self.PREFETCH_ROWS), min(self.count, last + self.PREFETCH_ROWS))
+
+        return self.rows[first - self.start:last - self.start]
+
+    def get_row(self, index):
+        """Строка с индексом index или None, если её нет"""
+        if not self.start <= index < self.start + len(self.rows):
+            rows = self.get_rows(index, index + 1)
+            return rows[0] if rows else None
+
+        return self.rows[index - self.start]
+
+    def fetch(self, first, last):
+        end = self.start + len(self.rows)
+        if self.order_fields and self.rows and self.start <= first <= end < last:
+            # Прокрутка вниз: дочитываем строки после последней в окне
+            key = get_key(self.rows[-1], self.order_fields)
+            condition = build_keyset_condition(self.order_fields, key)
+            rows = list(self.queryset.filter(condition)[:last - end])
+            self.rows = self.rows[first - self.start:] + rows
+            self.start = first
+        elif self.order_fields and self.rows and first < self.start <= last:
+            # Прокрутка вверх: дочитываем строки перед первой в окне
+            key = get_key(self.rows[0], self.order_fields)
+            condition = build_keyset_condition(self.order_fields, key, is_forward=False)
+            rows = list(self.queryset.filter(condition).reverse()[:self.start - first])
+            rows.reverse()
+            self.rows = rows + self.rows[:last - self.start]
+            self.start -= len(rows)
+        else:
+            self.rows = list(self.queryset[first:last])
+            self.start = first
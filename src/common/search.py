@@ -0,0 +1,22 @@
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+FTS_MIN_SEARCH_LENGTH = 3  # триграммный индекс находит только подстроки не короче трёх символов
+
+
+def build_search_condition(fields_search, search, fts_table=None):
+    """
+    Возвращает условие поиска подстроки search в любом из полей fields_search.
+    Если у модели есть триграммная FTS5-таблица по этим полям, поиск идёт по ней: так он не просматривает
+    всю таблицу и не зависит от регистра, в том числе для кириллицы. Слишком короткие строки ищутся через LIKE,
+    который в SQLite не различает регистр только у латиницы.
+    """
+    if fts_table and len(search) >= FTS_MIN_SEARCH_LENGTH:
+        phrase = '"{}"'.format(search.replace('"', '""'))
+        return Q(pk__in=RawSQL(f'SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH %s', [phrase]))
+
+    q_condition = Q()
+    for field_search in fields_search:
+        q_condition |= Q(**{f'{field_search}__contains': search})
+
+    return q_condition
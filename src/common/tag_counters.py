@@ -0,0 +1,181 @@
+"""
+Счётчики тегов: Tag.count_entities - сколько сущностей отмечено тегом, Tag.count_entities_in_subtree - сколько
+привязок у тега и всех вложенных в него тегов (сущность с двумя тегами поддерева учитывается дважды).
+Счётчики меняются в той же транзакции, что и привязки: при изменении тегов сущности (m2m_changed),
+удалении отмеченной сущности или тега и переносе тега к другому родителю. Массовые вставки в обход
+сигналов (bulk_create промежуточной таблицы) должны вызывать recount_tags.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import m2m_changed, pre_delete, pre_save
+from django.dispatch import Signal
+
+from common.models import Tag, TagClosure
+
+# Привязки тегов менялись в обход сигналов, и счётчики пересчитаны заново. Отправляется после фиксации транзакции
+tags_recounted = Signal()
+
+
+def get_tags_fields():
+    """Поля ManyToMany на Tag во всех моделях, которые поддерживают теги"""
+    return [
+        related_object.field for related_object in Tag._meta.related_objects
+        if related_object.many_to_many and related_object.field.model is not Tag
+    ]
+
+
+def get_ancestors_ids(tag_ids):
+    """Для каждого тега - его идентификатор и идентификаторы всех его предков одним запросом по таблице замыкания"""
+    ancestors = {tag_id: [] for tag_id in tag_ids}
+    links = TagClosure.objects.filter(descendant_id__in=ancestors).values_list('descendant_id', 'ancestor_id')
+    for tag_id, ancestor_id in links:
+        ancestors[tag_id].append(ancestor_id)
+
+    return ancestors
+
+
+def update_counters(field_name, deltas):
+    """Прибавляет к полю счётчика тегов их изменения: один UPDATE на каждое различное значение изменения"""
+    tags_by_delta = defaultdict(list)
+    for tag_id, delta in deltas.items():
+        if delta:
+            tags_by_delta[delta].append(tag_id)
+
+    for delta, tag_ids in tags_by_delta.items():
+        Tag.objects.filter(pk__in=tag_ids).update(**{field_name: F(field_name) + delta})
+
+
+def change_counts(deltas):
+    """Меняет счётчики тегов: deltas - сколько сущностей добавилось (или убавилось) у каждого тега"""
+    subtree_deltas = defaultdict(int)
+    for tag_id, ancestors_ids in get_ancestors_ids([tag_id for tag_id, delta in deltas.items() if delta]).items():
+        for ancestor_id in ancestors_ids:
+            subtree_deltas[ancestor_id] += deltas[tag_id]
+
+    with transaction.atomic():
+        update_counters('count_entities', deltas)
+        update_counters('count_entities_in_subtree', subtree_deltas)
+
+
+def recount_tags():
+    """Пересчитывает все счётчики по промежуточным таблицам. Возвращает число исправленных тегов"""
+    counts = defaultdict(int)
+    for dj_field in get_tags_fields():
+        through = dj_field.remote_field.through
+        tag_id_name = f'{dj_field.m2m_reverse_field_name()}_id'
+        for tag_id, count in through.objects.values_list(tag_id_name).annotate(Count('pk')).order_by():
+            counts[tag_id] += count
+
+    with transaction.atomic():
+        tags = list(Tag.objects.all())
+        subtree_counts = defaultdict(int)
+        parents = {dj_tag.pk: dj_tag.parent_id for dj_tag in tags}
+        for dj_tag in tags:
+            current_id = dj_tag.pk
+            while current_id:
+                subtree_counts[current_id] += counts[dj_tag.pk]
+                current_id = parents.get(current_id)
+
+        changed_tags = []
+        for dj_tag in tags:
+            if (dj_tag.count_entities, dj_tag.count_entities_in_subtree) != (counts[dj_tag.pk], subtree_counts[dj_tag.pk]):
+                dj_tag.count_entities = counts[dj_tag.pk]
+                dj_tag.count_entities_in_subtree = subtree_counts[dj_tag.pk]
+                changed_tags.append(dj_tag)
+
+        Tag.objects.bulk_update(changed_tags, ['count_entities', 'count_entities_in_subtree'], batch_size=500)
+
+    transaction.on_commit(lambda: tags_recounted.send(sender=Tag))
+    return len(changed_tags)
+
+
+def get_linked_tags_ids(through, entity_field_name, tag_field_name, entity_ids, tag_ids=None):
+    """Теги, которые действительно привязаны к сущностям entity_ids: (идентификатор тега, число сущностей)"""
+    links = through.objects.filter(**{f'{entity_field_name}_id__in': entity_ids})
+    if tag_ids is not None:
+        links = links.filter(**{f'{tag_field_name}_id__in': tag_ids})
+
+    return links.values_list(f'{tag_field_name}_id').annotate(Count('pk')).order_by()
+
+
+def on_tags_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Сигнал m2m_changed. При добавлении Django передаёт в pk_set только новые привязки, а при удалении -
+    всё, что попросили удалить. Поэтому удаляемые привязки выбираются из базы до удаления.
+    """
+    if not (model is Tag or isinstance(instance, Tag)):
+        return
+
+    dj_field = next(dj_field for dj_field in get_tags_fields() if dj_field.remote_field.through is sender)
+    entity_field_name = dj_field.m2m_field_name()
+    tag_field_name = dj_field.m2m_reverse_field_name()
+    if action in ('pre_remove', 'pre_clear'):
+        if reverse:
+            # Тег отвязывается от сущностей pk_set (при clear - от всех)
+            links = sender.objects.filter(**{f'{tag_field_name}_id': instance.pk})
+            if pk_set is not None:
+                links = links.filter(**{f'{entity_field_name}_id__in': pk_set})
+
+            instance._removed_tags_deltas = {instance.pk: -links.count()}
+        else:
+            linked = get_linked_tags_ids(sender, entity_field_name, tag_field_name, [instance.pk], pk_set)
+            instance._removed_tags_deltas = {tag_id: -count for tag_id, count in linked}
+    elif action in ('post_remove', 'post_clear'):
+        change_counts(instance.__dict__.pop('_removed_tags_deltas', {}))
+    elif action == 'post_add' and pk_set:
+        if reverse:
+            change_counts({instance.pk: len(pk_set)})
+        else:
+            change_counts({tag_id: 1 for tag_id in pk_set})
+
+
+def on_tagged_entity_deleted(sender, instance, **kwargs):
+    """Привязки удаляемой сущности удаляются каскадом, без m2m_changed"""
+    for dj_field in get_tags_fields():
+        if dj_field.model is sender:
+            through = dj_field.remote_field.through
+            linked = get_linked_tags_ids(
+                through, dj_field.m2m_field_name(), dj_field.m2m_reverse_field_name(), [instance.pk],
+            )
+            change_counts({tag_id: -count for tag_id, count in linked})
+
+
+def on_tag_deleted(sender, instance, **kwargs):
+    """Привязки удаляемого тега больше не входят в поддеревья его предков"""
+    count_entities = Tag.objects.filter(pk=instance.pk).values_list('count_entities', flat=True).first()
+    if count_entities and instance.parent_id:
+        ancestors_ids = get_ancestors_ids([instance.parent_id])[instance.parent_id]
+        update_counters('count_entities_in_subtree', {tag_id: -count_entities for tag_id in ancestors_ids})
+
+
+def on_tag_saved(sender, instance, **kwargs):
+    """При переносе тега к другому родителю его поддерево переходит от старых предков к новым"""
+    if instance.pk is None:
+        return
+
+    old_tag = Tag.objects.filter(pk=instance.pk).values('parent_id', 'count_entities_in_subtree').first()
+    if old_tag is None or old_tag['parent_id'] == instance.parent_id or not old_tag['count_entities_in_subtree']:
+        return
+
+    count = old_tag['count_entities_in_subtree']
+    deltas = defaultdict(int)
+    parents_ids = [parent_id for parent_id in (old_tag['parent_id'], instance.parent_id) if parent_id]
+    ancestors = get_ancestors_ids(parents_ids)
+    for tag_id in ancestors.get(old_tag['parent_id'], []):
+        deltas[tag_id] -= count
+
+    for tag_id in ancestors.get(instance.parent_id, []):
+        deltas[tag_id] += count
+
+    update_counters('count_entities_in_subtree', deltas)
+
+
+def connect_signals():
+    for dj_field in get_tags_fields():
+        m2m_changed.connect(on_tags_changed, sender=dj_field.remote_field.through)
+        pre_delete.connect(on_tagged_entity_deleted, sender=dj_field.model)
+
+    pre_delete.connect(on_tag_deleted, sender=Tag)
+    pre_save.connect(on_tag_saved, sender=Tag)
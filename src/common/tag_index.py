@@ -0,0 +1,290 @@
+"""
+Индекс тегов в памяти процесса: для каждого тега - множество сущностей с этим тегом (EntityIds).
+Редкий тег хранится отсортированным массивом первичных ключей, частый - битовой строкой, где бит с номером N
+означает сущность с первичным ключом N. Поэтому память растёт с числом привязок, а не с числом тегов,
+умноженным на наибольший ключ: 10 тысяч тегов по 100 файлов в библиотеке из миллиона файлов занимают
+около 8 МиБ, а тег с половиной библиотеки - 122 КиБ битовой строкой вместо 3,8 МиБ массивом.
+Индекс необязателен (настройка TAG_INDEX) и нужен для мгновенного подсчёта, что даст отметка тега.
+"""
+from array import array
+from bisect import bisect_left
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from common.models import Tag, TagClosure
+from common.tag_counters import tags_recounted
+
+
+def iter_bitmap(bitmap):
+    for index, byte in enumerate(bitmap):
+        while byte:
+            low_bit = byte & -byte
+            yield index * 8 + low_bit.bit_length() - 1
+            byte ^= low_bit
+
+
+class EntityIds:
+    """
+    Множество первичных ключей сущностей. Хранится отсортированным массивом (8 байт на ключ), пока массив
+    меньше битовой строки до наибольшего ключа (бит на каждый ключ), и битовой строкой, когда ключей больше.
+    Ключ добавляется и удаляется без перестройки всего множества; обратно в массив битовая строка
+    превращается только при построении нового множества.
+    """
+    __slots__ = ('ids', 'bitmap', 'count')
+
+    def __init__(self, sorted_ids=None):
+        self.ids = sorted_ids if sorted_ids is not None else array('q')
+        self.bitmap = None
+        self.count = len(self.ids)
+        self.pack()
+
+    @staticmethod
+    def is_dense(count, max_pk):
+        return count * 8 > max_pk // 8 + 1
+
+    def pack(self):
+        """Переводит массив в битовую строку, если она уже меньше"""
+        if self.bitmap is None and self.ids and self.is_dense(self.count, self.ids[-1]):
+            self.bitmap = bytearray(self.ids[-1] // 8 + 1)
+            for pk in self.ids:
+                self.bitmap[pk >> 3] |= 1 << (pk & 7)
+
+            self.ids = None
+
+    @classmethod
+    def from_ids(cls, ids):
+        return cls(array('q', sorted(set(ids))))
+
+    @classmethod
+    def from_int(cls, bits):
+        entity_ids = cls()
+        entity_ids.count = bits.bit_count()
+        bitmap = bytearray(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'))
+        if cls.is_dense(entity_ids.count, bits.bit_length() - 1):
+            entity_ids.ids = None
+            entity_ids.bitmap = bitmap
+        else:
+            entity_ids.ids = array('q', iter_bitmap(bitmap))
+
+        return entity_ids
+
+    @classmethod
+    def union(cls, entity_ids_list):
+        if all(entity_ids.bitmap is None for entity_ids in entity_ids_list):
+            return cls.from_ids(pk for entity_ids in entity_ids_list for pk in entity_ids.ids)
+
+        bits = 0
+        for entity_ids in entity_ids_list:
+            bits |= entity_ids.to_int()
+
+        return cls.from_int(bits)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, pk):
+        if self.bitmap is not None:
+            return pk >> 3 < len(self.bitmap) and self.bitmap[pk >> 3] >> (pk & 7) & 1 == 1
+
+        index = bisect_left(self.ids, pk)
+        return index < len(self.ids) and self.ids[index] == pk
+
+    def __iter__(self):
+        return iter(self.ids) if self.bitmap is None else iter_bitmap(self.bitmap)
+
+    def to_int(self):
+        """Битовая строка целым числом Python: объединение, пересечение и подсчёт над ним идут целыми блоками"""
+        if self.bitmap is not None:
+            return int.from_bytes(self.bitmap, 'little')
+
+        if not self.ids:
+            return 0
+
+        bitmap = bytearray(self.ids[-1] // 8 + 1)
+        for pk in self.ids:
+            bitmap[pk >> 3] |= 1 << (pk & 7)
+
+        return int.from_bytes(bitmap, 'little')
+
+    def add(self, pk):
+        if pk in self:
+            return
+
+        self.count += 1
+        if self.bitmap is None:
+            self.ids.insert(bisect_left(self.ids, pk), pk)
+            self.pack()
+            return
+
+        if pk >> 3 >= len(self.bitmap):
+            self.bitmap.extend(bytes((pk >> 3) - len(self.bitmap) + 1))
+
+        self.bitmap[pk >> 3] |= 1 << (pk & 7)
+
+    def discard(self, pk):
+        if pk not in self:
+            return
+
+        self.count -= 1
+        if self.bitmap is None:
+            del self.ids[bisect_left(self.ids, pk)]
+        else:
+            self.bitmap[pk >> 3] &= ~(1 << (pk & 7))
+
+
+class TagIndex:
+    """
+    Множества сущностей модели dj_model по тегам. Строится одним проходом по промежуточной таблице
+    и дальше поддерживается сигналами при привязке и отвязке тегов, удалении сущностей и изменении дерева
+    тегов. Изменения идемпотентны, поэтому повторная привязка или отвязка индекс не портит.
+    Объединения по поддеревьям запоминаются и сбрасываются только у предков изменённого тега.
+    После вставок в обход сигналов (импорт CSV через bulk_create) вызывается recount_tags, и индекс
+    помечается устаревшим (is_outdated) до следующего build(). Откаченные транзакции тоже требуют build().
+    """
+
+    def __init__(self, dj_model):
+        self.dj_model = dj_model
+        dj_field = dj_model._meta.get_field('tags')
+        self.through = dj_field.remote_field.through
+        self.entity_id_name = f'{dj_field.m2m_field_name()}_id'
+        self.tag_id_name = f'{dj_field.m2m_reverse_field_name()}_id'
+        self.entities = {}
+        self.descendants = {}
+        self.ancestors = {}
+        self.subtree_entities = {}
+        self.is_outdated = True
+        tags_recounted.connect(self.on_tags_recounted)
+        m2m_changed.connect(self.on_tags_changed, sender=self.through)
+        post_delete.connect(self.on_entity_deleted, sender=dj_model)
+        post_save.connect(self.on_tree_changed, sender=Tag)
+        post_delete.connect(self.on_tag_deleted, sender=Tag)
+
+    def build(self):
+        self.entities = {}
+        tag_id, ids = None, None
+        # Индекс промежуточной таблицы (тег, сущность) отдаёт привязки уже упорядоченными
+        links = self.through.objects.values_list(self.tag_id_name, self.entity_id_name)
+        for link_tag_id, entity_id in links.order_by(self.tag_id_name, self.entity_id_name).iterator(chunk_size=10000):
+            if link_tag_id != tag_id:
+                if ids is not None:
+                    self.entities[tag_id] = EntityIds(ids)
+
+                tag_id, ids = link_tag_id, array('q')
+
+            ids.append(entity_id)
+
+        if ids is not None:
+            self.entities[tag_id] = EntityIds(ids)
+
+        self.load_descendants()
+        self.is_outdated = False
+
+    def load_descendants(self):
+        self.descendants = {}
+        self.ancestors = {}
+        links = TagClosure.objects.filter(ancestor__code=self.dj_model.CODE).values_list('ancestor_id', 'descendant_id')
+        for ancestor_id, descendant_id in links:
+            self.descendants.setdefault(ancestor_id, []).append(descendant_id)
+            self.ancestors.setdefault(descendant_id, []).append(ancestor_id)
+
+        self.subtree_entities = {}
+
+    def get_entities(self, tag_id, with_descendants=True):
+        """Сущности с тегом tag_id (с with_descendants - или с любым вложенным в него тегом)"""
+        descendants = self.descendants.get(tag_id, [tag_id]) if with_descendants else [tag_id]
+        if len(descendants) == 1:
+            return self.entities.get(descendants[0]) or EntityIds()
+
+        entity_ids = self.subtree_entities.get(tag_id)
+        if entity_ids is None:
+            entity_ids = EntityIds.union([
+                self.entities[descendant_id] for descendant_id in descendants if descendant_id in self.entities
+            ])
+            self.subtree_entities[tag_id] = entity_ids
+
+        return entity_ids
+
+    def select(self, tag_ids):
+        """Сущности хотя бы с одним из тегов tag_ids или вложенных в них - как фильтр тегов в списке"""
+        return EntityIds.union([self.get_entities(tag_id) for tag_id in tag_ids])
+
+    def count_if_added(self, checked_tag_ids, tag_ids, found_ids=None):
+        """
+        Для каждого тега из tag_ids - сколько сущностей покажет список, если к отмеченным добавить этот тег.
+        found_ids - найденное строкой поиска без учёта тегов; None, если строки поиска нет
+        """
+        selected = self.select(checked_tag_ids)
+        selected_bits = selected.to_int()
+        found = None if found_ids is None else EntityIds.from_ids(found_ids)
+        found_bits = None if found is None else found.to_int()
+        count_selected = len(selected) if found is None else (selected_bits & found_bits).bit_count()
+        counts = {}
+        for tag_id in tag_ids:
+            entity_ids = self.get_entities(tag_id)
+            if entity_ids.bitmap is not None:
+                added_bits = entity_ids.to_int() & ~selected_bits
+                count_added = (added_bits if found is None else added_bits & found_bits).bit_count()
+            else:
+                count_added = sum(
+                    1 for pk in entity_ids.ids if pk not in selected and (found is None or pk in found)
+                )
+
+            counts[tag_id] = count_selected + count_added
+
+        return counts
+
+    def set_entity(self, tag_id, entity_id, is_set):
+        entity_ids = self.entities.get(tag_id)
+        if entity_ids is None:
+            if not is_set:
+                return
+
+            entity_ids = self.entities[tag_id] = EntityIds()
+
+        if is_set:
+            entity_ids.add(entity_id)
+        else:
+            entity_ids.discard(entity_id)
+
+        self.forget_subtrees(tag_id)
+
+    def forget_subtrees(self, tag_id):
+        for ancestor_id in self.ancestors.get(tag_id, []):
+            self.subtree_entities.pop(ancestor_id, None)
+
+    def on_tags_changed(self, sender, instance, action, reverse, pk_set, **kwargs):
+        if action not in ('post_add', 'post_remove', 'post_clear'):
+            return
+
+        is_set = action == 'post_add'
+        if action == 'post_clear':
+            if reverse:
+                self.entities.pop(instance.pk, None)
+                self.forget_subtrees(instance.pk)
+            else:
+                self.on_entity_deleted(sender, instance)
+        elif reverse:
+            for entity_id in pk_set:
+                self.set_entity(instance.pk, entity_id, is_set)
+        else:
+            for tag_id in pk_set:
+                self.set_entity(tag_id, instance.pk, is_set)
+
+    def on_entity_deleted(self, sender, instance, **kwargs):
+        for tag_id, entity_ids in self.entities.items():
+            if instance.pk in entity_ids:
+                entity_ids.discard(instance.pk)
+                self.forget_subtrees(tag_id)
+
+    def on_tags_recounted(self, sender, **kwargs):
+        # Импорт выполняется в отдельном потоке: индекс перестроит тот, кто им пользуется
+        self.is_outdated = True
+
+    def on_tree_changed(self, sender, instance, **kwargs):
+        # Строки таблицы замыкания для созданного или перенесённого тега уже записаны
+        self.load_descendants()
+
+    def on_tag_deleted(self, sender, instance, **kwargs):
+        # Строки таблицы замыкания и привязки удалённого тега уже удалены каскадом
+        self.entities.pop(instance.pk, None)
+        self.load_descendants()
@@ -0,0 +1,87 @@
+"""
+Дерево тегов в таблице замыкания TagClosure и фильтры сущностей по тегам с учётом вложенных тегов.
+Фильтр tagged_with возвращает Q, поэтому условия по тегам складываются как обычные условия Django:
+& - у сущности есть все теги, | - хотя бы один, ~ - тега нет. Любая такая комбинация выполняется
+одним запросом с подзапросами по индексам таблицы замыкания и промежуточной таблицы тегов.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, pre_save
+
+from common.models import Tag, TagClosure
+
+
+def get_descendants_ids(tag_ids):
+    """Подзапрос: идентификаторы тегов tag_ids и всех вложенных в них тегов"""
+    return TagClosure.objects.filter(ancestor_id__in=tag_ids).values('descendant_id')
+
+
+def tagged_with(dj_model, tag_ids, with_descendants=True):
+    """
+    Условие "у сущности есть хотя бы один из тегов tag_ids" (с with_descendants - или вложенный в них тег).
+    Сущность попадает в выборку один раз, сколько бы подходящих тегов у неё ни было.
+    """
+    dj_field = dj_model._meta.get_field('tags')
+    through = dj_field.remote_field.through
+    tags_ids = get_descendants_ids(tag_ids) if with_descendants else tag_ids
+    links = through.objects.filter(**{f'{dj_field.m2m_reverse_field_name()}_id__in': tags_ids})
+    return Q(pk__in=links.values(f'{dj_field.m2m_field_name()}_id'))
+
+
+def rebuild_tag_closure():
+    """Строит таблицу замыкания заново по Tag.parent. Нужна после вставки тегов в обход сигналов (bulk_create)"""
+    parents = dict(Tag.objects.values_list('pk', 'parent_id'))
+    links = []
+    for tag_id in parents:
+        depth, ancestor_id = 0, tag_id
+        while ancestor_id:
+            links.append(TagClosure(ancestor_id=ancestor_id, descendant_id=tag_id, depth=depth))
+            depth, ancestor_id = depth + 1, parents.get(ancestor_id)
+
+    with transaction.atomic():
+        TagClosure.objects.all().delete()
+        TagClosure.objects.bulk_create(links, batch_size=500)
+
+
+def link_to_parent(subtree_links, parent_id):
+    """Связывает поддерево (пары "потомок - расстояние от корня поддерева") с родителем и всеми его предками"""
+    if parent_id is None:
+        return
+
+    ancestors = TagClosure.objects.filter(descendant_id=parent_id).values_list('ancestor_id', 'depth')
+    TagClosure.objects.bulk_create(
+        TagClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + 1 + depth)
+        for ancestor_id, ancestor_depth in ancestors
+        for descendant_id, depth in subtree_links
+    )
+
+
+def on_tag_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        with transaction.atomic():
+            TagClosure.objects.create(ancestor=instance, descendant=instance, depth=0)
+            link_to_parent([(instance.pk, 0)], instance.parent_id)
+
+
+def on_tag_moved(sender, instance, raw=False, **kwargs):
+    """Перенос тега к другому родителю: поддерево отвязывается от старых предков и привязывается к новым"""
+    if instance.pk is None or raw:
+        return
+
+    old_parent_id = Tag.objects.filter(pk=instance.pk).values_list('parent_id', flat=True).first()
+    if old_parent_id == instance.parent_id:
+        return
+
+    subtree_links = list(TagClosure.objects.filter(ancestor_id=instance.pk).values_list('descendant_id', 'depth'))
+    subtree_ids = [descendant_id for descendant_id, _ in subtree_links]
+    if instance.parent_id in subtree_ids:
+        raise ValueError(f'Тег "{instance.name}" нельзя перенести во вложенный в него тег')
+
+    with transaction.atomic():
+        TagClosure.objects.filter(descendant_id__in=subtree_ids).exclude(ancestor_id__in=subtree_ids).delete()
+        link_to_parent(subtree_links, instance.parent_id)
+
+
+def connect_signals():
+    post_save.connect(on_tag_created, sender=Tag)
+    pre_save.connect(on_tag_moved, sender=Tag)
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+
+class EntityTagsCache:
+    """
+    Теги сущностей для карточек списка: pk сущности -> список её тегов, отсортированный по имени.
+    Теги для всех строк, которых ещё нет в кеше, загружаются одним запросом к промежуточной таблице,
+    поэтому прокрутка списка не зависит от числа карточек на экране. Хранится не больше MAX_SIZE
+    сущностей, давно не показанные вытесняются первыми.
+    """
+    MAX_SIZE = 5000
+
+    def __init__(self, dj_model):
+        dj_field = dj_model._meta.get_field('tags')
+        self.through = dj_field.remote_field.through
+        self.entity_field_name = dj_field.m2m_field_name()
+        self.tag_field_name = dj_field.m2m_reverse_field_name()
+        self.tags = OrderedDict()
+
+    def prefetch(self, entities):
+        """Загружает теги сущностей entities, которых нет в кеше"""
+        missed_pks = []
+        for dj_entity in entities:
+            if dj_entity.pk in self.tags:
+                self.tags.move_to_end(dj_entity.pk)
+            else:
+                missed_pks.append(dj_entity.pk)
+
+        if not missed_pks:
+            return
+
+        entities_tags = {pk: [] for pk in missed_pks}
+        links = self.through.objects.filter(
+            **{f'{self.entity_field_name}_id__in': missed_pks},
+        ).select_related(self.tag_field_name).order_by(f'{self.tag_field_name}__name')
+        for link in links:
+            entities_tags[getattr(link, f'{self.entity_field_name}_id')].append(getattr(link, self.tag_field_name))
+
+        self.tags.update(entities_tags)
+        while len(self.tags) > self.MAX_SIZE:
+            self.tags.popitem(last=False)
+
+    def get(self, dj_entity):
+        self.prefetch([dj_entity])
+        return self.tags[dj_entity.pk]
+
+    def invalidate(self, pk):
+        """Вызывается после привязки или отвязки тега"""
+        self.tags.pop(pk, None)
+
+    def clear(self):
+        self.tags.clear()
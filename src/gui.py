@@ -6,6 +6,8 @@ gi.require_version("Gdk", "4.0")
 from gi.repository import GLib, Gio, Gtk, GObject, Gdk
 
 from window_builder import WindowBuilder
+from common.tags_cache import EntityTagsCache
+from mediagarden.models import AnyFile
 from mediagarden.scanner import (
     LibraryStorage, STATUS_NEW, STATUS_MOVED, STATUS_RENAMED, STATUS_MOVED_AND_RENAMED,
     STATUS_UNTOUCHED, STATUS_DELETED, STATUS_DUPLICATE,
@@ -110,6 +112,8 @@ class Tag(GObject.Object):
 
 
 class BookListView:
+    TAGS_PREFETCH_ROWS = 50
+
     def _on_factory_setup(self, factory, list_item):
         builder = WindowBuilder(XML_DIR / 'item_book.xml', {})
         cell = builder.root_widget
@@ -147,7 +151,15 @@ class BookListView:
         controller.connect('pressed', self.open_file_window, item)
         cell.builder.title.add_controller(controller)
 
+        cell.book = item
         self.book_widgets[item.book_id] = cell
+        if item.book_id not in self.tags_cache.tags:
+            # Теги загружаются одним запросом для соседних строк, которые скоро будут показаны при прокрутке
+            position = list_item.get_position()
+            first = max(0, position - self.TAGS_PREFETCH_ROWS)
+            last = min(self.list_store.get_n_items(), position + self.TAGS_PREFETCH_ROWS)
+            self.tags_cache.prefetch([self.list_store.get_item(index).obj for index in range(first, last)])
+
         self.populate_tags(item)
 
         # https://pygobject.gnome.org/tutorials/gtk4/drag-and-drop.html
@@ -163,6 +175,7 @@ class BookListView:
     def on_drop(self, _ctrl, value, _x, _y, file_item):
         if isinstance(value, Tag):
             value.obj.files.add(file_item.obj)
+            self.tags_cache.invalidate(file_item.book_id)
             self.populate_tags(file_item)
             self.update_tag_count(value.tag_id)
 
@@ -199,6 +212,7 @@ class BookListView:
         self.view.set_name('books_list')
 
         self.book_widgets = {}
+        self.tags_cache = EntityTagsCache(AnyFile)
 
     def append(self, anyfile):
         item = Book(anyfile.pk, anyfile.filename, anyfile.directory)
@@ -207,6 +221,7 @@ class BookListView:
     
     def unassing_tag(self, _, book, tag_obj):
         book.obj.tags.remove(tag_obj)
+        self.tags_cache.invalidate(book.book_id)
         self.populate_tags(book)
         self.update_tag_count(tag_obj.pk)
 
@@ -215,7 +230,7 @@ class BookListView:
         while tags.get_first_child():
             tags.remove(tags.get_first_child())
 
-        for tag_obj in book.obj.tags.order_by('name'):
+        for tag_obj in self.tags_cache.get(book.obj):
             box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
             box.props.margin_end = 6
 
@@ -228,12 +243,21 @@ class BookListView:
             box.append(button)
             tags.append(box)
 
+    def refresh_tags(self):
+        # Тег переименован или удалён: закешированные экземпляры тегов устарели у всех файлов, а не только у показанных
+        self.tags_cache.clear()
+        cells = list(self.book_widgets.values())
+        self.tags_cache.prefetch([cell.book.obj for cell in cells])
+        for cell in cells:
+            self.populate_tags(cell.book)
+
     def clear(self):
         self.list_store.remove_all()
 
 
 class TagNameColumnBuilder:
-    def __init__(self):
+    def __init__(self, func_changed_tag):
+        self.func_changed_tag = func_changed_tag
         factory = Gtk.SignalListItemFactory()
         factory.connect('setup', self._on_factory_setup)
         factory.connect('bind', self._on_factory_bind)
@@ -299,7 +323,8 @@ class TagNameColumnBuilder:
             new_name = cell.custom_entry.props.text
             cell.custom_label.props.label = new_name
             item.obj.name = new_name
-            item.obj.save()
+            item.obj.save(update_fields=['name'])
+            self.func_changed_tag()
 
             cell.custom_label.props.visible = True
             cell.custom_entry.props.visible = False
@@ -384,8 +409,14 @@ class TagCountColumnBuilder:
     def _on_factory_bind(self, factory, list_item):
         cell = list_item.get_child()
         item = list_item.get_item()
-        self.update_count_funces[item.tag_id] = lambda: setattr(cell.props, 'label', str(item.obj.files.count()))
-        self.update_count_funces[item.tag_id]()
+        # Количество файлов хранится в теге: при прокрутке дерева строки показываются без запросов
+        # Как и фильтр по отмеченным тегам, количество учитывает вложенные теги
+        cell.props.label = str(item.obj.count_entities_in_subtree)
+        self.update_count_funces[item.tag_id] = lambda: self.update_count(cell, item)
+
+    def update_count(self, cell, item):
+        item.obj.refresh_from_db(fields=['count_entities', 'count_entities_in_subtree'])
+        cell.props.label = str(item.obj.count_entities_in_subtree)
 
     def _on_factory_unbind(self, factory, list_item):
         cell = list_item.get_child()
@@ -403,8 +434,9 @@ class TagTreeView:
 
         return None
 
-    def __init__(self, lib_storage, func_toggled_tag, tag_binded_values):
+    def __init__(self, lib_storage, func_toggled_tag, func_changed_tag, tag_binded_values):
         self.lib_storage = lib_storage
+        self.func_changed_tag = func_changed_tag
         self.list_store = Gio.ListStore(item_type=Tag)
         # https://api.pygobject.gnome.org/Gtk-4.0/class-TreeListModel.html
         tree_store = Gtk.TreeListModel.new(self.list_store, True, True, self.get_children)
@@ -415,7 +447,7 @@ class TagTreeView:
         self.tag_binded_values = tag_binded_values
         self.update_count_funces = {}
 
-        column_name_builder = TagNameColumnBuilder()
+        column_name_builder = TagNameColumnBuilder(func_changed_tag)
         self.view.append_column(column_name_builder.column)
 
         column_check_builder = TagCheckColumnBuilder(func_toggled_tag)
@@ -425,7 +457,12 @@ class TagTreeView:
         self.view.append_column(column_count_builder.column)
 
     def update_tag_count(self, tag_id):
-        self.update_count_funces[tag_id]()
+        # Количество у предков тоже изменилось: оно учитывает вложенные теги. Скрытые ячейки обновятся при показе
+        while tag_id:
+            if tag_id in self.update_count_funces:
+                self.update_count_funces[tag_id]()
+
+            tag_id = self.tags[tag_id].parent_id
 
     def append(self, tag_obj):
         parent_id = tag_obj.parent_id
@@ -481,6 +518,7 @@ class TagTreeView:
                 is_found, position = list_store.find(current_tag) # TODO: если ищет методом перебора, то найти решение без перебора
                 list_store.remove(position)
                 current_tag.obj.delete()
+                self.func_changed_tag()
 
 
 class ScanWindow(Gtk.ApplicationWindow):
@@ -507,9 +545,20 @@ class ScanWindow(Gtk.ApplicationWindow):
         self.set_child(self.builder.root_widget)
  
         self.count_new = 0
+        self.builder.button_stop.connect('clicked', self.on_stop)
+        self.connect('close-request', self.on_close_request)
 
         run_func_in_thread(self.fg_scan)
 
+    def on_stop(self, _):
+        self.builder.button_stop.props.sensitive = False
+        self.lib_storage.stop_scan()
+
+    def on_close_request(self, _):
+        # Сканирование сохранит контрольную точку и продолжится при следующем запуске
+        self.lib_storage.stop_scan()
+        return False
+
     @idle_add
     def progress_count_scanned_files(self, count_scanned_files):
         self.builder.count_scanned_files.props.label = str(count_scanned_files)
@@ -575,12 +624,12 @@ class ScanWindow(Gtk.ApplicationWindow):
         self.builder.books.append(builder.root_widget)
     
     def fg_scan(self):
-        self.lib_storage.scan_to_db(
+        is_finished = self.lib_storage.scan_to_db(
             progress_count_scanned_files=self.progress_count_scanned_files,
             progress_current_file=self.progress_current_file,
             func=self.add_file_task_card,
         )
-        print('Сканирование завершено')
+        print('Сканирование завершено' if is_finished else 'Сканирование прервано')
         self.emit('scan_end')
 
 
@@ -704,7 +753,7 @@ class AppWindow(Gtk.ApplicationWindow):
         self.builder.scrolled_tags.set_propagate_natural_height(True)
         
         self.tag_binded_values = {}
-        self.tag_tree = TagTreeView(self.lib_storage, self.toggled_tag, self.tag_binded_values)
+        self.tag_tree = TagTreeView(self.lib_storage, self.toggled_tag, self.changed_tag, self.tag_binded_values)
         self.builder.tags.append(self.tag_tree.view)
         self.builder.button_add_tag.connect('clicked', self.tag_tree.action_new_tag)
         self.builder.button_add_child_tag.connect('clicked', self.tag_tree.action_new_child_tag)
@@ -729,6 +778,9 @@ class AppWindow(Gtk.ApplicationWindow):
         self.tags = [str(key) for key, value in self.tag_binded_values.items() if value]
         self.update_book_list()
  
+    def changed_tag(self):
+        self.book_list.refresh_tags()
+
     def update_book_list(self, _=None):
         search = self.builder.search_entry.props.text
         tags = self.tags if self.tags else None
@@ -800,7 +852,8 @@ class MyApplication(Gtk.Application):
         window.present()
 
 
-app = MyApplication()
-exit_status = app.run(sys.argv)
+if __name__ == '__main__':
+    app = MyApplication()
+    exit_status = app.run(sys.argv)
 
-sys.exit(exit_status)
\ No newline at end of file
+    sys.exit(exit_status)
\ No newline at end of file
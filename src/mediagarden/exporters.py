@@ -1,30 +1,107 @@
+import hashlib
+import io
+import json
 import os
 import csv
+from functools import lru_cache
 from urllib.parse import quote
 
 
-class CSVExporter:
+@lru_cache(maxsize=4096)
+def quote_pathdir(directory):
+    """Директория повторяется у многих книг подряд, поэтому её закодированный вид кешируется"""
+    return quote('/{}'.format(directory)) if directory else ''
+
+
+class BaseExporter:
+    """
+    Экспортёр отрисовывает страницу целиком в строку и записывает её файл одним вызовом write.
+    Он не хранит открытых файлов, поэтому страницы могут писаться параллельно в разных процессах.
+
+    Хеши содержимого записанных страниц хранятся в манифесте MANIFEST_NAME. Страница, у которой
+    не изменились ни хеш, ни время изменения файла, не перезаписывается, чтобы Obsidian и синхронизация
+    хранилища заметок не обрабатывали тысячи нетронутых файлов. Изменённая страница пишется
+    во временный файл, который затем атомарно заменяет прежний.
+    """
+    MANIFEST_NAME = None
+    NEWLINE = None
+
     def __init__(self, storage_structure, storage_directory):
-        self.csv_writer = None
-        self.csv_file = None
         self.storage_structure = storage_structure
         if not os.path.exists(self.storage_structure):
             os.makedirs(self.storage_structure, exist_ok=True)
 
-    def open_new_page(self, current_page):
-        csv_full_path = os.path.join(self.storage_structure, '{}.csv'.format(str(current_page)))
-        self.csv_file = open(csv_full_path, 'w', encoding='utf-8', newline='\n')
-        self.csv_writer = csv.writer(self.csv_file)
+    def get_page_path(self, current_page):
+        raise NotImplementedError
+
+    def render_page(self, current_page, rows, is_last_page):
+        raise NotImplementedError
+
+    def write_page(self, current_page, rows, is_last_page, manifest_entry=None):
+        content = self.render_page(current_page, rows, is_last_page)
+        return self.write_file(self.get_page_path(current_page), content, manifest_entry)
+
+    def write_csv(self, filename, rows, manifest_entry=None):
+        """Файлы тегов пишутся в CSV при любом формате страниц"""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return self.write_file(os.path.join(self.storage_structure, filename), buffer.getvalue(), manifest_entry, '\n')
+
+    def write_file(self, file_path, content, manifest_entry=None, newline=None):
+        """Записывает файл, если он изменился, и возвращает запись манифеста: хеш содержимого и время изменения"""
+        content_hash = hashlib.blake2s(content.encode('utf-8')).hexdigest()
+        if manifest_entry and manifest_entry[0] == content_hash:
+            try:
+                if os.stat(file_path).st_mtime_ns == manifest_entry[1]:
+                    return manifest_entry
+            except FileNotFoundError:
+                pass
+
+        self.replace_file(file_path, content, newline)
+        return content_hash, os.stat(file_path).st_mtime_ns
+
+    def replace_file(self, file_path, content, newline=None):
+        directory, filename = os.path.split(file_path)
+        temp_path = os.path.join(directory, f'.{filename}.tmp')
+        newline = self.NEWLINE if newline is None else newline
+        with open(temp_path, 'w', encoding='utf-8', newline=newline) as temp_file:
+            temp_file.write(content)
+
+        os.replace(temp_path, file_path)
+
+    def load_manifest(self):
+        """Возвращает манифест прошлого экспорта: номер страницы (строкой) или имя файла тегов -> [хеш, время изменения]"""
+        try:
+            with open(os.path.join(self.storage_structure, self.MANIFEST_NAME), encoding='utf-8') as manifest_file:
+                return json.load(manifest_file)
+        except (OSError, ValueError):
+            return {}
 
-    def write_row(self, row):
-        self.csv_writer.writerow(row)
+    def save_manifest(self, manifest):
+        self.replace_file(os.path.join(self.storage_structure, self.MANIFEST_NAME), json.dumps(manifest))
 
-    def close(self, is_last_page):
-        if self.csv_file:
-            self.csv_file.close()
+    def remove_pages_after(self, last_page):
+        """Удаляет страницы прошлого экспорта, которые идут после последней страницы текущего"""
+        current_page = last_page + 1
+        while os.path.exists(page_path := self.get_page_path(current_page)):
+            os.remove(page_path)
+            current_page += 1
 
 
-class MarkdownExporter:
+class CSVExporter(BaseExporter):
+    MANIFEST_NAME = '.csv_manifest.json'
+    NEWLINE = '\n'
+
+    def get_page_path(self, current_page):
+        return os.path.join(self.storage_structure, '{}.csv'.format(str(current_page)))
+
+    def render_page(self, current_page, rows, is_last_page):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+
+class MarkdownExporter(BaseExporter):
     TABLE_HEADER = (
         '# Список книг из локального хранилища\n\n'
         'ID | Ссылка на описание | Ссылка на книгу\n'
@@ -33,38 +110,34 @@ class MarkdownExporter:
     TABLE_ROW = '{id} | [{hash}](книга_{id}) | [{name}](file://{relative_storage_pathdir}{pathdir}/{filename})\n'
     PREV_PAGE = '[<< Предыдщая страница](список_книг_{})'
     NEXT_PAGE = '[Следующая страница >>](список_книг_{})'
+    NAME_TRANSLATION = str.maketrans('', '', '[]()')
+    MANIFEST_NAME = '.список_книг_manifest.json'
 
     def __init__(self, storage_structure, storage_directory):
-        self.storage_structure = storage_structure
-        self.csv_file = None
-        self.current_page = None
+        super().__init__(storage_structure, storage_directory)
         self.storage_directory = storage_directory
-        if not os.path.exists(self.storage_structure):
-            os.makedirs(self.storage_structure, exist_ok=True)
-
-    def open_new_page(self, current_page):
-        csv_full_path = os.path.join(self.storage_structure, 'список_книг_{}.md'.format(str(current_page)))
-        self.csv_file = open(csv_full_path, 'w', encoding='utf-8')
-        self.csv_file.write(self.TABLE_HEADER)
-        self.current_page = current_page
 
-    def write_row(self, row):
         relpath = os.path.relpath(self.storage_directory, self.storage_structure).replace('\\', '/')
-        self.csv_file.write(
-            self.TABLE_ROW.format(
-                id=row[1],
-                hash=row[0],
-                name=row[3].replace('[', '').replace(']', '').replace('(', '').replace(')', ''),
-                relative_storage_pathdir=quote(relpath),
-                pathdir=quote('/{}'.format(row[2])) if row[2] else '',
-                filename=quote(row[3]),
-            )
-        )
+        self.relative_storage_pathdir = quote(relpath)
 
-    def close(self, is_last_page):
-        prev_page = self.PREV_PAGE.format(self.current_page - 1) if self.current_page > 1 else ''
-        next_page = self.NEXT_PAGE.format(self.current_page + 1) if not is_last_page else ''
-        self.csv_file.write(f'\n{prev_page} | {self.current_page} | {next_page}\n--- | --- | ---\n')
+    def get_page_path(self, current_page):
+        return os.path.join(self.storage_structure, 'список_книг_{}.md'.format(str(current_page)))
+
+    def render_page(self, current_page, rows, is_last_page):
+        lines = [self.TABLE_HEADER]
+        for row in rows:
+            lines.append(
+                self.TABLE_ROW.format(
+                    id=row[1],
+                    hash=row[0],
+                    name=row[3].translate(self.NAME_TRANSLATION),
+                    relative_storage_pathdir=self.relative_storage_pathdir,
+                    pathdir=quote_pathdir(row[2]),
+                    filename=quote(row[3]),
+                )
+            )
 
-        if self.csv_file:
-            self.csv_file.close()
+        prev_page = self.PREV_PAGE.format(current_page - 1) if current_page > 1 else ''
+        next_page = self.NEXT_PAGE.format(current_page + 1) if not is_last_page else ''
+        lines.append(f'\n{prev_page} | {current_page} | {next_page}\n--- | --- | ---\n')
+        return ''.join(lines)
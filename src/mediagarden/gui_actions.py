@@ -5,7 +5,7 @@ from PyQt6.QtWidgets import (
     QStyleOptionButton, QApplication,
 )
 from PyQt6.QtGui import QStandardItemModel, QStandardItem, QDrag, QPainter, QPalette
-from PyQt6.QtCore import Qt, QModelIndex, pyqtSignal, QMimeData, QThread, pyqtSlot, QObject
+from PyQt6.QtCore import Qt, QModelIndex, pyqtSignal, QMimeData, QThread, pyqtSlot, QObject, QSize
 
 from mediagarden.exporters import CSVExporter, MarkdownExporter
 from mediagarden.models import AnyFile
@@ -13,6 +13,19 @@ from mediagarden.scanner import (
     LibraryStorage, STATUS_NEW, STATUS_MOVED, STATUS_RENAMED, STATUS_MOVED_AND_RENAMED,
     STATUS_UNTOUCHED, STATUS_DELETED, STATUS_DUPLICATE,
 )
+from mediagarden.watcher import LibraryWatcher
+
+
+def start_in_thread(worker):
+    """Запускает worker.run_task в новом потоке. Поток и worker удаляются после сигнала worker.finished"""
+    thread = QThread()
+    worker.moveToThread(thread)
+    thread.started.connect(worker.run_task)
+    worker.finished.connect(thread.quit)
+    worker.finished.connect(worker.deleteLater)
+    thread.finished.connect(thread.deleteLater)
+    thread.start()
+    return thread
 
 
 class ExportWorker(QObject):
@@ -71,12 +84,30 @@ class ScanWorker(QObject):
     @pyqtSlot()
     def run_task(self):
         try:
-            self.lib_storage.scan_to_db(
+            is_finished = self.lib_storage.scan_to_db(
                 progress_count_scanned_files=self.progress_count_scanned_files.emit,
                 progress_current_file=self.progress_current_file.emit,
                 func=self.add_file_task_card.emit,
             )
-            print('Сканирование завершено')
+            print('Сканирование завершено' if is_finished else 'Сканирование прервано')
+        except Exception as error:
+            print(error)
+
+        self.finished.emit()
+
+
+class WatchWorker(QObject):
+    finished = pyqtSignal()
+    progress_count_synced_files = pyqtSignal(int)
+
+    def __init__(self, lib_storage):
+        super().__init__()
+        self.watcher = LibraryWatcher(lib_storage, progress_count_synced_files=self.progress_count_synced_files.emit)
+
+    @pyqtSlot()
+    def run_task(self):
+        try:
+            self.watcher.run()
         except Exception as error:
             print(error)
 
@@ -133,14 +164,7 @@ class ExportWindow(QDialog):
         self.worker = ExportWorker(self.lib_storage, self.field_export_type.currentData())
         self.worker.progress_count_exported_files.connect(self.progress_count_exported_files)
 
-        # TODO: вынести в функцию
-        self.thread = QThread()
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run_task)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.start()
+        self.thread = start_in_thread(self.worker)
 
     def progress_count_exported_files(self, index_of_current_row: int, count_rows: int, current_page: int):
         self.lbl_index_of_current_row.setText(str(index_of_current_row))
@@ -177,14 +201,7 @@ class ImportWindow(QDialog):
         self.worker.progress_count_imported_files.connect(self.progress_count_imported_files)
         self.worker.finished.connect(self.finished.emit)
 
-        # TODO: вынести в функцию
-        self.thread = QThread()
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run_task)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.start()
+        self.thread = start_in_thread(self.worker)
 
 
 class ItemData:
@@ -346,12 +363,13 @@ class ScanWindow(QDialog):
         layout_row_new.addWidget(QLabel('Новые:'))
         layout_row_new.addWidget(self.lbl_new)
 
-        btn_start = QPushButton('Сканировать')
-        btn_start.clicked.connect(self.start_scan)
-        btn_stop = QPushButton('Остановить')
-        btn_stop.clicked.connect(self.stop_scan)
-        layout_row_buttons.addWidget(btn_start)
-        layout_row_buttons.addWidget(btn_stop)
+        self.btn_start = QPushButton('Сканировать')
+        self.btn_start.clicked.connect(self.start_scan)
+        self.btn_stop = QPushButton('Остановить')
+        self.btn_stop.clicked.connect(self.stop_scan)
+        self.btn_stop.setEnabled(False)
+        layout_row_buttons.addWidget(self.btn_start)
+        layout_row_buttons.addWidget(self.btn_stop)
 
         layout_statistic.addLayout(layout_row_scanned)
         layout_statistic.addLayout(layout_row_new)
@@ -372,6 +390,7 @@ class ScanWindow(QDialog):
         layout.addWidget(cards_list)
 
         self.count_new = 0
+        self.is_scanning = False
         cards_model.setItem(0, QStandardItem())
         cards_model.setItem(1, QStandardItem())
 
@@ -386,23 +405,35 @@ class ScanWindow(QDialog):
             return
 
     def start_scan(self):
+        self.btn_start.setEnabled(False)
+        self.btn_stop.setEnabled(True)
+        self.is_scanning = True
         self.worker = ScanWorker(self.lib_storage)
         self.worker.progress_count_scanned_files.connect(self.progress_count_scanned_files)
         self.worker.progress_current_file.connect(self.progress_current_file)
         self.worker.add_file_task_card.connect(self.add_file_task_card)
+        self.worker.finished.connect(self.on_finished_scan)
         self.worker.finished.connect(self.finished.emit)
 
-        # TODO: вынести в функцию
-        self.thread = QThread()
-        self.worker.moveToThread(self.thread)
-        self.thread.started.connect(self.worker.run_task)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.start()
+        self.thread = start_in_thread(self.worker)
+
+    def on_finished_scan(self):
+        self.is_scanning = False
+        self.btn_start.setEnabled(True)
+        self.btn_stop.setEnabled(False)
 
     def stop_scan(self):
-        pass  # TODO: реализовать
+        self.btn_stop.setEnabled(False)
+        self.lib_storage.stop_scan()
+
+    def done(self, result):
+        # Поток не должен пережить окно: прерываем сканирование, оно продолжится при следующем запуске
+        if self.is_scanning:
+            self.stop_scan()
+            self.thread.quit()
+            self.thread.wait()
+
+        super().done(result)
 
 
 class ActionsAnyFileWidget(QWidget):
@@ -421,6 +452,12 @@ class ActionsAnyFileWidget(QWidget):
         btn_scan_extern.setDisabled(True)
         layout.addWidget(btn_scan_extern)
 
+        self.field_watch = QCheckBox('Следить за изменениями')
+        self.field_watch.toggled.connect(self.on_toggled_watch)
+        layout.addWidget(self.field_watch)
+        self.watch_thread = None
+        QApplication.instance().aboutToQuit.connect(self.stop_watch)
+
         layout.addSpacing(15)
 
         btn_export = QPushButton('Экспортировать в заметки')
@@ -443,7 +480,39 @@ class ActionsAnyFileWidget(QWidget):
         self.main_window.update_tags()
         self.main_window.update_table()
     
+    def on_finished_scan(self):
+        self.main_window.update_table()
+
     def on_click_scan(self):
         window = ScanWindow(self.lib_storage)
-        window.finished.connect(self.update_books_list)
+        window.finished.connect(self.on_finished_scan)
         window.exec()
+
+    def on_toggled_watch(self, is_checked):
+        if is_checked:
+            self.start_watch()
+        else:
+            self.stop_watch()
+
+    def start_watch(self):
+        self.watch_worker = WatchWorker(self.lib_storage)
+        self.watch_worker.progress_count_synced_files.connect(self.progress_count_synced_files)
+        self.watch_worker.finished.connect(self.on_finished_watch)
+
+        self.watch_thread = start_in_thread(self.watch_worker)
+
+    def stop_watch(self):
+        # Поток не должен пережить приложение: дожидаемся, пока наблюдатель запишет накопленные изменения
+        if self.watch_thread is not None:
+            self.watch_worker.watcher.stop()
+            self.watch_thread.quit()
+            self.watch_thread.wait()
+            self.watch_thread = None
+
+    def on_finished_watch(self):
+        # Наблюдение могло завершиться из-за ошибки - тогда снимаем флажок
+        self.watch_thread = None
+        self.field_watch.setChecked(False)
+
+    def progress_count_synced_files(self, count_synced_files: int):
+        self.main_window.update_table()
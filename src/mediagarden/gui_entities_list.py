@@ -1,213 +1,267 @@
-from PyQt6.QtWidgets import (
-    QVBoxLayout, QHBoxLayout, QPushButton, QLabel, QWidget, QAbstractScrollArea
-)
-from PyQt6.QtCore import Qt, pyqtSignal
-from PyQt6.QtGui import QPalette
-
-from common.gui_tags import TaggedWidget
+from PyQt6.QtWidgets import QApplication, QListView, QStyle, QStyledItemDelegate, QStyleOptionButton, QStyleOptionViewItem
+from PyQt6.QtCore import Qt, QAbstractListModel, QEvent, QModelIndex, QRect, QSize, pyqtSignal
+from PyQt6.QtGui import QCursor, QPalette
+
+from common.gui_tags import get_dropped_tag
+from common.pagination import RowsWindow
+from common.tags_cache import EntityTagsCache
+from mediagarden.models import AnyFile
 from utils import open_file_with_default_program
 
+FileRole = Qt.ItemDataRole.UserRole
+TagsRole = Qt.ItemDataRole.UserRole + 1
 
-class TagWidget(QWidget):
-    unassigned = pyqtSignal(object)
-
-    def __init__(self, parent=None):
-        super().__init__(parent)
-        tag_layout = QHBoxLayout(self)
-        self.lbl_tag_name = QLabel()
-        tag_layout.addWidget(self.lbl_tag_name)
-        btn_tag_delete = QPushButton('x')
-        btn_tag_delete.clicked.connect(self.unassign_from_file)
-        tag_layout.addWidget(btn_tag_delete)
-        self.dj_tag = None
-
-    def set_data(self, dj_tag):
-        self.lbl_tag_name.setText(dj_tag.name)
-        self.dj_tag = dj_tag
-
-    def unassign_from_file(self):
-        self.unassigned.emit(self.dj_tag)
 
+class FilesListModel(QAbstractListModel):
+    """
+    Модель списка файлов поверх окна строк RowsWindow.
+    Представлению строки становятся доступны порциями по FETCH_BATCH_SIZE через canFetchMore/fetchMore,
+    а в памяти хранятся только строки окна вокруг видимой части и их теги. Поэтому расход памяти
+    не зависит от числа найденных файлов.
+    """
+    FETCH_BATCH_SIZE = 500
 
-class FileCardWidget(TaggedWidget):
-    signal_open_entity = pyqtSignal(object)
+    def __init__(self, queryset, count=None, first_rows=None, tags_cache=None, parent=None):
+        super().__init__(parent)
+        self.rows_window = RowsWindow(queryset, count, first_rows)
+        self.tags_cache = tags_cache or EntityTagsCache(queryset.model)
+        self.count_fetched = min(self.rows_window.count, self.FETCH_BATCH_SIZE)
+        self.tags_prefetched_rows = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.count_fetched
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.count_fetched < self.rows_window.count
+
+    def fetchMore(self, parent):
+        # Сами строки загрузит окно, когда они понадобятся для отрисовки
+        count_fetched = min(self.rows_window.count, self.count_fetched + self.FETCH_BATCH_SIZE)
+        self.beginInsertRows(QModelIndex(), self.count_fetched, count_fetched - 1)
+        self.count_fetched = count_fetched
+        self.endInsertRows()
+
+    def get_file(self, row):
+        dj_file = self.rows_window.get_row(row)
+        # Окно подгрузило новые строки - теги для них тоже загружаются одним запросом
+        if self.rows_window.rows is not self.tags_prefetched_rows:
+            self.tags_cache.prefetch(self.rows_window.rows)
+            self.tags_prefetched_rows = self.rows_window.rows
+
+        return dj_file
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role not in (Qt.ItemDataRole.DisplayRole, FileRole, TagsRole):
+            return None
+
+        dj_file = self.get_file(index.row())
+        if dj_file is None:
+            return None
+        elif role == FileRole:
+            return dj_file
+        elif role == TagsRole:
+            return self.tags_cache.get(dj_file)
+
+        return dj_file.filename
+
+    def tags_changed(self, index):
+        """Вызывается после привязки или отвязки тега от файла в строке index"""
+        self.tags_cache.invalidate(index.data(FileRole).pk)
+        self.dataChanged.emit(index, index, [TagsRole])
+
+
+class FileCardDelegate(QStyledItemDelegate):
+    """Рисует карточку файла: имя, директорию, теги и кнопки открытия - без отдельных виджетов на строку"""
+    signal_open_file = pyqtSignal(object)
+    signal_open_directory = pyqtSignal(object)
+    tag_unassigned = pyqtSignal(QModelIndex, object)
+
+    ROW_HEIGHT = 90
+    TAG_HEIGHT = 20
+    TAG_SPACING = 6
 
-    def __init__(self, parent):
+    def __init__(self, parent=None):
         super().__init__(parent)
+        self.button_width = 80
+        self.button_height = 25
+        self.padding = 10
+
+    def sizeHint(self, option, index):
+        return QSize(200, self.ROW_HEIGHT)
+
+    def _get_buttons_rects(self, option):
+        """Кнопки "Открыть" (файл) и "Папка" прижаты к правому краю друг под другом"""
+        x = option.rect.right() - self.button_width - self.padding
+        y = option.rect.top() + (option.rect.height() - self.button_height * 2 - 5) // 2
+        return (
+            QRect(x, y, self.button_width, self.button_height),
+            QRect(x, y + self.button_height + 5, self.button_width, self.button_height),
+        )
+
+    def _get_tags_rects(self, option, tags):
+        """Для каждого тега возвращает прямоугольник его плашки и крестика, отвязывающего тег"""
+        font_metrics = option.fontMetrics
+        x = option.rect.left() + self.padding
+        y = option.rect.bottom() - self.padding - self.TAG_HEIGHT
+        right = option.rect.right() - self.button_width - self.padding * 2
+        close_width = font_metrics.horizontalAdvance('×') + 8
+        rects = []
+        for dj_tag in tags:
+            width = font_metrics.horizontalAdvance(dj_tag.name) + 8 + close_width
+            if x + width > right:
+                break
+
+            tag_rect = QRect(x, y, width, self.TAG_HEIGHT)
+            rects.append((tag_rect, QRect(tag_rect.right() - close_width, y, close_width, self.TAG_HEIGHT)))
+            x += width + self.TAG_SPACING
+
+        return rects
+
+    def paint(self, painter, option, index):
+        # Стандартный фон строки с выделением и подсветкой, но без текста - его рисуем сами
+        option = QStyleOptionViewItem(option)
+        self.initStyleOption(option, index)
+        option.text = ''
+        widget = option.widget
+        style = widget.style() if widget else QApplication.style()
+        style.drawControl(QStyle.ControlElement.CE_ItemViewItem, option, painter, widget)
+
+        dj_file = index.data(FileRole)
+        if dj_file is None:
+            return
 
-        layout = QVBoxLayout(self)
-        # self.setStyleSheet('QVBoxLayout {border: 1px solid white;}')
-        # self.setAttribute(Qt.WidgetAttribute.WA_StyledBackground, True)
-        # self.setStyleSheet('background-color: white;')
-
-        # palette = self.palette()
-        # palette.setColor(QPalette.ColorRole.Base, QColor('blue'))
-        # self.setPalette(palette)
-        # self.setAutoFillBackground(True)
-
-        data_layout = QHBoxLayout()
-        self.lbl_filename = QLabel()
-        self.lbl_directory = QLabel()
-        descr_layout = QVBoxLayout()
-        descr_layout.addWidget(self.lbl_filename)
-        descr_layout.addWidget(self.lbl_directory)
-
-        btn_open_file = QPushButton('Open')
-        btn_open_file.clicked.connect(self.open_file)
-        btn_open_directory = QPushButton('Open')
-        btn_open_directory.clicked.connect(self.open_directory)
-        btns_layout = QVBoxLayout()
-        btns_layout.addWidget(btn_open_file)
-        btns_layout.addWidget(btn_open_directory)
-
-        data_layout.addLayout(descr_layout, stretch=1)
-        data_layout.addLayout(btns_layout)
-
-        layout.addLayout(data_layout)
-
-        self.tags_layout = QHBoxLayout()
-        self.tags_layout.setAlignment(Qt.AlignmentFlag.AlignLeft)
-        layout.addLayout(self.tags_layout)
-
-        # Фиксируем высоту одной строки для точных расчетов прокрутки
-        self.setFixedHeight(120)
-        self.widgets: QHBoxLayout = []
-        self.dj_entity = None
-    
-    def mouseDoubleClickEvent(self, event):
-        if event.button() == Qt.MouseButton.LeftButton:
-            self.signal_open_entity.emit(self.dj_entity)
-        
-        super().mouseDoubleClickEvent(event)
-
-    def update_data(self, dj_entity):
-        self.dj_entity = dj_entity
-        self.lbl_filename.setText(dj_entity.filename)
-        self.lbl_directory.setText(dj_entity.directory)
-
-        for tag_widget in self.widgets:
-           tag_widget.hide()
-
-        for tag_index, dj_tag in enumerate(dj_entity.tags.order_by('name')):
-            if tag_index < len(self.widgets):
-                tag_widget = self.widgets[tag_index]
-                tag_widget.set_data(dj_tag)
-                tag_widget.show()
-            else:
-                tag_widget = TagWidget()
-                tag_widget.unassigned.connect(self.unassign_tag)
-                tag_widget.set_data(dj_tag)
-                self.tags_layout.addWidget(tag_widget)
-                self.widgets.append(tag_widget)
-    
-    def open_directory(self):
-        open_file_with_default_program(self.dj_entity.absdirpath)
-    
-    def open_file(self):
-        open_file_with_default_program(self.dj_entity.abspath)
-
-
-# TODO: Почитать, чем это лучше QListView? Возможно, переделать на QListView
-class FilesList(QAbstractScrollArea):
-    tag_count_changed = pyqtSignal(object)
+        painter.save()
+        rect = option.rect.adjusted(self.padding, self.padding, -self.button_width - self.padding * 2, 0)
+        painter.setPen(option.palette.color(QPalette.ColorRole.Text))
+
+        # Имя файла (жирным) и директория
+        font = painter.font()
+        font.setBold(True)
+        painter.setFont(font)
+        filename = painter.fontMetrics().elidedText(dj_file.filename, Qt.TextElideMode.ElideMiddle, rect.width())
+        painter.drawText(rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, filename)
+
+        font.setBold(False)
+        painter.setFont(font)
+        directory = painter.fontMetrics().elidedText(dj_file.directory, Qt.TextElideMode.ElideMiddle, rect.width())
+        painter.drawText(rect.adjusted(0, 22, 0, 0), Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, directory)
+
+        # Теги
+        painter.setPen(option.palette.color(QPalette.ColorRole.PlaceholderText))
+        tags = index.data(TagsRole)
+        for dj_tag, (tag_rect, close_rect) in zip(tags, self._get_tags_rects(option, tags)):
+            painter.drawRoundedRect(tag_rect.adjusted(0, 0, -1, -1), 4, 4)
+            painter.drawText(tag_rect.adjusted(4, 0, -close_rect.width(), 0), Qt.AlignmentFlag.AlignVCenter, dj_tag.name)
+            painter.drawText(close_rect, Qt.AlignmentFlag.AlignCenter, '×')
+
+        # Кнопки рисуются встроенным стилем ОС, кнопка под курсором подсвечивается
+        hover_pos = widget.viewport().mapFromGlobal(QCursor.pos()) if widget else None
+        for button_rect, text in zip(self._get_buttons_rects(option), ('Открыть', 'Папка')):
+            btn_option = QStyleOptionButton()
+            btn_option.rect = button_rect
+            btn_option.text = text
+            btn_option.state = QStyle.StateFlag.State_Enabled
+            if hover_pos and button_rect.contains(hover_pos):
+                btn_option.state |= QStyle.StateFlag.State_MouseOver
+
+            style.drawControl(QStyle.ControlElement.CE_PushButton, btn_option, painter, widget)
+
+        painter.restore()
+
+    def editorEvent(self, event, model, option, index):
+        """Нажатия на нарисованные кнопки и крестики тегов"""
+        if event.type() != QEvent.Type.MouseButtonRelease or event.button() != Qt.MouseButton.LeftButton:
+            return super().editorEvent(event, model, option, index)
+
+        position = event.position().toPoint()
+        dj_file = index.data(FileRole)
+        btn_file_rect, btn_directory_rect = self._get_buttons_rects(option)
+        if btn_file_rect.contains(position):
+            self.signal_open_file.emit(dj_file)
+            return True
+        elif btn_directory_rect.contains(position):
+            self.signal_open_directory.emit(dj_file)
+            return True
+
+        tags = index.data(TagsRole)
+        for dj_tag, (_, close_rect) in zip(tags, self._get_tags_rects(option, tags)):
+            if close_rect.contains(position):
+                self.tag_unassigned.emit(index, dj_tag)
+                return True
+
+        return super().editorEvent(event, model, option, index)
+
+
+class FilesList(QListView):
+    tag_count_changed = pyqtSignal(object, int)
     signal_open_entity = pyqtSignal(object)
     signal_add_entity = pyqtSignal()
     signal_delete_entity = pyqtSignal(object)
 
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.queryset = None      # Здесь хранятся только сырые данные (хоть 100 000 элементов)
-        self.visible_widgets = [] # Список из ~20 живых виджетов
-        self.row_height = 120      # Должна совпадать с ItemWidget.setFixedHeight
-        bg_color = self.palette().color(QPalette.ColorRole.Window)
-        self.setStyleSheet('border: none;')
-        self.setStyleSheet('QAbstractScrollArea {border: initial; background-color: initial;}')
-        self.viewport().setStyleSheet(f'background-color: {bg_color.name()};')
-
-        # Контейнер, внутри которого будут физически двигаться наши 20 виджетов
-        self.viewport_container = QWidget(self.viewport())
-        
-        # Настройка скроллбаров
-        self.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOn)
-        self.verticalScrollBar().valueChanged.connect(self.update_widgets_position)
-
-    def on_open_entity(self, dj_entity):
-        self.signal_open_entity.emit(dj_entity)
-
-    def set_model(self, _, queryset):
+        # Теги файлов переживают смену запроса: после поиска часто показываются те же файлы
+        self.tags_cache = EntityTagsCache(AnyFile)
+        # Все строки одной высоты: представлению не нужно измерять каждую, чтобы расположить видимые
+        self.setUniformItemSizes(True)
+        self.setVerticalScrollMode(QListView.ScrollMode.ScrollPerPixel)
+        self.setMouseTracking(True)
+        self.setAcceptDrops(True)
+
+        delegate = FileCardDelegate(self)
+        delegate.signal_open_file.connect(lambda dj_file: open_file_with_default_program(dj_file.abspath))
+        delegate.signal_open_directory.connect(lambda dj_file: open_file_with_default_program(dj_file.absdirpath))
+        delegate.tag_unassigned.connect(self.unassign_tag)
+        self.setItemDelegate(delegate)
+        self.doubleClicked.connect(self.on_double_clicked)
+
+    def set_model(self, _, queryset, count=None, first_rows=None):
         """Загрузка данных в список"""
-        self.queryset = queryset
-        
-        # Удаляем старые виджеты, если они были
-        for w in self.visible_widgets:
-            w.deleteLater()
-
-        self.visible_widgets.clear()
-        
-        # Вычисляем, сколько виджетов помещается на экране + 2 запасных сверху/снизу
-        total_count = self.queryset.count()
-        visible_count = (self.viewport().height() // self.row_height) + 2
-        visible_count = min(visible_count, total_count)
-        
-        # Создаем минимально необходимое количество виджетов
-        for _ in range(max(20, visible_count)): # Минимум 20 для запаса при ресайзе
-            w = FileCardWidget(self.viewport_container)
-            w.tag_unassigned.connect(self.on_tag_unassigned)
-            w.tag_assigned.connect(self.on_tag_assigned)
-            w.signal_open_entity.connect(self.on_open_entity)
-            w.show()
-            self.visible_widgets.append(w)
-            
-        # Обновляем максимальное значение скроллбара
-        total_height = total_count * self.row_height
-        self.verticalScrollBar().setRange(0, max(0, total_height - self.viewport().height()))
-        self.verticalScrollBar().setPageStep(self.viewport().height())
-        
-        self.update_widgets_position()
-    
-    def on_tag_unassigned(self, dj_tag):
-        self.tag_count_changed.emit(dj_tag)
-
-    def on_tag_assigned(self, dj_tag):
-        self.tag_count_changed.emit(dj_tag)
-
-    def resizeEvent(self, event):
-        super().resizeEvent(event)
-        total_count = self.queryset.count()
-        # Пересчитываем размеры контейнера при изменении окна
-        self.viewport_container.setGeometry(0, 0, self.viewport().width(), total_count * self.row_height)
-        if total_count:
-            self.set_model(None, self.queryset) # Пересоздаем виджеты под новый размер экрана
-
-    def update_widgets_position(self):
-        """Магия переиспользования: двигает виджеты и меняет в них текст"""
-        total_count = self.queryset.count()
-        if not total_count:
-            return
-        
-        scroll_value = self.verticalScrollBar().value()
-
-        # Находим индекс первой видимой строки
-        first_visible_idx = scroll_value // self.row_height
-
-        # Смещение внутри контейнера для плавной прокрутки
-        offset = scroll_value % self.row_height  # TODO: удалить?
-        
-        # Двигаем сам контейнер вверх относительно viewport
-        self.viewport_container.move(0, -scroll_value)
-        
-        # Перераспределяем наши 20 виджетов по экрану
-        for i, widget in enumerate(self.visible_widgets):
-            current_row = first_visible_idx + i
-            if current_row < total_count:
-                # Если строка существует, наполняем виджет данными и сдвигаем его на нужное место
-                dj_file = self.queryset[current_row]
-                widget.update_data(dj_file)
-                
-                # Физически перемещаем виджет на его координату по Y
-                widget.move(0, current_row * self.row_height)
-                widget.resize(self.viewport().width(), self.row_height)
-                widget.show()
-            else:
-                # Если данные кончились (низ списка), прячем лишние виджеты
-                widget.hide()
+        old_model = self.model()
+        self.setModel(FilesListModel(queryset, count, first_rows, self.tags_cache, self))
+        if old_model:
+            old_model.deleteLater()
+
+    def refresh(self):
+        self.set_model(None, self.model().rows_window.queryset)
+
+    def on_double_clicked(self, index):
+        self.signal_open_entity.emit(index.data(FileRole))
+
+    def unassign_tag(self, index, dj_tag):
+        index.data(FileRole).tags.remove(dj_tag)
+        self.model().tags_changed(index)
+        self.tag_count_changed.emit(dj_tag, -1)
+
+    def mouseMoveEvent(self, event):
+        # Перерисовываем строку под курсором, чтобы подсветка нарисованных кнопок следовала за мышью
+        super().mouseMoveEvent(event)
+        index = self.indexAt(event.position().toPoint())
+        if index.isValid():
+            self.viewport().update(self.visualRect(index))
+
+    def dragEnterEvent(self, event):
+        if event.mimeData().hasFormat('application/x-tag-id'):
+            event.acceptProposedAction()
+        else:
+            event.ignore()
+
+    def dragMoveEvent(self, event):
+        if self.indexAt(event.position().toPoint()).isValid():
+            event.acceptProposedAction()
+        else:
+            event.ignore()
+
+    def dropEvent(self, event):
+        index = self.indexAt(event.position().toPoint())
+        dj_tag = get_dropped_tag(event.mimeData()) if index.isValid() else None
+        if dj_tag:
+            # Повторная привязка того же тега ничего не меняет, и счётчик тега тоже
+            if dj_tag not in index.data(TagsRole):
+                index.data(FileRole).tags.add(dj_tag)
+                self.model().tags_changed(index)
+                self.tag_count_changed.emit(dj_tag, 1)
+
+            event.acceptProposedAction()
+        else:
+            event.ignore()
@@ -57,5 +57,6 @@ class GUIAnyFile(GUIEntity):
     actions_class = ActionsAnyFileWidget
     field_order = 'filename'
     fields_search = ['directory', 'filename']
+    fts_table = 'mediagarden_anyfile_fts'
     table_class = FilesList
     window_class = FileWindow
\ No newline at end of file
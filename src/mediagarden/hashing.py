@@ -0,0 +1,63 @@
+import hashlib
+import mmap
+import os
+import threading
+
+SMALL_FILE_SIZE = 1024 * 1024  # файлы не больше этого размера читаются одним вызовом
+MMAP_FILE_SIZE = 64 * 1024 * 1024  # файлы не меньше этого размера хешируются через mmap
+MIN_BLOCK_SIZE = 64 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+
+_buffers = threading.local()
+
+
+def get_block_size(file_size):
+    """Подбирает размер блока так, чтобы файл читался примерно за 16 вызовов, но в пределах MIN/MAX_BLOCK_SIZE"""
+    return min(max(file_size // 16, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+
+def get_buffer(block_size):
+    """Возвращает буфер потока, переиспользуемый между файлами, чтобы не выделять память на каждый блок"""
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None or len(buffer) < block_size:
+        buffer = _buffers.buffer = bytearray(block_size)
+
+    return memoryview(buffer)[:block_size]
+
+
+def update_by_blocks(hasher, afile, file_size):
+    buffer = get_buffer(get_block_size(file_size))
+    while count_read := afile.readinto(buffer):
+        hasher.update(buffer[:count_read])
+
+
+def update_by_mmap(hasher, afile):
+    with mmap.mmap(afile.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+        if hasattr(mapped_file, 'madvise'):
+            mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+
+        hasher.update(mapped_file)
+
+
+def get_file_hash(file_path):
+    """
+    Возвращает blake2s-хеш содержимого файла.
+    Маленькие файлы читаются целиком, большие - через mmap, остальные - блоками в переиспользуемый буфер.
+    """
+    hasher = hashlib.blake2s()
+    with open(file_path, 'rb') as afile:
+        file_size = os.fstat(afile.fileno()).st_size
+        if file_size <= SMALL_FILE_SIZE:
+            hasher.update(afile.read())
+        elif file_size >= MMAP_FILE_SIZE:
+            try:
+                update_by_mmap(hasher, afile)
+            except (OSError, ValueError):  # mmap недоступен для этой файловой системы или адресного пространства
+                hasher = hashlib.blake2s()
+                afile.seek(0)
+                update_by_blocks(hasher, afile, file_size)
+        else:
+            update_by_blocks(hasher, afile, file_size)
+
+    return hasher.hexdigest()
+
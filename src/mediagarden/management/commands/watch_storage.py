@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mediagarden.scanner import LibraryStorage, STATUS_UNTOUCHED
+from mediagarden.watcher import LibraryWatcher, PollingBackend
+
+
+class Command(BaseCommand):
+    help = 'Следит за хранилищем книг и актуализирует базу без полного сканирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--polling', type=int, metavar='SECONDS',
+            help='Не использовать inotify, а обходить хранилище раз в SECONDS секунд',
+        )
+
+    def handle(self, *args, **options):
+        backend = None
+        if options['polling']:
+            backend = PollingBackend(str(settings.STORAGE_BOOKS), options['polling'])
+
+        watcher = LibraryWatcher(LibraryStorage(), func=self.print_status, backend=backend)
+        self.stdout.write(f'Слежу за {settings.STORAGE_BOOKS}, Ctrl+C - остановить')
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+
+    def print_status(self, status, inserted_anyfile, existed_anyfile):
+        if status == STATUS_UNTOUCHED:
+            return
+
+        paths = [anyfile.relpath for anyfile in (existed_anyfile, inserted_anyfile) if anyfile]
+        self.stdout.write(f'{status}: {" -> ".join(paths)}')
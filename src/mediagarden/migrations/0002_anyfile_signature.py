@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-17 10:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediagarden', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='anyfile',
+            name='device',
+            field=models.BigIntegerField(null=True, verbose_name='Устройство'),
+        ),
+        migrations.AddField(
+            model_name='anyfile',
+            name='inode',
+            field=models.BigIntegerField(null=True, verbose_name='Inode'),
+        ),
+        migrations.AddField(
+            model_name='anyfile',
+            name='mtime_ns',
+            field=models.BigIntegerField(null=True, verbose_name='Время изменения, нс'),
+        ),
+        migrations.AddField(
+            model_name='anyfile',
+            name='size',
+            field=models.BigIntegerField(null=True, verbose_name='Размер'),
+        ),
+    ]
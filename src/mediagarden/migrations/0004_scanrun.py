@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-17 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediagarden', '0002_anyfile_signature'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Начато')),
+                ('finished_at', models.DateTimeField(null=True, verbose_name='Завершено')),
+                ('is_incremental', models.BooleanField(default=True, verbose_name='Инкрементальное')),
+                ('count_scanned_files', models.PositiveIntegerField(default=0, verbose_name='Сканировано файлов')),
+                ('cursor', models.CharField(blank=True, default='', max_length=511, verbose_name='Последний сохранённый файл')),
+            ],
+            options={
+                'verbose_name': 'Сканирование',
+                'verbose_name_plural': 'Сканирования',
+            },
+        ),
+    ]
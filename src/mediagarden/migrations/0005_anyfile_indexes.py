@@ -0,0 +1,30 @@
+# Generated by Django 5.2.1 on 2026-10-17 10:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0002_tag_parent_code_idx'),
+        ('mediagarden', '0004_scanrun'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='anyfile',
+            options={'verbose_name': 'Файл', 'verbose_name_plural': 'Файлы'},
+        ),
+        migrations.AddIndex(
+            model_name='anyfile',
+            index=models.Index(fields=['filename', 'directory'], name='anyfile_filename_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='anyfile',
+            index=models.Index(fields=['directory', 'filename'], name='anyfile_path_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='anyfile',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['id'], name='anyfile_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Триграммный полнотекстовый индекс для поиска по подстроке в директории и имени файла.
+# Синхронизируется триггерами, поэтому его поддерживают любые записи в AnyFile, включая bulk_create и update().
+# Миграция, которая пересоздаёт таблицу mediagarden_anyfile (например, AlterField в SQLite), удалит триггеры,
+# и их нужно будет создать заново. Триграммный токенизатор есть в SQLite начиная с версии 3.34.
+
+from django.db import migrations
+
+CREATE_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE mediagarden_anyfile_fts USING fts5(
+        directory, filename, content='mediagarden_anyfile', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER mediagarden_anyfile_fts_insert AFTER INSERT ON mediagarden_anyfile BEGIN
+        INSERT INTO mediagarden_anyfile_fts(rowid, directory, filename) VALUES (new.id, new.directory, new.filename);
+    END
+    """,
+    """
+    CREATE TRIGGER mediagarden_anyfile_fts_delete AFTER DELETE ON mediagarden_anyfile BEGIN
+        INSERT INTO mediagarden_anyfile_fts(mediagarden_anyfile_fts, rowid, directory, filename)
+        VALUES ('delete', old.id, old.directory, old.filename);
+    END
+    """,
+    """
+    CREATE TRIGGER mediagarden_anyfile_fts_update AFTER UPDATE OF directory, filename ON mediagarden_anyfile BEGIN
+        INSERT INTO mediagarden_anyfile_fts(mediagarden_anyfile_fts, rowid, directory, filename)
+        VALUES ('delete', old.id, old.directory, old.filename);
+        INSERT INTO mediagarden_anyfile_fts(rowid, directory, filename) VALUES (new.id, new.directory, new.filename);
+    END
+    """,
+    "INSERT INTO mediagarden_anyfile_fts(mediagarden_anyfile_fts) VALUES ('rebuild')",
+]
+
+DROP_FTS_SQL = [
+    'DROP TRIGGER mediagarden_anyfile_fts_update',
+    'DROP TRIGGER mediagarden_anyfile_fts_delete',
+    'DROP TRIGGER mediagarden_anyfile_fts_insert',
+    'DROP TABLE mediagarden_anyfile_fts',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediagarden', '0005_anyfile_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_FTS_SQL, DROP_FTS_SQL),
+    ]
@@ -0,0 +1,34 @@
+# Заполняет счётчики тегов, добавленные в common.0003, по уже существующим привязкам файлов.
+# Дальше их поддерживает common.tag_counters, а пересчитать заново можно командой recount_tags.
+
+from django.db import migrations
+
+FILL_COUNTERS_SQL = [
+    """
+    UPDATE common_tag SET count_entities = (
+        SELECT COUNT(*) FROM mediagarden_anyfile_tags WHERE mediagarden_anyfile_tags.tag_id = common_tag.id
+    )
+    """,
+    """
+    UPDATE common_tag SET count_entities_in_subtree = (
+        WITH RECURSIVE subtree(id) AS (
+            SELECT common_tag.id
+            UNION ALL
+            SELECT child.id FROM common_tag AS child JOIN subtree ON child.parent_id = subtree.id
+        )
+        SELECT SUM(tag.count_entities) FROM common_tag AS tag JOIN subtree ON tag.id = subtree.id
+    )
+    """,
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('common', '0003_tag_counters'),
+        ('mediagarden', '0006_anyfile_fts'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FILL_COUNTERS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,19 @@
+# Фильтр по тегам (common.tag_tree.tagged_with) выбирает из промежуточной таблицы файлы с нужными тегами.
+# Индекс по (tag_id, anyfile_id) отдаёт идентификаторы файлов прямо из индекса, без чтения строк таблицы.
+# Промежуточную таблицу создаёт сам Django, поэтому индекс добавляется вручную.
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mediagarden', '0007_tag_counters'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX anyfile_tags_tag_anyfile_idx ON mediagarden_anyfile_tags (tag_id, anyfile_id)',
+            'DROP INDEX anyfile_tags_tag_anyfile_idx',
+        ),
+    ]
@@ -19,6 +19,11 @@ class AnyFile(models.Model):
     directory = models.CharField('Директория', max_length=255)
     filename = models.CharField('Имя файла', max_length=255)
     is_deleted = models.BooleanField('Удалён ли', default=False)
+    # Сигнатура файла на момент последнего сканирования: если она не изменилась, хеш не пересчитывается
+    size = models.BigIntegerField('Размер', null=True)
+    mtime_ns = models.BigIntegerField('Время изменения, нс', null=True)
+    inode = models.BigIntegerField('Inode', null=True)
+    device = models.BigIntegerField('Устройство', null=True)
     tags = models.ManyToManyField(Tag, related_name='files')
     # TODO: Нужны эти поля?
     mediagroup = models.IntegerField('Тип файла', choices=CHOICES_MEDIAGROUP, default=MEDIAGROUP_DOCUMENT)
@@ -49,9 +54,31 @@ class AnyFile(models.Model):
         self.filename = inserted_filename
         self.save()
 
-    class Model:
+    class Meta:
         verbose_name = 'Файл'
         verbose_name_plural = 'Файлы'
+        indexes = [
+            # Список книг сортируется по имени, а поиск идёт по имени и директории: индекс отдаёт строки
+            # уже упорядоченными, а подсчёт и фильтрация по подстроке читают только его, не всю таблицу
+            models.Index(fields=['filename', 'directory'], name='anyfile_filename_idx'),
+            # Поиск файлов по пути при синхронизации изменений из файловой системы
+            models.Index(fields=['directory', 'filename'], name='anyfile_path_idx'),
+            # Удалённых файлов мало, поэтому частичный индекс по ним крошечный
+            models.Index(fields=['id'], condition=models.Q(is_deleted=True), name='anyfile_deleted_idx'),
+        ]
+
+
+class ScanRun(models.Model):
+    """Запуск сканирования. Незавершённый запуск продолжается со своей контрольной точки при следующем сканировании"""
+    started_at = models.DateTimeField('Начато', auto_now_add=True)
+    finished_at = models.DateTimeField('Завершено', null=True)
+    is_incremental = models.BooleanField('Инкрементальное', default=True)
+    count_scanned_files = models.PositiveIntegerField('Сканировано файлов', default=0)
+    cursor = models.CharField('Последний сохранённый файл', max_length=511, blank=True, default='')
+
+    class Meta:
+        verbose_name = 'Сканирование'
+        verbose_name_plural = 'Сканирования'
 
 
 # class BaseMedia(models.Model):
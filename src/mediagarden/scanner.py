@@ -1,11 +1,21 @@
 import csv
-import hashlib
+import multiprocessing
 import os
+import threading
+from collections import deque
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from itertools import islice
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 
 from common.models import Tag
-from mediagarden.models import AnyFile
+from common.tag_counters import recount_tags
+from common.tag_tree import rebuild_tag_closure
+from mediagarden.hashing import get_file_hash
+from mediagarden.models import AnyFile, ScanRun
 
 STATUS_NEW = 'Новый'
 STATUS_MOVED = 'Переместили'
@@ -14,128 +24,545 @@ STATUS_MOVED_AND_RENAMED = 'Переместили и переименовали
 STATUS_UNTOUCHED = 'Не тронут'
 STATUS_DELETED = 'Удалён'
 STATUS_DUPLICATE = 'Дубликат'
-LIBRARY_IGNORE_EXTENSIONS = ['db', 'db-journal']
+LIBRARY_IGNORE_EXTENSIONS = ['db', 'db-journal', 'db-wal', 'db-shm']
+FILE_SIGNATURE_FIELDS = ('size', 'mtime_ns', 'inode', 'device')
 
 
-def get_file_hash(file_path):
-    BLOCKSIZE = 65536
-    hasher = hashlib.blake2s()
-    with open(file_path, 'rb') as afile:
-        buf = afile.read(BLOCKSIZE)
-        while len(buf) > 0:
-            hasher.update(buf)
-            buf = afile.read(BLOCKSIZE)
+def get_file_signature(file_stat):
+    """Возвращает сигнатуру файла, по которой определяется, изменился ли он с прошлого сканирования"""
+    # inode на некоторых файловых системах не помещается в знаковое 64-битное целое SQLite
+    return file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino & 0x7FFFFFFFFFFFFFFF, file_stat.st_dev
 
-    return hasher.hexdigest()
+
+def get_walk_key(relpath):
+    """Ключ пути относительно хранилища, по возрастанию которого walk_storage обходит файлы"""
+    return tuple(relpath.split('/'))
+
+
+def scan_directory_sorted(top, directory):
+    try:
+        return iter(sorted(os.scandir(os.path.join(top, directory)), key=lambda entry: entry.name))
+    except OSError:
+        return iter(())
+
+
+def walk_storage(top, directory=''):
+    """
+    Обходит директорию, возвращая для каждого файла кортеж: директория относительно top, имя файла, os.stat_result.
+    Если указана directory (относительно top), обходится только она.
+    Как и os.walk, не заходит в символьные ссылки на директории и пропускает недоступные директории.
+    Файлы возвращаются по возрастанию get_walk_key: каждая директория обходится целиком на месте своего имени.
+    Поэтому прерванное сканирование продолжается сравнением пути с контрольной точкой, даже если файлы
+    до неё с тех пор добавлялись или удалялись.
+    """
+    stack = [(directory, scan_directory_sorted(top, directory))]
+    while stack:
+        directory, entries = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+
+        try:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirectory = '{}/{}'.format(directory, entry.name).removeprefix('/')
+                    stack.append((subdirectory, scan_directory_sorted(top, subdirectory)))
+
+                continue
+
+            yield directory, entry.name, entry.stat()
+        except OSError:
+            continue
+
+
+def read_csv_rows(csv_paths):
+    for csv_path in csv_paths:
+        with open(csv_path, 'r', encoding='utf-8', newline='\n') as csv_file:
+            yield from csv.reader(csv_file)
+
+
+def read_csv_in_batches(csv_paths, batch_size):
+    """Читает CSV-файлы потоково, как один, возвращая строки списками не длиннее batch_size"""
+    csv_rows = read_csv_rows(csv_paths)
+    while batch_of_rows := list(islice(csv_rows, batch_size)):
+        yield batch_of_rows
+
+
+class ScanBatch:
+    """
+    Копит результаты сканирования и записывает их в базу пачкой в одной транзакции.
+    Статусы файлов сообщаются после записи, чтобы новые файлы уже имели идентификатор.
+    Флаг is_deleted переписывается только у тех файлов, у которых он действительно меняется.
+    Вместе с пачкой сохраняется контрольная точка запуска сканирования, если он передан.
+    """
+    def __init__(self, known_hashes, deleted_pks, scan_run):
+        self.known_hashes = known_hashes  # хеш -> (идентификатор, директория, имя файла) для файлов из базы
+        self.deleted_pks = deleted_pks  # файлы, отмеченные удалёнными до начала сканирования
+        self.seen_pks = set()
+        self.scan_run = scan_run
+        self.inserted_anyfiles = {}  # хеш -> AnyFile для файлов, добавленных в текущем сканировании
+        self.new_anyfiles = []
+        self.updated_anyfiles = []
+        self.undeleted_pks = []
+        self.statuses = []
+
+    def __len__(self):
+        return len(self.statuses)
+
+    def get_existed(self, file_hash):
+        existed_anyfile = self.inserted_anyfiles.get(file_hash)
+        if existed_anyfile is None and file_hash in self.known_hashes:
+            pk, directory, filename = self.known_hashes[file_hash]
+            # Незагруженные поля отложены, поэтому save() (например, в update_path) не затрёт их
+            existed_anyfile = AnyFile.from_db(
+                'default', ['id', 'hash', 'directory', 'filename'], [pk, file_hash, directory, filename],
+            )
+
+        return existed_anyfile
+
+    def mark_seen(self, pk):
+        self.seen_pks.add(pk)
+        if pk in self.deleted_pks:
+            self.undeleted_pks.append(pk)
+
+    def add_new(self, inserted_anyfile):
+        self.new_anyfiles.append(inserted_anyfile)
+        self.inserted_anyfiles[inserted_anyfile.hash] = inserted_anyfile
+
+    def flush(self, func=None):
+        with transaction.atomic():
+            AnyFile.objects.bulk_create(self.new_anyfiles)
+            AnyFile.objects.bulk_update(self.updated_anyfiles, ['is_deleted', *FILE_SIGNATURE_FIELDS])
+            AnyFile.objects.filter(pk__in=self.undeleted_pks).update(is_deleted=False)
+            if self.scan_run:
+                self.scan_run.save(update_fields=['count_scanned_files', 'cursor'])
+
+        if func:
+            for status, inserted_anyfile, existed_anyfile in self.statuses:
+                func(status, inserted_anyfile, existed_anyfile)
+
+        self.new_anyfiles.clear()
+        self.updated_anyfiles.clear()
+        self.undeleted_pks.clear()
+        self.statuses.clear()
+
+    def mark_missing_as_deleted(self, batch_size):
+        """Отмечает удалёнными файлы из базы, которые не встретились при сканировании"""
+        missing_pks = [
+            pk for pk, _, _ in self.known_hashes.values()
+            if pk not in self.seen_pks and pk not in self.deleted_pks
+        ]
+        with transaction.atomic():
+            for index in range(0, len(missing_pks), batch_size):
+                AnyFile.objects.filter(pk__in=missing_pks[index:index + batch_size]).update(is_deleted=True)
 
 
 class LibraryStorage:
     CSV_COUNT_ROWS_ON_PAGE = 100
+    CSV_IMPORT_BATCH_SIZE = 2000
+    EXPORT_CHUNK_SIZE = 2000
+    # Отрисовка страниц - чистый Python, который держит GIL, поэтому параллельно работают только процессы
+    EXPORT_EXECUTOR_CLASS = ProcessPoolExecutor
+    # Экспорт запускается из многопоточного процесса GUI: fork скопировал бы блокировки, захваченные
+    # другими потоками (Qt, Django, logging), поэтому процессы экспорта запускаются заново. Запущенный
+    # заново процесс выполняет и главный модуль программы (PyQt, django.setup()), поэтому пул живёт между экспортами
+    EXPORT_START_METHOD = 'spawn'
+    EXPORT_WORKERS = os.cpu_count() or 1
+    SCAN_BATCH_SIZE = 500
+    # blake2s и чтение файла отпускают GIL, поэтому потоки хешируют параллельно, не мешая GUI и Django
+    SCAN_EXECUTOR_CLASS = ThreadPoolExecutor
+    SCAN_HASH_WORKERS = os.cpu_count() or 1
+
+    def __init__(self):
+        self.scan_stop_event = threading.Event()
+        # Сканирование, синхронизация изменений от наблюдателя и импорт пишут в базу по очереди
+        self.db_write_lock = threading.Lock()
+        self.export_executor = None
+
+    def stop_scan(self):
+        """Прерывает сканирование после записи текущей пачки. Следующее сканирование продолжит с этого места"""
+        self.scan_stop_event.set()
 
     def scan_to_db(
             self,
             progress_count_scanned_files=None,
             progress_current_file=None,
             func=None,
+            is_incremental=True,
     ):
-        """Сканирует информацию о файлах в директории и заносит её в базу"""
-        AnyFile.objects.update(is_deleted=True)
-        os.chdir(settings.STORAGE_BOOKS)
-        total_count_files = 0
-        for directory, _, filenames in os.walk('./'):
-            directory = directory[2:]
-            if os.path.sep == '\\':
-                directory = directory.replace('\\', '/')
-
-            for filename in filenames:
-                if filename.split('.')[-1] in LIBRARY_IGNORE_EXTENSIONS:
-                    continue  # останется отмеченным как удалённый, а потому в структуру (экспорт) не попадёт
-
-                full_path = os.path.join(directory, filename)
-                if progress_current_file:
-                    progress_current_file(full_path)
-
-                file_hash = get_file_hash(full_path)
-                total_count_files += 1
-                if progress_count_scanned_files:
-                    progress_count_scanned_files(total_count_files)
-
-                inserted_anyfile = AnyFile(hash=file_hash, directory=directory, filename=filename)
-                existed_anyfile = AnyFile.objects.filter(hash=file_hash).first()
+        """
+        Сканирует информацию о файлах в директории и заносит её в базу.
+        При is_incremental=True хеш пересчитывается только для файлов, у которых изменилась сигнатура
+        (размер, время изменения, inode, устройство), остальные считаются нетронутыми.
+
+        Если предыдущее сканирование того же вида было прервано, оно продолжается: файлы до его контрольной
+        точки (пути последнего записанного файла) не перехешируются. Прерванное сканирование другого вида
+        отбрасывается: его контрольная точка не сокращает запрошенную работу.
+        Возвращает False, если сканирование прервано через stop_scan.
+        """
+        with self.db_write_lock:
+            self.scan_stop_event.clear()
+            unfinished_runs = ScanRun.objects.filter(finished_at__isnull=True)
+            unfinished_runs.exclude(is_incremental=is_incremental).delete()
+            scan_run = unfinished_runs.order_by('pk').last()
+            if scan_run is None:
+                scan_run = ScanRun.objects.create(is_incremental=is_incremental)
+
+            known_hashes = {}
+            known_signatures = {}
+            deleted_pks = set()
+            known_files = AnyFile.objects.values_list(
+                'pk', 'hash', 'directory', 'filename', 'is_deleted', *FILE_SIGNATURE_FIELDS,
+            )
+            for pk, file_hash, directory, filename, is_deleted, *signature in known_files:
+                known_hashes[file_hash] = (pk, directory, filename)
+                if is_deleted:
+                    deleted_pks.add(pk)
+                elif signature[0] is not None:
+                    known_signatures[(directory, filename)] = (pk, file_hash, tuple(signature))
+
+            os.chdir(settings.STORAGE_BOOKS)
+            total_count_files = 0
+            is_stopped = False
+            scan_batch = ScanBatch(known_hashes, deleted_pks, scan_run)
+            with self.SCAN_EXECUTOR_CLASS(max_workers=self.SCAN_HASH_WORKERS) as executor:
+                scanned_files = self.hash_files(executor, known_signatures, scan_run)
+                for directory, filename, signature, known_pk, future_hash in scanned_files:
+                    if self.scan_stop_event.is_set():
+                        is_stopped = True
+                        scanned_files.close()
+                        executor.shutdown(cancel_futures=True)
+                        break
+
+                    full_path = os.path.join(directory, filename)
+                    if progress_current_file:
+                        progress_current_file(full_path)
+
+                    file_hash = future_hash.result()
+                    total_count_files += 1
+                    if progress_count_scanned_files:
+                        progress_count_scanned_files(total_count_files)
+
+                    self.write_scanned_file(directory, filename, signature, known_pk, file_hash, scan_batch)
+                    scan_run.count_scanned_files = max(scan_run.count_scanned_files, total_count_files)
+                    scan_run.cursor = full_path
+                    if len(scan_batch) >= self.SCAN_BATCH_SIZE:
+                        scan_batch.flush(func)
+
+            scan_batch.flush(func)
+            if is_stopped:
+                return False
+
+            scan_batch.mark_missing_as_deleted(self.SCAN_BATCH_SIZE)
+            scan_run.finished_at = timezone.now()
+            scan_run.save(update_fields=['finished_at'])
+
+            for existed_anyfile in AnyFile.objects.filter(is_deleted=True):
+                if func:
+                    func(STATUS_DELETED, None, existed_anyfile)
+
+            return True
+
+    def hash_files(self, executor, known_signatures, scan_run):
+        """
+        Обходит хранилище и отдаёт файлы на хеширование в executor, держа в работе не более
+        SCAN_HASH_WORKERS * 2 файлов. Возвращает файлы в порядке обхода: директория, имя файла, сигнатура,
+        идентификатор нетронутого файла в базе (или None) и future с хешем.
+        Сохранённым в базе хешам доверяется при инкрементальном сканировании и до контрольной точки запуска.
+        """
+        pending = deque()
+        cursor_key = get_walk_key(scan_run.cursor) if scan_run.cursor else ()
+        for directory, filename, file_stat in walk_storage('.'):
+            if filename.split('.')[-1] in LIBRARY_IGNORE_EXTENSIONS:
+                continue  # останется отмеченным как удалённый, а потому в структуру (экспорт) не попадёт
+
+            signature = get_file_signature(file_stat)
+            known_pk, file_hash, known_signature = None, None, None
+            if scan_run.is_incremental or get_walk_key(os.path.join(directory, filename)) <= cursor_key:
+                known_pk, file_hash, known_signature = known_signatures.get((directory, filename), (None, None, None))
+
+            if known_signature == signature:
+                future_hash = Future()
+                future_hash.set_result(file_hash)
+            else:
+                known_pk = None
+                future_hash = executor.submit(get_file_hash, os.path.join(directory, filename))
+
+            pending.append((directory, filename, signature, known_pk, future_hash))
+            if len(pending) >= self.SCAN_HASH_WORKERS * 2:
+                yield pending.popleft()
+
+        while pending:
+            yield pending.popleft()
+
+    def write_scanned_file(self, directory, filename, signature, known_pk, file_hash, scan_batch):
+        """Определяет статус отсканированного файла и откладывает запись в базу до сброса пачки"""
+        signature_fields = dict(zip(FILE_SIGNATURE_FIELDS, signature))
+        inserted_anyfile = AnyFile(hash=file_hash, directory=directory, filename=filename, **signature_fields)
+        existed_anyfile = scan_batch.get_existed(file_hash)
+        if known_pk:
+            scan_batch.mark_seen(known_pk)
+        elif existed_anyfile is None:
+            scan_batch.add_new(inserted_anyfile)
+        elif existed_anyfile.relpath == inserted_anyfile.relpath:
+            scan_batch.seen_pks.add(existed_anyfile.pk)
+            scan_batch.updated_anyfiles.append(AnyFile(pk=existed_anyfile.pk, is_deleted=False, **signature_fields))
+        elif existed_anyfile.pk:  # иначе это дубликат файла, ещё не записанного в этом же сканировании
+            scan_batch.mark_seen(existed_anyfile.pk)
+
+        status = self.get_file_status(inserted_anyfile, existed_anyfile)
+        scan_batch.statuses.append((status, inserted_anyfile, existed_anyfile))
+
+    def sync_paths_to_db(self, paths, func=None):
+        """
+        Актуализирует в базе сведения о файлах по изменившимся путям (файлам или директориям относительно
+        хранилища), не обходя всё хранилище. Пустой путь означает всё хранилище.
+        Файл, сигнатура которого совпала с сигнатурой исчезнувшего файла, считается переименованным
+        и хешем не пересчитывается. Перемещённые и переименованные файлы сразу получают новый путь.
+        Если идёт сканирование или импорт, ждёт их окончания: сканирование сверяет файлы с базой,
+        загруженной в начале, и вставило бы повторно файл, записанный в обход него.
+        Возвращает количество статусов, о которых сообщено через func.
+        """
+        with self.db_write_lock:
+            os.chdir(settings.STORAGE_BOOKS)
+            on_disk = {}  # путь -> (директория, имя файла, сигнатура)
+            condition = Q(pk__in=[])
+            for path in paths:
+                if not path or os.path.isdir(path):
+                    for directory, filename, file_stat in walk_storage('.', path):
+                        if filename.split('.')[-1] not in LIBRARY_IGNORE_EXTENSIONS:
+                            relpath = '{}/{}'.format(directory, filename).removeprefix('/')
+                            on_disk[relpath] = (directory, filename, get_file_signature(file_stat))
+                elif os.path.isfile(path):
+                    directory, _, filename = path.rpartition('/')
+                    on_disk[path] = (directory, filename, get_file_signature(os.stat(path)))
+
+                if not path:
+                    condition = Q()
+                    break
+
+                # Путь мог быть и файлом, и директорией, которой уже нет на диске
+                directory, _, filename = path.rpartition('/')
+                condition |= Q(directory=directory, filename=filename) | Q(directory=path)
+                # startswith в SQLite превращается в LIKE, который не различает регистр ASCII: событие в Books
+                # захватило бы файлы из books. Сравнение строк через BETWEEN регистр различает
+                condition |= Q(directory__range=(f'{path}/', f'{path}/\U0010ffff'))
+
+            rows_by_path = {anyfile.relpath: anyfile for anyfile in AnyFile.objects.filter(condition, is_deleted=False)}
+            modified_anyfiles = {}  # путь -> AnyFile, у которого на том же пути изменилась сигнатура
+            changed_files = {}
+            for relpath, (directory, filename, signature) in on_disk.items():
+                existed_anyfile = rows_by_path.pop(relpath, None)
+                if existed_anyfile and existed_anyfile.size is not None:
+                    if tuple(getattr(existed_anyfile, field) for field in FILE_SIGNATURE_FIELDS) == signature:
+                        continue
+
                 if existed_anyfile:
-                    existed_anyfile.is_deleted = False
-                    existed_anyfile.save()
-                else:
-                    inserted_anyfile.save()
+                    modified_anyfiles[relpath] = existed_anyfile
+
+                changed_files[relpath] = (directory, filename, signature)
 
+            count_changes = 0
+            missing_anyfiles = rows_by_path
+            missing_by_signature = {
+                tuple(getattr(anyfile, field) for field in FILE_SIGNATURE_FIELDS): anyfile
+                for anyfile in missing_anyfiles.values() if anyfile.size is not None
+            }
+            for relpath, (directory, filename, signature) in list(changed_files.items()):
+                if relpath in modified_anyfiles or signature not in missing_by_signature:
+                    continue
+
+                existed_anyfile = missing_by_signature.pop(signature)
+                del changed_files[relpath]
+                del missing_anyfiles[existed_anyfile.relpath]
+                inserted_anyfile = AnyFile(
+                    pk=existed_anyfile.pk, hash=existed_anyfile.hash, directory=directory, filename=filename,
+                    **dict(zip(FILE_SIGNATURE_FIELDS, signature)),
+                )
                 status = self.get_file_status(inserted_anyfile, existed_anyfile)
+                self.move_anyfile(existed_anyfile, inserted_anyfile)
+                count_changes += 1
+                if func:
+                    func(status, inserted_anyfile, existed_anyfile)
+
+            hashed_files = {}
+            for relpath, (directory, filename, signature) in changed_files.items():
+                try:
+                    file_hash = get_file_hash(relpath)
+                except OSError:  # файл успели удалить или он недоступен - об этом придёт следующее событие
+                    continue
+
+                hashed_files[relpath] = (directory, filename, signature, file_hash)
+
+            known_hashes = {}
+            deleted_pks = set()
+            known_files = AnyFile.objects.filter(hash__in=[row[3] for row in hashed_files.values()]).values_list(
+                'pk', 'hash', 'directory', 'filename', 'is_deleted',
+            )
+            for pk, file_hash, directory, filename, is_deleted in known_files:
+                known_hashes[file_hash] = (pk, directory, filename)
+                if is_deleted:
+                    deleted_pks.add(pk)
+
+            scan_batch = ScanBatch(known_hashes, deleted_pks, None)
+            for directory, filename, signature, file_hash in hashed_files.values():
+                self.write_scanned_file(directory, filename, signature, None, file_hash, scan_batch)
+
+            statuses = list(scan_batch.statuses)
+            scan_batch.flush()
+            for status, inserted_anyfile, existed_anyfile in statuses:
+                if status in (STATUS_MOVED, STATUS_RENAMED, STATUS_MOVED_AND_RENAMED):
+                    self.move_anyfile(existed_anyfile, inserted_anyfile)
+
+                count_changes += 1
                 if func:
                     func(status, inserted_anyfile, existed_anyfile)
 
-        for existed_anyfile in AnyFile.objects.filter(is_deleted=True):
-            if func:
-                func(STATUS_DELETED, None, existed_anyfile)
+            # Файл исчез или на его пути теперь другое содержимое, а сам он не нашёлся в другом месте
+            deleted_anyfiles = [
+                anyfile for anyfile in missing_anyfiles.values() if anyfile.pk not in scan_batch.seen_pks
+            ] + [
+                anyfile for relpath, anyfile in modified_anyfiles.items()
+                if relpath in hashed_files and anyfile.pk not in scan_batch.seen_pks
+            ]
+            AnyFile.objects.filter(pk__in=[anyfile.pk for anyfile in deleted_anyfiles]).update(is_deleted=True)
+            for existed_anyfile in deleted_anyfiles:
+                count_changes += 1
+                if func:
+                    func(STATUS_DELETED, None, existed_anyfile)
+
+            return count_changes
+
+    def move_anyfile(self, existed_anyfile, inserted_anyfile):
+        """
+        Переносит файл базы на путь найденного файла вместе с сигнатурой, чтобы не пересчитывать хеш
+        при следующем сканировании. existed_anyfile не меняется и по-прежнему описывает прежний путь.
+        """
+        AnyFile.objects.filter(pk=existed_anyfile.pk).update(
+            directory=inserted_anyfile.directory,
+            filename=inserted_anyfile.filename,
+            **{field: getattr(inserted_anyfile, field) for field in FILE_SIGNATURE_FIELDS},
+        )
 
     def export_db(self, exporter_class, progress_count_exported_files=None) -> None:
         """
         Экспортирует из базы следующую информацию о файле:
         хэш,идентификатор,директория,имя файла
+        Строки читаются из базы потоково и делятся на страницы по CSV_COUNT_ROWS_ON_PAGE.
+        Страницы отрисовываются и записываются параллельно, в работе держится не более EXPORT_WORKERS * 2 страниц.
+        Перезаписываются только изменившиеся страницы и файлы тегов, лишние страницы прошлого экспорта удаляются.
+        Пул, отрисовывающий страницы, создаётся при первом экспорте и переиспользуется следующими.
         """
-        csv_current_page = 1
         exporter = exporter_class(settings.STORAGE_NOTES, settings.STORAGE_BOOKS)
-        exporter.open_new_page(csv_current_page)
-        number_of_last_row_on_current_page = self.CSV_COUNT_ROWS_ON_PAGE
         count_rows = AnyFile.objects.count()
-        index_of_current_row = None
-        for index_of_current_row, anyfile in enumerate(AnyFile.objects.order_by('id')):
-            number_of_last_row_on_current_page = number_of_last_row_on_current_page - anyfile.pk + 1
-            if index_of_current_row >= number_of_last_row_on_current_page:
-                exporter.close(is_last_page=index_of_current_row == count_rows - 1)
-                number_of_last_row_on_current_page += self.CSV_COUNT_ROWS_ON_PAGE
-                csv_current_page += 1
-                exporter.open_new_page(csv_current_page)
-                if progress_count_exported_files:
-                    progress_count_exported_files(index_of_current_row + 1, count_rows, csv_current_page)
-
-            exporter.write_row((anyfile.hash, anyfile.id, anyfile.directory, anyfile.filename))
-            number_of_last_row_on_current_page += anyfile.pk
-
-        if progress_count_exported_files and index_of_current_row is not None:
-            progress_count_exported_files(index_of_current_row + 1, count_rows, csv_current_page)
-
-        exporter.close(is_last_page=index_of_current_row is None or index_of_current_row == count_rows - 1)
-
-        with open(os.path.join(exporter.storage_structure, 'tags.csv'), 'w', encoding='utf-8', newline='\n') as csv_file:
-            csv_writer = csv.writer(csv_file)
-            for row in Tag.objects.values_list('pk', 'code', 'name', 'parent_id'):
-                csv_writer.writerow(row)
-
-        with open(os.path.join(exporter.storage_structure, 'tags-files.csv'), 'w', encoding='utf-8', newline='\n') as csv_file:
-            csv_writer = csv.writer(csv_file)
-            for tag in Tag.objects.all():
-                for row in tag.files.values_list('pk'):
-                    csv_writer.writerow((row[0], tag.pk))
+        rows = AnyFile.objects.order_by('id').values_list('hash', 'id', 'directory', 'filename').iterator(
+            chunk_size=self.EXPORT_CHUNK_SIZE,
+        )
+        pending = deque()
+        count_exported_rows = 0
+        manifest = exporter.load_manifest()
+        new_manifest = {}
+        last_page = 1
+        executor = self.get_export_executor()
+        try:
+            for current_page, page_rows, is_last_page in self.split_into_pages(rows):
+                count_exported_rows += len(page_rows)
+                future_page = executor.submit(
+                    exporter.write_page, current_page, page_rows, is_last_page, manifest.get(str(current_page)),
+                )
+                pending.append((future_page, count_exported_rows, current_page))
+                while pending and (len(pending) >= self.EXPORT_WORKERS * 2 or is_last_page):
+                    future_page, count_written_rows, last_page = pending.popleft()
+                    new_manifest[str(last_page)] = list(future_page.result())
+                    if progress_count_exported_files:
+                        progress_count_exported_files(count_written_rows, count_rows, last_page)
+        except BrokenExecutor:
+            # Процесс пула аварийно завершился, и пул больше не принимает задач: следующий экспорт создаст новый
+            self.export_executor = None
+            raise
+        finally:
+            # Пул не закрывается после экспорта, поэтому страницы, отправленные до ошибки, дожидаются здесь
+            wait([future_page for future_page, _, _ in pending])
+
+        exporter.remove_pages_after(last_page)
+        tags = Tag.objects.order_by('pk').values_list('pk', 'code', 'name', 'parent_id')
+        tags_files = AnyFile.tags.through.objects.order_by('tag_id', 'anyfile_id').values_list('anyfile_id', 'tag_id')
+        tags_files = tags_files.iterator(chunk_size=self.EXPORT_CHUNK_SIZE)
+        for filename, rows in (('tags.csv', tags), ('tags-files.csv', tags_files)):
+            new_manifest[filename] = list(exporter.write_csv(filename, rows, manifest.get(filename)))
+
+        if new_manifest != manifest:
+            exporter.save_manifest(new_manifest)
+
+    def get_export_executor(self):
+        if self.export_executor is None:
+            self.export_executor = self.create_export_executor()
+
+        return self.export_executor
+
+    def create_export_executor(self):
+        # С одним ядром процесс только добавил бы пересылку строк, поэтому страницы пишутся в потоке
+        if self.EXPORT_WORKERS == 1:
+            return ThreadPoolExecutor(max_workers=1)
+
+        if issubclass(self.EXPORT_EXECUTOR_CLASS, ProcessPoolExecutor):
+            mp_context = multiprocessing.get_context(self.EXPORT_START_METHOD)
+            return self.EXPORT_EXECUTOR_CLASS(max_workers=self.EXPORT_WORKERS, mp_context=mp_context)
+
+        return self.EXPORT_EXECUTOR_CLASS(max_workers=self.EXPORT_WORKERS)
+
+    def split_into_pages(self, rows):
+        """
+        Делит строки на страницы по CSV_COUNT_ROWS_ON_PAGE, возвращая номер страницы, её строки и флаг последней страницы.
+        Пустой экспорт состоит из одной пустой страницы.
+        """
+        current_page = 1
+        page_rows = list(islice(rows, self.CSV_COUNT_ROWS_ON_PAGE))
+        while True:
+            next_page_rows = list(islice(rows, self.CSV_COUNT_ROWS_ON_PAGE))
+            yield current_page, page_rows, not next_page_rows
+            if not next_page_rows:
+                break
+
+            page_rows = next_page_rows
+            current_page += 1
 
     def import_csv_to_db(self, progress_count_imported_files):
-        index_of_current_row = 0
-        for csv_filename in os.scandir(settings.STORAGE_NOTES):
-            if csv_filename.name in ('tags.csv', 'tags-files.csv'):
-                continue
+        """
+        Импортирует файлы, теги и привязки тегов из CSV-страниц, созданных экспортом в формате CSV.
+        Строки читаются потоково и вставляются через bulk_create пачками по CSV_IMPORT_BATCH_SIZE
+        в одной транзакции: при ошибке база остаётся такой, какой была до импорта.
+        """
+        with self.db_write_lock:
+            csv_paths = [
+                csv_entry.path for csv_entry in os.scandir(settings.STORAGE_NOTES)
+                if csv_entry.name.endswith('.csv') and csv_entry.name not in ('tags.csv', 'tags-files.csv')
+            ]
+            index_of_current_row = 0
+            with transaction.atomic():
+                for csv_rows in read_csv_in_batches(csv_paths, self.CSV_IMPORT_BATCH_SIZE):
+                    AnyFile.objects.bulk_create(
+                        AnyFile(pk=csv_row[1], hash=csv_row[0], directory=csv_row[2], filename=csv_row[3])
+                        for csv_row in csv_rows
+                    )
+                    index_of_current_row += len(csv_rows)
+                    progress_count_imported_files(index_of_current_row)
 
-            with open(csv_filename.path, 'r', encoding='utf-8', newline='\n') as csv_file:
-                for csv_row in csv.reader(csv_file):
-                    anyfile = AnyFile.objects.create(pk=csv_row[1], hash=csv_row[0], directory=csv_row[2], filename=csv_row[3])
-                    progress_count_imported_files(index_of_current_row := index_of_current_row + 1)
+                # Столбцы как в export_db: идентификатор, код, имя, родитель (пусто у корневых тегов)
+                for csv_rows in read_csv_in_batches([settings.STORAGE_NOTES / 'tags.csv'], self.CSV_IMPORT_BATCH_SIZE):
+                    Tag.objects.bulk_create(
+                        Tag(pk=csv_row[0], code=csv_row[1], name=csv_row[2], parent_id=csv_row[3] or None)
+                        for csv_row in csv_rows
+                    )
 
-        with open(settings.STORAGE_NOTES / 'tags.csv', 'r', encoding='utf-8', newline='\n') as csv_file:
-            for csv_row in csv.reader(csv_file):
-                Tag.objects.create(pk=csv_row[0], name=csv_row[1], parent_id=csv_row[2], code=csv_row[3])
+                TagFile = AnyFile.tags.through
+                for csv_rows in read_csv_in_batches([settings.STORAGE_NOTES / 'tags-files.csv'], self.CSV_IMPORT_BATCH_SIZE):
+                    TagFile.objects.bulk_create(TagFile(anyfile_id=csv_row[0], tag_id=csv_row[1]) for csv_row in csv_rows)
 
-        with open(settings.STORAGE_NOTES / 'tags-files.csv', 'r', encoding='utf-8', newline='\n') as csv_file:
-            for csv_row in csv.reader(csv_file):
-                anyfile = AnyFile.objects.filter(pk=csv_row[0]).first()
-                tag = Tag.objects.filter(pk=csv_row[1]).first()
-                tag.files.add(anyfile)
+                # bulk_create не вызывает сигналов, поэтому дерево тегов и счётчики строятся заново по вставленным строкам
+                rebuild_tag_closure()
+                recount_tags()
 
     def get_file_status(self, inserted_anyfile, existed_anyfile):
         if existed_anyfile is None:
@@ -0,0 +1,226 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from mediagarden.scanner import LIBRARY_IGNORE_EXTENSIONS, get_file_signature, walk_storage
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len; за ним следует имя длиной len
+
+
+class InotifyBackend:
+    """
+    Получает изменённые пути от inotify (только Linux). Следит за каждой директорией хранилища,
+    новые и перемещённые в хранилище директории берутся под наблюдение по мере появления.
+    """
+    MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self, top):
+        self.top = top
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error_code = ctypes.get_errno()
+            raise OSError(error_code, os.strerror(error_code))
+
+        self.directories = {}  # дескриптор наблюдения -> директория относительно top
+        try:
+            self.watch_directory('')
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def watch_directory(self, directory):
+        directories = [directory]
+        while directories:
+            directory = directories.pop()
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(os.path.join(self.top, directory)), self.MASK)
+            if wd < 0:
+                error_code = ctypes.get_errno()
+                if error_code == errno.ENOSPC:
+                    # Исчерпан лимит fs.inotify.max_user_watches - полноценно следить не получится
+                    raise OSError(error_code, os.strerror(error_code))
+
+                continue  # директорию успели удалить или она недоступна
+
+            self.directories[wd] = directory
+            try:
+                entries = list(os.scandir(os.path.join(self.top, directory)))
+            except OSError:
+                continue
+
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append('{}/{}'.format(directory, entry.name).removeprefix('/'))
+
+    def unwatch_directory(self, directory):
+        for wd, watched_directory in list(self.directories.items()):
+            if watched_directory == directory or watched_directory.startswith(f'{directory}/'):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.directories[wd]
+
+    def read_paths(self, timeout):
+        """Ждёт событий не дольше timeout секунд и возвращает множество изменившихся путей"""
+        paths = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return paths
+
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0'))
+                offset += INOTIFY_EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    paths.add('')  # события потеряны - нужно перепроверить всё хранилище
+                    continue
+
+                directory = self.directories.get(wd)
+                if directory is None:
+                    continue
+
+                if mask & IN_IGNORED:
+                    del self.directories[wd]
+                    continue
+
+                path = '{}/{}'.format(directory, name).removeprefix('/')
+                if mask & IN_ISDIR:
+                    if mask & IN_MOVED_FROM:
+                        self.unwatch_directory(path)
+                    elif mask & (IN_CREATE | IN_MOVED_TO):
+                        self.watch_directory(path)
+
+                paths.add(path)
+
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingBackend:
+    """
+    Находит изменённые пути, сравнивая снимки сигнатур файлов. Работает на любой системе,
+    но раз в interval секунд обходит всё хранилище (без чтения файлов).
+    """
+    def __init__(self, top, interval=10):
+        self.top = top
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+        self.last_poll_time = time.monotonic()
+
+    def take_snapshot(self):
+        return {
+            '{}/{}'.format(directory, filename).removeprefix('/'): get_file_signature(file_stat)
+            for directory, filename, file_stat in walk_storage(self.top)
+        }
+
+    def read_paths(self, timeout):
+        """Ждёт не дольше timeout секунд и, если подошло время обхода, возвращает множество изменившихся путей"""
+        time_to_poll = self.last_poll_time + self.interval - time.monotonic()
+        if time_to_poll > timeout:
+            time.sleep(timeout)
+            return set()
+
+        time.sleep(max(time_to_poll, 0))
+        snapshot = self.take_snapshot()
+        self.last_poll_time = time.monotonic()
+        paths = {path for path, signature in snapshot.items() if self.snapshot.get(path) != signature}
+        paths.update(self.snapshot.keys() - snapshot.keys())
+        self.snapshot = snapshot
+        return paths
+
+    def close(self):
+        pass
+
+
+def get_watch_backend(top):
+    """Возвращает InotifyBackend, если он доступен, иначе PollingBackend"""
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyBackend(top)
+        except (OSError, AttributeError):  # нет libc с inotify или исчерпан лимит наблюдений
+            pass
+
+    return PollingBackend(top)
+
+
+class LibraryWatcher:
+    """
+    Следит за хранилищем книг и актуализирует базу без полного сканирования.
+    Изменённые пути копятся, пока хранилище не затихнет на DEBOUNCE_SECONDS секунд, и отправляются
+    в LibraryStorage.sync_paths_to_db пачками не больше MAX_BATCH_PATHS путей, так что файл,
+    который ещё копируется, хешируется один раз, а не на каждую запись.
+    """
+    DEBOUNCE_SECONDS = 2
+    MAX_BATCH_PATHS = 200
+
+    def __init__(self, lib_storage, func=None, progress_count_synced_files=None, backend=None):
+        self.lib_storage = lib_storage
+        self.func = func
+        self.progress_count_synced_files = progress_count_synced_files
+        self.backend = backend
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        """Останавливает наблюдение в течение DEBOUNCE_SECONDS секунд; накопленные пути записываются"""
+        self.stop_event.set()
+
+    def run(self):
+        """Следит за хранилищем, пока не вызван stop()"""
+        backend = self.backend or get_watch_backend(str(settings.STORAGE_BOOKS))
+        dirty_paths = set()
+        last_change_time = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                paths = {
+                    path for path in backend.read_paths(self.DEBOUNCE_SECONDS / 2)
+                    if path.split('.')[-1] not in LIBRARY_IGNORE_EXTENSIONS
+                }
+                if paths:
+                    dirty_paths.update(paths)
+                    last_change_time = time.monotonic()
+
+                is_quiet = time.monotonic() - last_change_time >= self.DEBOUNCE_SECONDS
+                if dirty_paths and (is_quiet or len(dirty_paths) >= self.MAX_BATCH_PATHS):
+                    self.sync(dirty_paths)
+                    dirty_paths = set()
+
+            if dirty_paths:
+                self.sync(dirty_paths)
+        finally:
+            backend.close()
+
+    def sync(self, paths):
+        if '' in paths:
+            paths = {''}
+
+        paths = sorted(paths)
+        count_synced_files = 0
+        for index in range(0, len(paths), self.MAX_BATCH_PATHS):
+            count_synced_files += self.lib_storage.sync_paths_to_db(paths[index:index + self.MAX_BATCH_PATHS], self.func)
+
+        if self.progress_count_synced_files and count_synced_files:
+            self.progress_count_synced_files(count_synced_files)
@@ -31,10 +31,27 @@ if not CONFIG_PATH.exists():
         from shutil import copyfile
         copyfile(EXAMPLE_CONFIG_PATH, CONFIG_PATH)
 
+# Прагмы SQLite, выполняемые при открытии каждого соединения. WAL позволяет GUI читать базу, пока сканер пишет,
+# а synchronous=NORMAL в режиме WAL не рискует целостностью базы, лишь последними транзакциями при сбое питания.
+# Отключить профиль можно, указав в config.json "sqlite_profile": {}; режим журнала хранится в самой базе,
+# поэтому вернуть прежний можно только явно: "sqlite_profile": {"journal_mode": "DELETE"}
+DEFAULT_SQLITE_PROFILE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # отрицательное значение - в КиБ
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,  # мс
+}
+
 with CONFIG_PATH.open(encoding='utf-8') as fjson:
     data = json.load(fjson)
     STORAGE_BOOKS = Path(data['storage_books']).resolve()
     STORAGE_NOTES = Path(data['storage_notes']).resolve()
+    SQLITE_PROFILE = data.get('sqlite_profile', DEFAULT_SQLITE_PROFILE)
+    # Индекс тегов в памяти (common.tag_index): строится при запуске и показывает в дереве тегов,
+    # сколько найденных файлов останется в списке при отметке тега. Отключить: "tag_index": false
+    TAG_INDEX = data.get('tag_index', True)
 
 del data, fjson
 
@@ -99,6 +116,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': STORAGE_BOOKS / 'sqlite3.db',
+        'OPTIONS': {
+            'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PROFILE.items()),
+        },
     }
 }
 
@@ -0,0 +1,36 @@
+"""Настраивает Django для тестов, которым нужна база: миграции применяются к временной базе в памяти"""
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test import TestCase  # noqa: E402
+
+_old_database_names = []
+
+
+def create_test_database():
+    _old_database_names.append(connection.creation.create_test_db(verbosity=0, serialize=False))
+
+
+def destroy_test_database():
+    connection.creation.destroy_test_db(_old_database_names.pop(), verbosity=0)
+
+
+class DatabaseTestCase(TestCase):
+    """
+    Тесты на временной базе, создаваемой для класса тестов. Как и в любом django.test.TestCase,
+    каждый тест выполняется в транзакции, которая после него откатывается
+    """
+    @classmethod
+    def setUpClass(cls):
+        create_test_database()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        destroy_test_database()
@@ -0,0 +1,125 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from tests.database import DatabaseTestCase
+
+from common.models import Tag
+from common.tag_tree import tagged_with
+from mediagarden.exporters import CSVExporter, MarkdownExporter
+from mediagarden.models import AnyFile
+from mediagarden.scanner import LibraryStorage
+
+ANYFILE_FIELDS = ('pk', 'hash', 'directory', 'filename')
+TAG_FIELDS = ('pk', 'code', 'name', 'parent_id', 'count_entities', 'count_entities_in_subtree')
+
+
+class ExportTestCase(DatabaseTestCase):
+    """Экспорт во временную директорию, подставленную вместо хранилища заметок"""
+    def setUp(self):
+        self.notes_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(self.settings(STORAGE_NOTES=self.notes_dir, STORAGE_BOOKS=self.notes_dir / 'books'))
+        self.storage = LibraryStorage()
+        self.storage.CSV_COUNT_ROWS_ON_PAGE = 3
+        self.storage.EXPORT_WORKERS = 1
+        AnyFile.objects.bulk_create([
+            AnyFile(hash=f'{index:064x}', directory=f'раздел_{index % 2}' if index % 3 else '', filename=f'книга, {index}.pdf')
+            for index in range(1, 8)
+        ])
+        self.tag_books = Tag.objects.create(code=AnyFile.CODE, name='Книги')
+        self.tag_fiction = Tag.objects.create(code=AnyFile.CODE, name='Фантастика', parent=self.tag_books)
+        self.tag_fiction.files.add(*AnyFile.objects.filter(pk__in=[2, 5]))
+
+    def export(self, exporter_class=CSVExporter):
+        self.storage.export_db(exporter_class)
+        return {
+            entry.name: entry.stat().st_mtime_ns
+            for entry in os.scandir(self.notes_dir) if entry.is_file() and not entry.name.startswith('.')
+        }
+
+
+class ExportDbTestCase(ExportTestCase):
+    def test_csv_matches_previous_format(self):
+        """Страницы и файлы тегов побайтно совпадают с тем, что писал прежний построчный экспорт"""
+        self.export()
+        hashes = {index: f'{index:064x}' for index in range(1, 8)}
+        self.assertEqual((self.notes_dir / '1.csv').read_bytes(), (
+            f'{hashes[1]},1,раздел_1,"книга, 1.pdf"\r\n'
+            f'{hashes[2]},2,раздел_0,"книга, 2.pdf"\r\n'
+            f'{hashes[3]},3,,"книга, 3.pdf"\r\n'
+        ).encode())
+        self.assertEqual((self.notes_dir / '2.csv').read_bytes(), (
+            f'{hashes[4]},4,раздел_0,"книга, 4.pdf"\r\n'
+            f'{hashes[5]},5,раздел_1,"книга, 5.pdf"\r\n'
+            f'{hashes[6]},6,,"книга, 6.pdf"\r\n'
+        ).encode())
+        self.assertEqual((self.notes_dir / '3.csv').read_bytes(), f'{hashes[7]},7,раздел_1,"книга, 7.pdf"\r\n'.encode())
+        self.assertEqual((self.notes_dir / 'tags.csv').read_bytes(), (
+            f'{self.tag_books.pk},{AnyFile.CODE},Книги,\r\n'
+            f'{self.tag_fiction.pk},{AnyFile.CODE},Фантастика,{self.tag_books.pk}\r\n'
+        ).encode())
+
+    def test_unchanged_pages_are_not_rewritten(self):
+        for exporter_class, first_page, changed_page in (
+                (CSVExporter, '1.csv', '2.csv'), (MarkdownExporter, 'список_книг_1.md', 'список_книг_2.md'),
+        ):
+            with self.subTest(exporter_class=exporter_class.__name__):
+                mtimes = self.export(exporter_class)
+                self.assertEqual(self.export(exporter_class), mtimes)
+
+                AnyFile.objects.filter(pk=5).update(filename='книга 5.djvu')
+                new_mtimes = self.export(exporter_class)
+                self.assertEqual(new_mtimes[first_page], mtimes[first_page])
+                self.assertNotEqual(new_mtimes[changed_page], mtimes[changed_page])
+                AnyFile.objects.filter(pk=5).update(filename='книга, 5.pdf')
+
+    def test_page_edited_outside_is_rewritten(self):
+        self.export()
+        (self.notes_dir / '1.csv').write_text('изменено вручную')
+        self.export()
+        self.assertTrue((self.notes_dir / '1.csv').read_text().startswith(f'{1:064x},1,'))
+
+    def test_tail_pages_are_removed(self):
+        self.export()
+        AnyFile.objects.filter(pk__gt=4).delete()
+        self.assertEqual(sorted(name for name in self.export() if name.endswith('.csv')), ['1.csv', '2.csv', 'tags-files.csv', 'tags.csv'])
+        self.assertEqual((self.notes_dir / '2.csv').read_bytes(), f'{4:064x},4,раздел_0,"книга, 4.pdf"\r\n'.encode())
+        manifest = CSVExporter(self.notes_dir, None).load_manifest()
+        self.assertEqual(sorted(manifest), ['1', '2', 'tags-files.csv', 'tags.csv'])
+
+    def test_unchanged_tags_are_not_rewritten(self):
+        mtimes = self.export()
+        self.assertEqual((self.notes_dir / 'tags-files.csv').read_bytes(), f'2,{self.tag_fiction.pk}\r\n5,{self.tag_fiction.pk}\r\n'.encode())
+        self.assertEqual(self.export(), mtimes)
+
+        self.tag_fiction.files.add(AnyFile.objects.get(pk=7))
+        new_mtimes = self.export()
+        self.assertEqual(new_mtimes['tags.csv'], mtimes['tags.csv'])
+        self.assertNotEqual(new_mtimes['tags-files.csv'], mtimes['tags-files.csv'])
+
+    def test_executor_is_reused(self):
+        self.storage.EXPORT_WORKERS = 2
+        self.storage.EXPORT_EXECUTOR_CLASS = ThreadPoolExecutor
+        mtimes = self.export()
+        executor = self.storage.export_executor
+        self.addCleanup(executor.shutdown)
+        self.assertEqual(self.export(), mtimes)
+        self.assertIs(self.storage.export_executor, executor)
+
+    def test_round_trip(self):
+        self.tag_books.files.add(AnyFile.objects.get(pk=7))
+        rows = list(AnyFile.objects.order_by('pk').values_list(*ANYFILE_FIELDS))
+        tags = list(Tag.objects.order_by('pk').values_list(*TAG_FIELDS))
+        links = sorted(AnyFile.tags.through.objects.values_list('anyfile_id', 'tag_id'))
+        self.export()
+        Tag.objects.all().delete()
+        AnyFile.objects.all().delete()
+
+        self.storage.import_csv_to_db(lambda count_imported_files: None)
+        self.assertEqual(list(AnyFile.objects.order_by('pk').values_list(*ANYFILE_FIELDS)), rows)
+        self.assertEqual(list(Tag.objects.order_by('pk').values_list(*TAG_FIELDS)), tags)
+        self.assertEqual(sorted(AnyFile.tags.through.objects.values_list('anyfile_id', 'tag_id')), links)
+        # Дерево тегов восстановлено: фильтр по корневому тегу находит и файлы вложенного тега
+        tagged_files = AnyFile.objects.filter(tagged_with(AnyFile, [self.tag_books.pk])).order_by('pk')
+        self.assertEqual(list(tagged_files.values_list('pk', flat=True)), [2, 5, 7])
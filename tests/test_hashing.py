@@ -0,0 +1,58 @@
+import hashlib
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from mediagarden import hashing
+from mediagarden.hashing import get_file_hash
+
+
+def get_reference_hash(content):
+    """Хеш в том виде, в котором он хранился в AnyFile.hash до появления размерных порогов"""
+    hasher = hashlib.blake2s()
+    for index in range(0, len(content), 65536):
+        hasher.update(content[index:index + 65536])
+
+    return hasher.hexdigest()
+
+
+class GetFileHashTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_file(self, size):
+        content = os.urandom(size)
+        file_path = os.path.join(self.directory.name, str(size))
+        with open(file_path, 'wb') as afile:
+            afile.write(content)
+
+        return file_path, content
+
+    def check_sizes(self, sizes):
+        for size in sizes:
+            file_path, content = self.create_file(size)
+            self.assertEqual(get_reference_hash(content), get_file_hash(file_path), size)
+
+    def test_small_files(self):
+        self.check_sizes([0, 1, 4096, hashing.SMALL_FILE_SIZE])
+
+    @patch('mediagarden.hashing.SMALL_FILE_SIZE', 1024)
+    @patch('mediagarden.hashing.MIN_BLOCK_SIZE', 1000)
+    @patch('mediagarden.hashing.MAX_BLOCK_SIZE', 4000)
+    def test_block_files(self):
+        self.check_sizes([1025, 4000, 30001, 100000])
+
+    @patch('mediagarden.hashing.SMALL_FILE_SIZE', 1024)
+    @patch('mediagarden.hashing.MMAP_FILE_SIZE', 2048)
+    def test_mmap_files(self):
+        self.check_sizes([2048, 70000])
+
+    @patch('mediagarden.hashing.SMALL_FILE_SIZE', 1024)
+    @patch('mediagarden.hashing.MMAP_FILE_SIZE', 2048)
+    def test_mmap_fallback(self):
+        with patch('mediagarden.hashing.update_by_mmap', side_effect=OSError):
+            self.check_sizes([70000])
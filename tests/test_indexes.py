@@ -0,0 +1,39 @@
+from tests.database import DatabaseTestCase
+
+from django.db.models import Q
+
+from common.models import Tag
+from common.search import build_search_condition
+from mediagarden.models import AnyFile
+
+
+class IndexesTestCase(DatabaseTestCase):
+    """Проверяет по EXPLAIN QUERY PLAN, что частые запросы идут по индексам, а не полным просмотром таблиц"""
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'INDEX {index_name}', plan)
+
+    def test_files_list(self):
+        queryset = AnyFile.objects.order_by('filename')[:50]
+        self.assertUsesIndex(queryset, 'anyfile_filename_idx')
+
+    def test_files_search(self):
+        queryset = AnyFile.objects.filter(Q(directory__contains='книга') | Q(filename__contains='книга'))
+        self.assertUsesIndex(queryset.order_by('filename')[:50], 'anyfile_filename_idx')
+        # Подсчёт найденного читает только индекс, в котором есть оба столбца поиска
+        self.assertIn('COVERING INDEX', queryset.order_by().values('directory', 'filename').explain())
+
+    def test_files_search_by_fts(self):
+        condition = build_search_condition(['directory', 'filename'], 'книга', 'mediagarden_anyfile_fts')
+        self.assertIn('VIRTUAL TABLE INDEX', AnyFile.objects.filter(condition).explain())
+
+    def test_files_by_path(self):
+        self.assertUsesIndex(AnyFile.objects.filter(directory='раздел', filename='книга.pdf'), 'anyfile_path_idx')
+        self.assertUsesIndex(AnyFile.objects.filter(directory='раздел'), 'anyfile_path_idx')
+
+    def test_deleted_files(self):
+        self.assertUsesIndex(AnyFile.objects.filter(is_deleted=True), 'anyfile_deleted_idx')
+
+    def test_tags_tree_level(self):
+        self.assertUsesIndex(Tag.objects.filter(parent_id=None, code=AnyFile.CODE), 'tag_parent_code_idx')
+        self.assertUsesIndex(Tag.objects.filter(parent_id=1, code=AnyFile.CODE), 'tag_parent_code_idx')
@@ -0,0 +1,62 @@
+from tests.database import DatabaseTestCase
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from common.pagination import RowsWindow
+from mediagarden.models import AnyFile
+
+
+class RowsWindowTestCase(DatabaseTestCase):
+    def setUp(self):
+        # Одинаковые имена в разных директориях: порядок между ними задаёт только первичный ключ
+        AnyFile.objects.bulk_create([
+            AnyFile(hash=str(index), directory=f'раздел_{index}', filename=f'книга_{index % 30:02}.pdf')
+            for index in range(300)
+        ])
+        self.queryset = AnyFile.objects.order_by('filename', 'pk')
+        self.expected_ids = list(self.queryset.values_list('pk', flat=True))
+
+    def assertWindow(self, window, first, last, max_queries):
+        with CaptureQueriesContext(connection) as context:
+            rows = window.get_rows(first, last)
+
+        self.assertEqual([row.pk for row in rows], self.expected_ids[first:last])
+        self.assertLessEqual(len(context.captured_queries), max_queries)
+        return context.captured_queries
+
+    def test_scroll_down_and_up(self):
+        window = RowsWindow(self.queryset, first_rows=list(self.queryset[:50]))
+        self.assertEqual(window.count, 300)
+        self.assertWindow(window, 0, 20, max_queries=0)
+        for first in range(1, 280):
+            queries = self.assertWindow(window, first, first + 20, max_queries=1)
+            for query in queries:
+                self.assertNotIn('OFFSET', query['sql'])
+
+        for first in reversed(range(0, 280)):
+            queries = self.assertWindow(window, first, first + 20, max_queries=1)
+            for query in queries:
+                self.assertNotIn('OFFSET', query['sql'])
+
+    def test_jump(self):
+        window = RowsWindow(self.queryset)
+        self.assertWindow(window, 200, 220, max_queries=1)
+        self.assertWindow(window, 30, 50, max_queries=1)
+        self.assertWindow(window, 290, 320, max_queries=1)
+        self.assertEqual(window.get_rows(300, 320), [])
+        self.assertEqual(window.get_row(299).pk, self.expected_ids[299])
+        self.assertEqual(window.get_row(5).pk, self.expected_ids[5])
+        self.assertIsNone(window.get_row(300))
+
+    def test_descending_order(self):
+        self.queryset = AnyFile.objects.order_by('-filename', '-pk')
+        self.expected_ids = list(self.queryset.values_list('pk', flat=True))
+        window = RowsWindow(self.queryset)
+        self.assertWindow(window, 0, 20, max_queries=1)
+        self.assertWindow(window, 50, 70, max_queries=1)
+        self.assertWindow(window, 10, 30, max_queries=1)
+
+    def test_ambiguous_order_uses_offset(self):
+        window = RowsWindow(AnyFile.objects.order_by('filename'))
+        self.assertIsNone(window.order_fields)
@@ -0,0 +1,257 @@
+import os
+import tempfile
+from hashlib import blake2s
+from pathlib import Path
+from unittest import mock
+
+from tests.database import DatabaseTestCase
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from mediagarden import scanner
+from mediagarden.exporters import CSVExporter
+from mediagarden.hashing import get_file_hash
+from mediagarden.models import AnyFile, ScanRun
+from mediagarden.scanner import (
+    STATUS_DELETED, STATUS_DUPLICATE, STATUS_MOVED, STATUS_MOVED_AND_RENAMED, STATUS_NEW, STATUS_RENAMED,
+    STATUS_UNTOUCHED, LibraryStorage, get_walk_key, walk_storage,
+)
+
+ORIGIN_FS = (
+    ('file01.txt', b'content01'),
+    ('file02.txt', b'content02'),
+    ('file05.txt', b'content05'),
+    ('directory01/file03.txt', b'content03'),
+    ('directory01/file04.txt', b'content04'),
+    ('directory02/file06.txt', b'content06'),
+    ('directory02/file07.txt', b'content07'),
+    ('directory03/file08.txt', b'content08'),
+)
+# Файлы получают идентификаторы в порядке обхода хранилища
+ORIGIN_RELPATHS = sorted((relpath for relpath, _ in ORIGIN_FS), key=get_walk_key)
+
+
+class ScannerTestCase(DatabaseTestCase):
+    """Сканирование временной директории, подставленной вместо хранилища книг"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.enterContext(self.settings(STORAGE_BOOKS=Path(self.directory.name)))
+        self.cwd = os.getcwd()
+        self.storage = LibraryStorage()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def write(self, relpath, content, mtime_ns=None):
+        path = os.path.join(self.directory.name, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as afile:
+            afile.write(content)
+
+        if mtime_ns is not None:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def scan(self, **kwargs):
+        self.scanned = []
+        self.storage.scan_to_db(func=lambda *scanned_file: self.scanned.append(scanned_file), **kwargs)
+        return [(status, (inserted or existed).relpath) for status, inserted, existed in self.scanned]
+
+    def get_hashed_paths(self, **kwargs):
+        """Сканирует хранилище и возвращает пути файлов, хеш которых пришлось считать"""
+        with mock.patch.object(scanner, 'get_file_hash', wraps=scanner.get_file_hash) as get_file_hash:
+            self.assertTrue(self.storage.scan_to_db(**kwargs))
+
+        return sorted(call.args[0] for call in get_file_hash.call_args_list)
+
+    def get_anyfile(self, relpath):
+        directory, _, filename = relpath.rpartition('/')
+        return AnyFile.objects.get(directory=directory, filename=filename, is_deleted=False)
+
+
+class ScanStatusesTestCase(ScannerTestCase):
+    """Статусы файлов при повторном сканировании одного хранилища и строки базы и экспорта после него"""
+    def setUp(self):
+        super().setUp()
+        self.enterContext(self.settings(STORAGE_NOTES=Path(self.directory.name) / '.notes'))
+        for relpath, content in ORIGIN_FS:
+            self.write(relpath, content)
+
+        self.assertEqual(self.scan(), [(STATUS_NEW, relpath) for relpath in ORIGIN_RELPATHS])
+        self.origin_rows = self.get_rows()
+
+    def scan(self, **kwargs):
+        statuses = super().scan(**kwargs)
+        # Как в окне сканирования: перемещённые и переименованные файлы получают новый путь
+        for status, inserted_anyfile, existed_anyfile in self.scanned:
+            if status in (STATUS_MOVED, STATUS_RENAMED, STATUS_MOVED_AND_RENAMED):
+                existed_anyfile.update_path(inserted_anyfile.directory, inserted_anyfile.filename)
+
+        return statuses
+
+    def get_rows(self):
+        return list(AnyFile.objects.order_by('pk').values_list('hash', 'pk', 'directory', 'filename', 'is_deleted'))
+
+    def get_exported_page(self):
+        self.storage.export_db(CSVExporter)
+        with open(os.path.join(self.directory.name, '.notes', '1.csv'), encoding='utf-8') as page_file:
+            return page_file.read()
+
+    def assertStatuses(self, statuses, changed):
+        expected = {relpath: STATUS_UNTOUCHED for relpath in ORIGIN_RELPATHS}
+        expected.update(changed)
+        self.assertEqual(sorted(statuses), sorted((status, relpath) for relpath, status in expected.items() if status))
+
+    def test_first_scanning(self):
+        expected_rows = [
+            (get_file_hash(os.path.join(self.directory.name, relpath)), pk, *relpath.rpartition('/')[::2], False)
+            for pk, relpath in enumerate(ORIGIN_RELPATHS, 1)
+        ]
+        self.assertEqual(self.origin_rows, expected_rows)
+        self.assertEqual(self.get_exported_page(), ''.join(f'{h},{pk},{d},{f}\n' for h, pk, d, f, _ in expected_rows))
+
+    def test_without_changing(self):
+        self.assertStatuses(self.scan(), {})
+        self.assertEqual(self.get_rows(), self.origin_rows)
+
+    def test_delete_file(self):
+        os.remove(os.path.join(self.directory.name, 'directory01/file03.txt'))
+        self.assertStatuses(self.scan(), {'directory01/file03.txt': STATUS_DELETED})
+        rows = self.get_rows()
+        self.assertEqual(rows[0], (*self.origin_rows[0][:4], True))
+        self.assertEqual(rows[1:], self.origin_rows[1:])
+        # Удалённый файл остаётся в экспорте со своим идентификатором
+        self.assertIn(',1,directory01,file03.txt\n', self.get_exported_page())
+
+    def test_restore_file(self):
+        outside_path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'file02.txt')
+        os.rename(os.path.join(self.directory.name, 'file02.txt'), outside_path)
+        self.assertStatuses(self.scan(), {'file02.txt': STATUS_DELETED})
+        os.rename(outside_path, os.path.join(self.directory.name, 'file02.txt'))
+        self.assertStatuses(self.scan(), {})
+        self.assertEqual(self.get_rows(), self.origin_rows)
+
+    def test_add_file(self):
+        self.write('directory04/file09.txt', b'content09')
+        self.assertStatuses(self.scan(), {'directory04/file09.txt': STATUS_NEW})
+        file_hash = get_file_hash(os.path.join(self.directory.name, 'directory04/file09.txt'))
+        self.assertEqual(self.get_rows(), [*self.origin_rows, (file_hash, 9, 'directory04', 'file09.txt', False)])
+
+    def test_rename_file(self):
+        os.rename(
+            os.path.join(self.directory.name, 'directory01/file03.txt'),
+            os.path.join(self.directory.name, 'directory01/file03.txt_renamed'),
+        )
+        self.assertStatuses(self.scan(), {
+            'directory01/file03.txt': None, 'directory01/file03.txt_renamed': STATUS_RENAMED,
+        })
+        self.assertEqual(self.get_rows(), [(*self.origin_rows[0][:3], 'file03.txt_renamed', False), *self.origin_rows[1:]])
+
+    def test_move_file(self):
+        os.makedirs(os.path.join(self.directory.name, 'new_dir'))
+        os.rename(
+            os.path.join(self.directory.name, 'directory01/file03.txt'),
+            os.path.join(self.directory.name, 'new_dir/file03.txt'),
+        )
+        self.assertStatuses(self.scan(), {'directory01/file03.txt': None, 'new_dir/file03.txt': STATUS_MOVED})
+        self.assertEqual(self.get_rows(), [(*self.origin_rows[0][:2], 'new_dir', 'file03.txt', False), *self.origin_rows[1:]])
+        self.assertIn(',1,new_dir,file03.txt\n', self.get_exported_page())
+
+    def test_duplicate(self):
+        self.write('directory01111/duplicate.txt', b'content04')
+        self.assertStatuses(self.scan(), {'directory01111/duplicate.txt': STATUS_DUPLICATE})
+        self.assertEqual(self.get_rows(), self.origin_rows)
+
+
+class ScanToDbTestCase(ScannerTestCase):
+    def get_anyfile_updates(self, context):
+        table = AnyFile._meta.db_table
+        return [query['sql'] for query in context.captured_queries if query['sql'].startswith(f'UPDATE "{table}"')]
+
+    def test_deleted_files_by_set_difference(self):
+        for name in ('a', 'b', 'c'):
+            self.write(f'{name}.pdf', name.encode())
+
+        self.scan()
+        os.remove(os.path.join(self.directory.name, 'b.pdf'))
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.scan(), [
+                (STATUS_UNTOUCHED, 'a.pdf'), (STATUS_UNTOUCHED, 'c.pdf'), (STATUS_DELETED, 'b.pdf'),
+            ])
+
+        # Одним запросом отмечен только исчезнувший файл, остальные строки не переписаны
+        self.assertEqual(len(self.get_anyfile_updates(context)), 1)
+        self.assertEqual(list(AnyFile.objects.filter(is_deleted=True).values_list('filename', flat=True)), ['b.pdf'])
+
+        # Флаг ни у одного файла не меняется - строки не переписываются
+        with CaptureQueriesContext(connection) as context:
+            self.scan()
+
+        self.assertEqual(self.get_anyfile_updates(context), [])
+
+    def test_incremental_skips_unchanged_signature(self):
+        self.write('a.pdf', b'a', mtime_ns=1_000_000_000)
+        self.write('b/c.pdf', b'c', mtime_ns=1_000_000_000)
+        self.assertEqual(self.get_hashed_paths(), ['a.pdf', 'b/c.pdf'])
+        self.assertEqual(self.get_hashed_paths(), [])
+
+        # Тот же размер, другое время изменения: хеш пересчитывается
+        self.write('b/c.pdf', b'd', mtime_ns=2_000_000_000)
+        self.assertEqual(self.get_hashed_paths(), ['b/c.pdf'])
+        # Новое содержимое записано новым файлом, прежнее осталось удалённым
+        file_hashes = AnyFile.objects.filter(filename='c.pdf').order_by('pk').values_list('hash', 'is_deleted')
+        self.assertEqual(list(file_hashes), [(blake2s(b'c').hexdigest(), True), (blake2s(b'd').hexdigest(), False)])
+        self.assertEqual(self.get_hashed_paths(is_incremental=False), ['a.pdf', 'b/c.pdf'])
+
+
+class ResumeScanTestCase(ScannerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage.SCAN_BATCH_SIZE = 1
+        for relpath in ('a.txt', 'b/c.txt', 'b/d/e.txt', 'ba.txt', 'c.txt'):
+            self.write(relpath, relpath.encode())
+
+    def scan_and_stop_after(self, relpath, **kwargs):
+        def progress_current_file(current_path):
+            if current_path == relpath:
+                self.storage.stop_scan()
+
+        return self.storage.scan_to_db(progress_current_file=progress_current_file, **kwargs)
+
+    def test_walk_order(self):
+        relpaths = [os.path.join(directory, filename) for directory, filename, _ in walk_storage(self.directory.name)]
+        self.assertEqual(relpaths, ['a.txt', 'b/c.txt', 'b/d/e.txt', 'ba.txt', 'c.txt'])
+        self.assertEqual(relpaths, sorted(relpaths, key=get_walk_key))
+
+    def test_stop_keeps_unscanned_files(self):
+        self.scan()
+        os.remove(os.path.join(self.directory.name, 'c.txt'))
+        self.assertFalse(self.scan_and_stop_after('b/c.txt'))
+        # Прерванное сканирование не видело остальных файлов, но не считает их удалёнными
+        self.assertFalse(AnyFile.objects.filter(is_deleted=True).exists())
+        scan_run = ScanRun.objects.get(finished_at__isnull=True)
+        self.assertEqual((scan_run.cursor, scan_run.count_scanned_files), ('b/c.txt', 2))
+
+        self.assertEqual(self.scan(), [
+            (STATUS_UNTOUCHED, 'a.txt'), (STATUS_UNTOUCHED, 'b/c.txt'), (STATUS_UNTOUCHED, 'b/d/e.txt'),
+            (STATUS_UNTOUCHED, 'ba.txt'), (STATUS_DELETED, 'c.txt'),
+        ])
+
+    def test_resume_from_cursor(self):
+        self.scan()
+        self.assertFalse(self.scan_and_stop_after('b/d/e.txt', is_incremental=False))
+        self.assertEqual(ScanRun.objects.get(finished_at__isnull=True).cursor, 'b/d/e.txt')
+
+        # Файлы, добавленные до контрольной точки, не сдвигают её: продолжение перехеширует только файлы после неё
+        self.write('a0.txt', b'a0')
+        self.write('b/a.txt', b'b/a')
+        self.assertEqual(self.get_hashed_paths(is_incremental=False), ['a0.txt', 'b/a.txt', 'ba.txt', 'c.txt'])
+        self.assertFalse(ScanRun.objects.filter(finished_at__isnull=True).exists())
+
+    def test_resume_other_mode(self):
+        self.scan()
+        self.assertFalse(self.scan_and_stop_after('b/c.txt'))
+        # Прерванное инкрементальное сканирование не сокращает запрошенное полное
+        self.assertEqual(self.get_hashed_paths(is_incremental=False), ['a.txt', 'b/c.txt', 'b/d/e.txt', 'ba.txt', 'c.txt'])
+        self.assertEqual(list(ScanRun.objects.values_list('is_incremental', flat=True)), [True, False])
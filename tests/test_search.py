@@ -0,0 +1,45 @@
+from tests.database import DatabaseTestCase
+
+from common.search import build_search_condition
+from mediagarden.models import AnyFile
+
+FIELDS_SEARCH = ['directory', 'filename']
+FTS_TABLE = 'mediagarden_anyfile_fts'
+
+
+class SearchTestCase(DatabaseTestCase):
+    def setUp(self):
+        AnyFile.objects.bulk_create([
+            AnyFile(hash='1', directory='Физика/Теоретическая', filename='Ландау. Теория поля.pdf'),
+            AnyFile(hash='2', directory='Физика', filename='Фейнман. Лекции.djvu'),
+            AnyFile(hash='3', directory='Programming', filename='SICP.pdf'),
+        ])
+
+    def search(self, search):
+        condition = build_search_condition(FIELDS_SEARCH, search, FTS_TABLE)
+        return sorted(AnyFile.objects.filter(condition).values_list('hash', flat=True))
+
+    def test_substring_in_any_field(self):
+        self.assertEqual(self.search('теория'), ['1'])
+        self.assertEqual(self.search('ФИЗИКА'), ['1', '2'])
+        self.assertEqual(self.search('ика/Тео'), ['1'])
+        self.assertEqual(self.search('sicp'), ['3'])
+        self.assertEqual(self.search('.pdf'), ['1', '3'])
+        self.assertEqual(self.search('"кавычки"'), [])
+
+    def test_short_search_uses_like(self):
+        self.assertEqual(self.search('Фе'), ['2'])
+        self.assertEqual(self.search('pr'), ['3'])
+
+    def test_index_follows_changes(self):
+        anyfile = AnyFile.objects.get(hash='3')
+        anyfile.update_path('Алгоритмы', 'Кнут. Искусство программирования.djvu')
+        self.assertEqual(self.search('sicp'), [])
+        self.assertEqual(self.search('искусство'), ['3'])
+
+        AnyFile.objects.filter(hash='2').update(filename='Фейнман. Том 1.djvu')
+        self.assertEqual(self.search('лекции'), [])
+        self.assertEqual(self.search('том 1'), ['2'])
+
+        AnyFile.objects.filter(hash='1').delete()
+        self.assertEqual(self.search('физика'), ['2'])
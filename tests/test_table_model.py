@@ -0,0 +1,44 @@
+from tests.database import DatabaseTestCase
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from PyQt6.QtCore import Qt
+
+from common.gui_entities_list import DjangoTableModel
+from common.models import Tag
+from mediagarden.models import MEDIAGROUP_IMAGE, AnyFile
+
+
+class DjangoTableModelTestCase(DatabaseTestCase):
+    def setUp(self):
+        AnyFile.objects.bulk_create([
+            AnyFile(hash=str(index), directory='', filename=f'{index}.pdf', mediagroup=MEDIAGROUP_IMAGE)
+            for index in range(450)
+        ])
+
+    def test_fetch_in_batches(self):
+        with CaptureQueriesContext(connection) as context:
+            model = DjangoTableModel(AnyFile, ['id', 'filename', 'mediagroup'])
+
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(model.rowCount(), DjangoTableModel.BATCH_SIZE)
+        self.assertEqual(model.headerData(0, Qt.Orientation.Horizontal), 'ID')
+        self.assertEqual(model.data(model.index(0, 2)), 'Картинка')
+
+        while model.canFetchMore():
+            model.fetchMore()
+
+        self.assertEqual(model.rowCount(), 450)
+        filenames = [model.data(model.index(row, 1)) for row in range(450)]
+        self.assertEqual(filenames, list(AnyFile.objects.order_by('pk').values_list('filename', flat=True)))
+        self.assertEqual(model.get_entity(449).filename, '449.pdf')
+
+    def test_related_column_in_same_query(self):
+        parent = Tag.objects.create(code=AnyFile.CODE, name='родитель')
+        Tag.objects.bulk_create([Tag(code=AnyFile.CODE, name=str(index), parent=parent) for index in range(10)])
+        with CaptureQueriesContext(connection) as context:
+            model = DjangoTableModel(Tag, ['name', 'parent'], Tag.objects.filter(parent=parent))
+
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(model.data(model.index(0, 1)), str(parent))
+        self.assertFalse(model.canFetchMore())
@@ -0,0 +1,87 @@
+from tests.database import DatabaseTestCase
+
+from common.models import Tag
+from common.tag_counters import recount_tags
+from mediagarden.models import AnyFile
+
+
+class TagCountersTestCase(DatabaseTestCase):
+    def setUp(self):
+        AnyFile.objects.bulk_create([AnyFile(hash=str(index), directory='', filename=f'{index}.pdf') for index in range(5)])
+        self.files = list(AnyFile.objects.order_by('pk'))
+        self.tag_root = Tag.objects.create(code=AnyFile.CODE, name='Книги')
+        self.tag_child = Tag.objects.create(code=AnyFile.CODE, name='Фантастика', parent=self.tag_root)
+        self.tag_leaf = Tag.objects.create(code=AnyFile.CODE, name='Космос', parent=self.tag_child)
+
+    def assertCounts(self, dj_tag, count_entities, count_entities_in_subtree):
+        dj_tag.refresh_from_db()
+        self.assertEqual((dj_tag.count_entities, dj_tag.count_entities_in_subtree), (count_entities, count_entities_in_subtree))
+
+    def test_add_and_remove(self):
+        self.files[0].tags.add(self.tag_leaf, self.tag_root)
+        self.files[1].tags.add(self.tag_leaf)
+        self.files[1].tags.add(self.tag_leaf)
+        self.assertCounts(self.tag_leaf, 2, 2)
+        self.assertCounts(self.tag_child, 0, 2)
+        self.assertCounts(self.tag_root, 1, 3)
+
+        self.files[0].tags.remove(self.tag_leaf, self.tag_child)
+        self.assertCounts(self.tag_leaf, 1, 1)
+        self.assertCounts(self.tag_child, 0, 1)
+        self.assertCounts(self.tag_root, 1, 2)
+
+        self.files[0].tags.clear()
+        self.assertCounts(self.tag_root, 0, 1)
+
+    def test_reverse_add_and_clear(self):
+        self.tag_child.files.add(*self.files[:3])
+        self.tag_child.files.add(self.files[0])
+        self.assertCounts(self.tag_child, 3, 3)
+        self.assertCounts(self.tag_root, 0, 3)
+
+        self.tag_child.files.remove(self.files[0], self.files[4])
+        self.assertCounts(self.tag_child, 2, 2)
+
+        self.tag_child.files.clear()
+        self.assertCounts(self.tag_child, 0, 0)
+        self.assertCounts(self.tag_root, 0, 0)
+
+    def test_delete_entity_and_tag(self):
+        for anyfile in self.files:
+            anyfile.tags.add(self.tag_leaf, self.tag_child)
+
+        self.files[0].delete()
+        self.assertCounts(self.tag_leaf, 4, 4)
+        self.assertCounts(self.tag_root, 0, 8)
+
+        self.tag_leaf.delete()
+        self.assertCounts(self.tag_child, 4, 4)
+        self.assertCounts(self.tag_root, 0, 4)
+
+    def test_move_tag(self):
+        self.tag_leaf.files.add(*self.files)
+        other_root = Tag.objects.create(code=AnyFile.CODE, name='Журналы')
+        self.tag_leaf.parent = other_root
+        self.tag_leaf.save()
+        self.assertCounts(self.tag_root, 0, 0)
+        self.assertCounts(self.tag_child, 0, 0)
+        self.assertCounts(other_root, 0, 5)
+        self.assertCounts(self.tag_leaf, 5, 5)
+
+    def test_save_stale_tag(self):
+        stale_tag = Tag.objects.get(pk=self.tag_leaf.pk)
+        self.tag_leaf.files.add(*self.files[:3])
+        stale_tag.name = 'Космос и звёзды'
+        stale_tag.save()
+        self.assertCounts(self.tag_leaf, 3, 3)
+        self.assertEqual(self.tag_leaf.name, 'Космос и звёзды')
+        self.assertEqual(recount_tags(), 0)
+
+    def test_recount(self):
+        TagFile = AnyFile.tags.through
+        TagFile.objects.bulk_create(TagFile(anyfile=anyfile, tag=self.tag_leaf) for anyfile in self.files)
+        self.assertCounts(self.tag_leaf, 0, 0)
+        self.assertEqual(recount_tags(), 3)
+        self.assertCounts(self.tag_leaf, 5, 5)
+        self.assertCounts(self.tag_root, 0, 5)
+        self.assertEqual(recount_tags(), 0)
@@ -0,0 +1,137 @@
+import tempfile
+from pathlib import Path
+from unittest import TestCase
+
+from tests.database import DatabaseTestCase
+
+from common.models import Tag
+from common.tag_index import EntityIds, TagIndex
+from mediagarden.models import AnyFile
+from mediagarden.scanner import LibraryStorage
+
+
+class EntityIdsTestCase(TestCase):
+    def test_sparse_and_dense(self):
+        sparse = EntityIds.from_ids([1000, 5, 5, 70])
+        self.assertIsNone(sparse.bitmap)
+        self.assertEqual(list(sparse), [5, 70, 1000])
+        dense = EntityIds.from_ids(range(0, 1000, 3))
+        self.assertIsNone(dense.ids)
+        self.assertEqual(list(dense), list(range(0, 1000, 3)))
+        self.assertEqual(len(dense), 334)
+        self.assertIn(999, dense)
+        self.assertNotIn(998, dense)
+        self.assertNotIn(5000, dense)
+
+    def test_add_and_discard(self):
+        entity_ids = EntityIds()
+        for pk in range(0, 64, 2):
+            entity_ids.add(pk)
+            entity_ids.add(pk)
+
+        # Ключей стало больше, чем бит до наибольшего из них: массив перешёл в битовую строку
+        self.assertIsNotNone(entity_ids.bitmap)
+        entity_ids.add(100)
+        entity_ids.discard(2)
+        entity_ids.discard(2)
+        entity_ids.discard(3)
+        self.assertEqual(list(entity_ids), [0, *range(4, 64, 2), 100])
+        self.assertEqual(len(entity_ids), 32)
+
+    def test_union(self):
+        sparse = EntityIds.from_ids([5, 7000])
+        dense = EntityIds.from_ids(range(64))
+        self.assertEqual(list(EntityIds.union([sparse, EntityIds.from_ids([7, 5])])), [5, 7, 7000])
+        union = EntityIds.union([sparse, dense])
+        self.assertEqual(list(union), [*range(64), 7000])
+        # Два ключа до 7000: битовая строка заняла бы больше массива
+        self.assertIsNone(EntityIds.from_int(sparse.to_int()).bitmap)
+        self.assertEqual(union.to_int(), dense.to_int() | 1 << 7000)
+
+
+class TagIndexTestCase(DatabaseTestCase):
+    def setUp(self):
+        AnyFile.objects.bulk_create([AnyFile(hash=str(index), directory='', filename=f'{index}.pdf') for index in range(5)])
+        self.files = list(AnyFile.objects.order_by('pk'))
+        self.tag_books = Tag.objects.create(code=AnyFile.CODE, name='Книги')
+        self.tag_fiction = Tag.objects.create(code=AnyFile.CODE, name='Фантастика', parent=self.tag_books)
+        self.tag_read = Tag.objects.create(code=AnyFile.CODE, name='Прочитано')
+        self.files[0].tags.add(self.tag_books)
+        self.files[1].tags.add(self.tag_fiction, self.tag_read)
+        self.files[2].tags.add(self.tag_read)
+        self.index = TagIndex(AnyFile)
+        self.index.build()
+
+    def assertEntities(self, entity_ids, file_indexes):
+        self.assertEqual(set(entity_ids), {self.files[index].pk for index in file_indexes})
+        self.assertEqual(len(entity_ids), len(file_indexes))
+
+    def assertMatchesDatabase(self):
+        index = TagIndex(AnyFile)
+        index.build()
+        self.assertEqual(
+            {tag_id: set(entity_ids) for tag_id, entity_ids in self.index.entities.items() if entity_ids},
+            {tag_id: set(entity_ids) for tag_id, entity_ids in index.entities.items()},
+        )
+
+    def test_build(self):
+        self.assertEntities(self.index.get_entities(self.tag_books.pk), [0, 1])
+        self.assertEntities(self.index.get_entities(self.tag_books.pk, with_descendants=False), [0])
+        self.assertEntities(self.index.select([self.tag_fiction.pk, self.tag_read.pk]), [1, 2])
+
+    def test_count_if_added(self):
+        tag_ids = [self.tag_books.pk, self.tag_fiction.pk, self.tag_read.pk]
+        self.assertEqual(self.index.count_if_added([], tag_ids), {self.tag_books.pk: 2, self.tag_fiction.pk: 1, self.tag_read.pk: 2})
+        self.assertEqual(self.index.count_if_added([self.tag_fiction.pk], tag_ids)[self.tag_read.pk], 2)
+        self.assertEqual(self.index.count_if_added([self.tag_read.pk], tag_ids)[self.tag_books.pk], 3)
+
+    def test_count_if_added_to_found(self):
+        # Строка поиска нашла файлы 1, 3 и 4: отметка тега оставит в списке только найденное
+        found_ids = [self.files[index].pk for index in (1, 3, 4)]
+        tag_ids = [self.tag_books.pk, self.tag_fiction.pk, self.tag_read.pk]
+        self.assertEqual(
+            self.index.count_if_added([], tag_ids, found_ids),
+            {self.tag_books.pk: 1, self.tag_fiction.pk: 1, self.tag_read.pk: 1},
+        )
+        self.files[3].tags.add(self.tag_read)
+        self.assertEqual(self.index.count_if_added([self.tag_read.pk], tag_ids, found_ids)[self.tag_books.pk], 2)
+        self.assertEqual(self.index.count_if_added([self.tag_read.pk], tag_ids, [])[self.tag_books.pk], 0)
+
+    def test_updates(self):
+        self.files[3].tags.add(self.tag_fiction, self.tag_read)
+        self.assertEntities(self.index.get_entities(self.tag_books.pk), [0, 1, 3])
+        self.files[1].tags.remove(self.tag_fiction)
+        self.tag_read.files.remove(self.files[2])
+        self.assertMatchesDatabase()
+
+        self.tag_read.files.add(self.files[4])
+        self.files[0].tags.clear()
+        self.files[3].delete()
+        self.assertEntities(self.index.get_entities(self.tag_books.pk), [])
+        self.assertMatchesDatabase()
+
+    def test_tree_changes(self):
+        self.tag_read.parent = self.tag_books
+        self.tag_read.save()
+        self.assertEntities(self.index.get_entities(self.tag_books.pk), [0, 1, 2])
+        tag_fiction_id = self.tag_fiction.pk
+        self.tag_fiction.delete()
+        self.assertEntities(self.index.get_entities(self.tag_books.pk), [0, 1, 2])
+        self.assertNotIn(tag_fiction_id, self.index.entities)
+
+    def test_import_csv(self):
+        notes_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(self.settings(STORAGE_NOTES=notes_dir))
+        (notes_dir / '1.csv').write_text('imported,100,,100.pdf\n')
+        (notes_dir / 'tags.csv').write_text(f'200,{AnyFile.CODE},Повести,{self.tag_fiction.pk}\n')
+        (notes_dir / 'tags-files.csv').write_text(f'100,200\n100,{self.tag_read.pk}\n')
+        with self.captureOnCommitCallbacks(execute=True):
+            LibraryStorage().import_csv_to_db(lambda count_imported_files: None)
+
+        # Импорт вставляет привязки через bulk_create, без сигналов m2m_changed
+        self.assertTrue(self.index.is_outdated)
+        self.index.build()
+        self.assertFalse(self.index.is_outdated)
+        self.assertIn(100, self.index.get_entities(self.tag_books.pk))
+        self.assertEqual(self.index.count_if_added([], [self.tag_fiction.pk])[self.tag_fiction.pk], 2)
+        self.assertMatchesDatabase()
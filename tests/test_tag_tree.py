@@ -0,0 +1,63 @@
+from tests.database import DatabaseTestCase
+
+from common.models import Tag, TagClosure
+from common.tag_tree import rebuild_tag_closure, tagged_with
+from mediagarden.models import AnyFile
+
+
+class TagTreeTestCase(DatabaseTestCase):
+    def setUp(self):
+        AnyFile.objects.bulk_create([AnyFile(hash=str(index), directory='', filename=f'{index}.pdf') for index in range(4)])
+        self.files = list(AnyFile.objects.order_by('pk'))
+        self.tag_books = Tag.objects.create(code=AnyFile.CODE, name='Книги')
+        self.tag_fiction = Tag.objects.create(code=AnyFile.CODE, name='Фантастика', parent=self.tag_books)
+        self.tag_space = Tag.objects.create(code=AnyFile.CODE, name='Космос', parent=self.tag_fiction)
+        self.tag_read = Tag.objects.create(code=AnyFile.CODE, name='Прочитано')
+        self.files[0].tags.add(self.tag_books)
+        self.files[1].tags.add(self.tag_space, self.tag_fiction, self.tag_read)
+        self.files[2].tags.add(self.tag_read)
+
+    def assertFiles(self, condition, file_indexes):
+        queryset = AnyFile.objects.filter(condition).order_by('pk')
+        self.assertEqual(list(queryset), [self.files[index] for index in file_indexes])
+        self.assertEqual(queryset.count(), len(file_indexes))
+
+    def get_links(self):
+        return set(TagClosure.objects.values_list('ancestor__name', 'descendant__name', 'depth'))
+
+    def test_descendants(self):
+        self.assertFiles(tagged_with(AnyFile, [self.tag_books.pk]), [0, 1])
+        self.assertFiles(tagged_with(AnyFile, [self.tag_books.pk], with_descendants=False), [0])
+        self.assertFiles(tagged_with(AnyFile, [self.tag_fiction.pk, self.tag_read.pk]), [1, 2])
+
+    def test_algebra(self):
+        books = tagged_with(AnyFile, [self.tag_books.pk])
+        read = tagged_with(AnyFile, [self.tag_read.pk])
+        self.assertFiles(books & read, [1])
+        self.assertFiles(books | read, [0, 1, 2])
+        self.assertFiles(books & ~read, [0])
+        self.assertFiles(~books & ~read, [3])
+
+    def test_move_and_delete(self):
+        self.tag_fiction.parent = self.tag_read
+        self.tag_fiction.save()
+        self.assertFiles(tagged_with(AnyFile, [self.tag_books.pk]), [0])
+        self.assertIn(('Прочитано', 'Космос', 2), self.get_links())
+        self.assertNotIn(('Книги', 'Космос', 2), self.get_links())
+
+        self.tag_books.parent = self.tag_space
+        self.tag_books.save()
+        self.assertIn(('Прочитано', 'Книги', 3), self.get_links())
+
+        self.tag_read.parent = self.tag_books
+        with self.assertRaises(ValueError):
+            self.tag_read.save()
+
+        self.tag_fiction.delete()
+        self.assertEqual(self.get_links(), {('Прочитано', 'Прочитано', 0)})
+
+    def test_rebuild(self):
+        links = self.get_links()
+        TagClosure.objects.all().delete()
+        rebuild_tag_closure()
+        self.assertEqual(self.get_links(), links)
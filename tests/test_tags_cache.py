@@ -0,0 +1,47 @@
+from tests.database import DatabaseTestCase
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from common.models import Tag
+from common.tags_cache import EntityTagsCache
+from mediagarden.models import AnyFile
+
+
+class EntityTagsCacheTestCase(DatabaseTestCase):
+    def setUp(self):
+        AnyFile.objects.bulk_create([AnyFile(hash=str(index), directory='', filename=f'{index}.pdf') for index in range(30)])
+        self.files = list(AnyFile.objects.order_by('pk'))
+        self.tag_b = Tag.objects.create(code=AnyFile.CODE, name='Б')
+        self.tag_a = Tag.objects.create(code=AnyFile.CODE, name='А')
+        for anyfile in self.files[::2]:
+            anyfile.tags.add(self.tag_b, self.tag_a)
+
+    def test_prefetch_in_one_query(self):
+        cache = EntityTagsCache(AnyFile)
+        with CaptureQueriesContext(connection) as context:
+            cache.prefetch(self.files)
+            cache.prefetch(self.files[:10])
+            tags = [cache.get(anyfile) for anyfile in self.files]
+
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual([dj_tag.name for dj_tag in tags[0]], ['А', 'Б'])
+        self.assertEqual(tags[1], [])
+
+    def test_invalidate(self):
+        cache = EntityTagsCache(AnyFile)
+        anyfile = self.files[1]
+        self.assertEqual(cache.get(anyfile), [])
+        anyfile.tags.add(self.tag_a)
+        cache.invalidate(anyfile.pk)
+        self.assertEqual(cache.get(anyfile), [self.tag_a])
+
+    def test_least_recently_used_are_evicted(self):
+        cache = EntityTagsCache(AnyFile)
+        cache.MAX_SIZE = 10
+        cache.prefetch(self.files[:10])
+        cache.prefetch(self.files[:1])
+        cache.prefetch(self.files[10:15])
+        self.assertEqual(len(cache.tags), 10)
+        self.assertIn(self.files[0].pk, cache.tags)
+        self.assertNotIn(self.files[1].pk, cache.tags)
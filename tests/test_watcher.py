@@ -0,0 +1,152 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+from tests.test_scanner import ScannerTestCase
+
+from mediagarden import scanner
+from mediagarden.models import AnyFile
+from mediagarden.scanner import STATUS_DELETED, STATUS_MOVED, STATUS_NEW, STATUS_RENAMED
+from mediagarden.watcher import InotifyBackend, LibraryWatcher, PollingBackend
+
+
+class ListBackend:
+    """Отдаёт заранее заданные пачки путей, а когда они кончаются, останавливает наблюдение"""
+    def __init__(self, watcher, batches):
+        self.watcher = watcher
+        self.batches = list(batches)
+        self.is_closed = False
+
+    def read_paths(self, timeout):
+        if self.batches:
+            return self.batches.pop(0)
+
+        self.watcher.stop()
+        return set()
+
+    def close(self):
+        self.is_closed = True
+
+
+class WatcherTestCase(ScannerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.write('a.pdf', b'a', mtime_ns=1_000_000_000)
+        self.write('x/b.pdf', b'b', mtime_ns=1_000_000_000)
+        self.scan()
+        self.origin = {anyfile.relpath: anyfile for anyfile in AnyFile.objects.all()}
+
+    def path(self, relpath):
+        return os.path.join(self.directory.name, relpath)
+
+    def sync(self, paths):
+        """Синхронизирует пути и возвращает статусы и пути файлов, хеш которых пришлось считать"""
+        statuses = []
+        with mock.patch.object(scanner, 'get_file_hash', wraps=scanner.get_file_hash) as get_file_hash:
+            self.storage.sync_paths_to_db(paths, lambda status, inserted, existed: statuses.append(
+                (status, (inserted or existed).relpath),
+            ))
+
+        return statuses, sorted(call.args[0] for call in get_file_hash.call_args_list)
+
+
+class SyncPathsToDbTestCase(WatcherTestCase):
+    def test_rename_without_rehash(self):
+        os.rename(self.path('a.pdf'), self.path('c.pdf'))
+        self.assertEqual(self.sync(['a.pdf', 'c.pdf']), ([(STATUS_RENAMED, 'c.pdf')], []))
+        anyfile = self.get_anyfile('c.pdf')
+        self.assertEqual((anyfile.pk, anyfile.hash), (self.origin['a.pdf'].pk, self.origin['a.pdf'].hash))
+        self.assertFalse(AnyFile.objects.filter(filename='a.pdf').exists())
+
+    def test_move_directory(self):
+        os.rename(self.path('x'), self.path('y'))
+        self.assertEqual(self.sync(['x', 'y']), ([(STATUS_MOVED, 'y/b.pdf')], []))
+        self.assertEqual(self.get_anyfile('y/b.pdf').pk, self.origin['x/b.pdf'].pk)
+
+    def test_modify(self):
+        self.write('a.pdf', b'd', mtime_ns=2_000_000_000)
+        self.assertEqual(self.sync(['a.pdf']), ([(STATUS_NEW, 'a.pdf'), (STATUS_DELETED, 'a.pdf')], ['a.pdf']))
+        self.assertTrue(AnyFile.objects.get(pk=self.origin['a.pdf'].pk).is_deleted)
+        self.assertNotEqual(self.get_anyfile('a.pdf').hash, self.origin['a.pdf'].hash)
+
+    def test_delete(self):
+        os.remove(self.path('x/b.pdf'))
+        self.assertEqual(self.sync(['x/b.pdf']), ([(STATUS_DELETED, 'x/b.pdf')], []))
+        self.assertTrue(AnyFile.objects.get(pk=self.origin['x/b.pdf'].pk).is_deleted)
+        # Повторное событие по тому же пути ничего не меняет
+        self.assertEqual(self.sync(['x/b.pdf']), ([], []))
+
+    def test_directories_differing_in_case(self):
+        self.write('x/y/c.pdf', b'c')
+        self.assertEqual(self.sync(['x/y/c.pdf']), ([(STATUS_NEW, 'x/y/c.pdf')], ['x/y/c.pdf']))
+        # Событие в X не затрагивает файлы из x, даже вложенные
+        self.write('X/y/d.pdf', b'd')
+        self.assertEqual(self.sync(['X']), ([(STATUS_NEW, 'X/y/d.pdf')], ['X/y/d.pdf']))
+        os.remove(self.path('X/y/d.pdf'))
+        self.assertEqual(self.sync(['X']), ([(STATUS_DELETED, 'X/y/d.pdf')], []))
+        self.assertFalse(self.get_anyfile('x/y/c.pdf').is_deleted)
+
+    def test_holds_write_lock(self):
+        # Сканирование и синхронизация пишут в базу, только захватив общую блокировку хранилища
+        self.write('c.pdf', b'c')
+        is_locked = []
+        self.storage.scan_to_db(progress_current_file=lambda path: is_locked.append(self.storage.db_write_lock.locked()))
+        self.write('d.pdf', b'd')
+        self.storage.sync_paths_to_db(['d.pdf'], lambda *args: is_locked.append(self.storage.db_write_lock.locked()))
+        self.assertEqual(is_locked, [True] * 4)
+        self.assertFalse(self.storage.db_write_lock.locked())
+
+
+class LibraryWatcherTestCase(WatcherTestCase):
+    def test_run(self):
+        synced_counts = []
+        watcher = LibraryWatcher(self.storage, progress_count_synced_files=synced_counts.append)
+        # Хранилище не затихает до остановки: все пути копятся и синхронизируются одной пачкой
+        watcher.DEBOUNCE_SECONDS = 60
+        os.rename(self.path('a.pdf'), self.path('c.pdf'))
+        self.write('x/b.pdf', b'e', mtime_ns=2_000_000_000)
+        os.remove(self.path('x/b.pdf'))
+        self.write('x/sqlite3.db', b'')
+        watcher.backend = ListBackend(watcher, [{'a.pdf', 'x/sqlite3.db'}, {'c.pdf'}, {'x/b.pdf'}])
+        watcher.run()
+        self.assertTrue(watcher.backend.is_closed)
+        self.assertEqual(synced_counts, [2])
+        self.assertEqual(list(AnyFile.objects.order_by('pk').values_list('filename', 'is_deleted')), [
+            ('c.pdf', False), ('b.pdf', True),
+        ])
+
+
+class PollingBackendTestCase(WatcherTestCase):
+    def test_read_paths(self):
+        backend = PollingBackend(self.directory.name, interval=0)
+        os.rename(self.path('a.pdf'), self.path('c.pdf'))
+        self.write('x/b.pdf', b'f', mtime_ns=2_000_000_000)
+        self.write('x/d.pdf', b'd')
+        self.assertEqual(backend.read_paths(0), {'a.pdf', 'c.pdf', 'x/b.pdf', 'x/d.pdf'})
+        self.assertEqual(backend.read_paths(0), set())
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify есть только в Linux')
+class InotifyBackendTestCase(WatcherTestCase):
+    def setUp(self):
+        super().setUp()
+        self.backend = InotifyBackend(self.directory.name)
+        self.addCleanup(self.backend.close)
+
+    def test_read_paths(self):
+        os.rename(self.path('a.pdf'), self.path('c.pdf'))
+        self.write('x/d.pdf', b'd')
+        os.remove(self.path('x/b.pdf'))
+        self.assertEqual(self.backend.read_paths(1), {'a.pdf', 'c.pdf', 'x/b.pdf', 'x/d.pdf'})
+
+    def test_new_and_moved_directories(self):
+        os.mkdir(self.path('z'))
+        self.assertEqual(self.backend.read_paths(1), {'z'})
+        self.write('z/e.pdf', b'e')
+        self.assertEqual(self.backend.read_paths(1), {'z/e.pdf'})
+
+        os.rename(self.path('x'), self.path('y'))
+        self.assertEqual(self.backend.read_paths(1), {'x', 'y'})
+        self.write('y/f.pdf', b'f')
+        self.assertEqual(self.backend.read_paths(1), {'y/f.pdf'})